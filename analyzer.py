@@ -0,0 +1,581 @@
+# analyzer.py
+import abc
+import heapq
+import ipaddress
+import logging
+import math
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from ip_index import IPIndex, aggregate_ips, parse_interval
+from ratelimit import BURST_KEY, EXPECTED_KEYS_KEY, REQUESTS_PER_MINUTE_KEY
+from ruleset import RuleSpec, Ruleset
+from simulator import LogRecord, Simulator
+from sketches import (DEFAULT_CMS_DEPTH, DEFAULT_CMS_WIDTH, DEFAULT_HEAVY_HITTERS, HeavyHitters, HyperLogLog,
+                      KLLSketch, hash64)
+
+# Length of the windows peak request rates are measured over
+DEFAULT_WINDOW_SECONDS = 60
+
+# Peak rate above which a client address is proposed for the blacklist
+DEFAULT_THRESHOLD_RPM = 600
+
+# Longer keys (e.g., User-Agents) are shortened in text reports
+MAX_KEY_WIDTH = 80
+
+# Significant digits of recommended expected_keys values (rounded up)
+EXPECTED_KEYS_DIGITS = 2
+
+# Percentile of key windows the recommended limits leave unlimited
+DEFAULT_PERCENTILE = 99.9
+
+logger = logging.getLogger(__name__)
+
+class KeyCounter:
+    """
+    Heavy hitters of one key kind (client address, User-Agent or a header).
+
+    Tracks the keys with the most requests over the whole log and, per
+    window, the keys with the most requests in that window. At the end of
+    every window each tracked key's count is kept as its peak if higher;
+    only the highest peaks are retained, so memory stays fixed.
+    """
+
+    __slots__ = ('extract', 'capacity', 'totals', 'window', 'peaks')
+
+    def __init__(self, extract: Callable[[LogRecord], str], capacity: int = DEFAULT_HEAVY_HITTERS,
+                 width: int = DEFAULT_CMS_WIDTH, depth: int = DEFAULT_CMS_DEPTH):
+        """
+        Args:
+            extract: Returns the key of a record, empty if it has none.
+            capacity: Keys tracked for totals, per window and for peaks.
+            width: Count-Min sketch width.
+            depth: Count-Min sketch depth.
+        """
+        self.extract = extract
+        self.capacity = capacity
+        self.totals = HeavyHitters(capacity, width, depth)
+        self.window = HeavyHitters(capacity, width, depth)
+        self.peaks: Dict[str, int] = {}
+
+    def add(self, key: str, value: int) -> None:
+        """
+        Counts a key.
+
+        Args:
+            key: The key.
+            value: The key's hash64.
+        """
+        # Both sketches have the same dimensions, so they share the key's cells
+        cells = self.totals.sketch.cells(value)
+        self.totals.add(key, 1, cells)
+        self.window.add(key, 1, cells)
+
+    def close_window(self) -> None:
+        """
+        Folds the current window into the peaks and starts a new one.
+        """
+        peaks = self.peaks
+        for key, count in self.window.counts.items():
+            if count > peaks.get(key, 0):
+                peaks[key] = count
+        if len(peaks) > 2 * self.capacity:
+            self.peaks = dict(heapq.nlargest(self.capacity, peaks.items(), key=lambda item: item[1]))
+        if self.window.counts:
+            self.window.clear()
+
+class RuleTracker(abc.ABC):
+    """
+    Base of the per-rule statistics, gathered over tumbling windows.
+
+    Windows tumble every window_seconds of the rule, the period its limits
+    apply over and its limiter state must hold every active key for.
+    Subclasses count the keys of a window in _count and fold the window
+    into their statistics in _fold.
+    """
+
+    __slots__ = ('rule', 'kind', 'window_ms', '_window_end')
+
+    def __init__(self, rule: RuleSpec):
+        """
+        Args:
+            rule: The compiled rule.
+        """
+        self.rule = rule
+        self.kind = key_kind(rule)
+        self.window_ms = rule.window_seconds * 1000
+        self._window_end: Optional[int] = None
+
+    def add(self, now: int, value: int) -> None:
+        """
+        Counts the key of a request the rule applies to.
+
+        Args:
+            now: The request time, in milliseconds.
+            value: The key's hash64.
+        """
+        if self._window_end is None or now >= self._window_end:
+            # Late records fall into the current window
+            self.close_window()
+            self._window_end = now - now % self.window_ms + self.window_ms
+        self._count(now, value)
+
+    def close_window(self) -> None:
+        """
+        Folds the current window into the statistics and starts a new one.
+        """
+        if self._window_end is not None:
+            self._fold()
+
+    @abc.abstractmethod
+    def _count(self, now: int, value: int) -> None:
+        """
+        Counts a key in the current window.
+        """
+
+    @abc.abstractmethod
+    def _fold(self) -> None:
+        """
+        Folds the current window into the statistics and clears it.
+        """
+
+class RuleCardinality(RuleTracker):
+    """
+    Distinct keys a rule tracks per window, counted with HyperLogLog sketches.
+
+    Each window's count is folded into the peak and mean, and its sketch
+    into the total over the log.
+    """
+
+    __slots__ = ('current', 'total', 'peak', 'windows', 'window_sum')
+
+    def __init__(self, rule: RuleSpec):
+        """
+        Args:
+            rule: The compiled rule.
+        """
+        super().__init__(rule)
+        self.current = HyperLogLog()
+        self.total = HyperLogLog()
+        self.peak = 0
+        self.windows = 0
+        self.window_sum = 0
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Returns the rule's key counts and the expected_keys they call for.
+        """
+        return {
+            'rule': self.rule.name,
+            'limit_by': self.kind,
+            'window': self.rule.window_seconds,
+            'peak_keys': self.peak,
+            'mean_keys': round(self.window_sum / self.windows, 1) if self.windows else 0.0,
+            'total_keys': self.total.estimate(),
+            'expected_keys': self.rule.expected_keys,
+            'recommended_expected_keys': round_up(self.peak, EXPECTED_KEYS_DIGITS) if self.peak else None,
+        }
+
+    def _count(self, now: int, value: int) -> None:
+        self.current.add(value)
+
+    def _fold(self) -> None:
+        distinct = self.current.estimate()
+        if distinct:
+            self.peak = max(self.peak, distinct)
+            self.windows += 1
+            self.window_sum += distinct
+            self.total.merge(self.current)
+            self.current.clear()
+
+class RuleRates(RuleTracker):
+    """
+    Request rate distribution of the keys of a rule, in KLL quantile sketches.
+
+    Every key active in a window yields two samples: its request count over
+    the window, which requests_per_minute limits, and the most requests it
+    sent within one second, which burst has to absorb. Only the keys of the
+    current window are held exactly, so memory follows the rule's peak
+    distinct keys rather than the length of the log.
+    """
+
+    __slots__ = ('counts', 'rates', 'bursts')
+
+    def __init__(self, rule: RuleSpec):
+        """
+        Args:
+            rule: The compiled rule.
+        """
+        super().__init__(rule)
+        # hash64 of the key -> [requests, current second, requests in it, peak requests in a second]
+        self.counts: Dict[int, List[int]] = {}
+        self.rates = KLLSketch()
+        self.bursts = KLLSketch()
+
+    def report(self, percentile: float) -> Dict[str, Any]:
+        """
+        Returns the limits that would leave a percentile of the key windows unlimited.
+
+        The recommended burst is the per-second peak at the percentile, less
+        the request a key is admitted without burst. It ignores the rate
+        draining within that second, so it errs on the generous side.
+
+        Args:
+            percentile: The percentile, from 0 to 100 (e.g., 99.9).
+
+        Returns:
+            The rule's configured and recommended requests_per_minute and burst.
+        """
+        rate = self.rates.quantile(percentile / 100)
+        burst = self.bursts.quantile(percentile / 100)
+        return {
+            'rule': self.rule.name,
+            'limit_by': self.kind,
+            'window': self.rule.window_seconds,
+            'key_windows': self.rates.count,
+            'requests_per_minute': self.rule.requests_per_minute,
+            'burst': self.rule.burst,
+            'recommended_requests_per_minute': max(1, int(math.ceil(rate))) if rate is not None else None,
+            'recommended_burst': max(0, int(math.ceil(burst)) - 1) if burst is not None else None,
+        }
+
+    def _count(self, now: int, value: int) -> None:
+        second = now // 1000
+        state = self.counts.get(value)
+        if state is None:
+            self.counts[value] = [1, second, 1, 1]
+            return
+        state[0] += 1
+        if state[1] == second:
+            state[2] += 1
+            if state[2] > state[3]:
+                state[3] = state[2]
+        else:
+            state[1] = second
+            state[2] = 1
+
+    def _fold(self) -> None:
+        for requests, _, _, peak in self.counts.values():
+            self.rates.add(requests)
+            self.bursts.add(peak)
+        self.counts = {}
+
+class LogAnalyzer:
+    """
+    Finds the heaviest clients of an access log in fixed memory.
+
+    Client addresses, User-Agents and the value of every header a rule
+    limits by are counted with Count-Min sketches. Top-k heaps keep the
+    keys with the most requests overall, and the keys with the highest
+    peak rate within a window. Requests are also routed through the rules
+    like the simulator does. Per rule, HyperLogLog sketches count the
+    distinct keys tracked per window, which sizes its limiter state, and KLL
+    sketches hold the distribution of per-key rates, which sets its limits.
+    """
+
+    def __init__(self, ruleset: Ruleset, capacity: int = DEFAULT_HEAVY_HITTERS,
+                 window_seconds: int = DEFAULT_WINDOW_SECONDS, percentile: float = DEFAULT_PERCENTILE):
+        """
+        Args:
+            ruleset: The compiled Ruleset; its header rules select the headers to analyze.
+            capacity: Keys tracked per kind.
+            window_seconds: Length of the windows peak rates are measured over.
+            percentile: Percentile of key windows the recommended limits leave unlimited.
+        """
+        self.ruleset = ruleset
+        self.window_ms = window_seconds * 1000
+        self.percentile = percentile
+        self.counters: Dict[str, KeyCounter] = {
+            'ip': KeyCounter(lambda record: record.ip, capacity),
+            'user_agent': KeyCounter(lambda record: record.user_agent, capacity),
+        }
+        for header in limit_by_headers(ruleset):
+            self.counters[f'header:{header}'] = KeyCounter(lambda record, name=header: record.headers.get(name, ''),
+                                                           capacity)
+        # Routes requests like a replay that evaluates no model
+        self.router = Simulator(ruleset, ())
+        self.rule_trackers: Dict[str, Tuple[RuleCardinality, RuleRates]] = {
+            rule.name: (RuleCardinality(rule), RuleRates(rule))
+            for rule in ([ruleset.global_rule] if ruleset.global_rule else []) + list(ruleset.paths)
+        }
+        self._global_trackers = self.rule_trackers[ruleset.global_rule.name] if ruleset.global_rule else ()
+        self.records = 0
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self._window_end: Optional[int] = None
+
+    def feed(self, record: LogRecord) -> None:
+        """
+        Counts one record.
+
+        Args:
+            record: The log record.
+        """
+        now = int(round(record.timestamp * 1000))
+        self.records += 1
+        if self.start is None:
+            self.start = self.end = now
+            self._window_end = now - now % self.window_ms + self.window_ms
+        elif now < self.start:
+            self.start = now
+        elif now > self.end:
+            self.end = now
+        if now >= self._window_end:
+            # Late records fall into the current window
+            self._close_window()
+            self._window_end = now - now % self.window_ms + self.window_ms
+        # Each key is hashed once for its counter and the rules limiting by it
+        values = {}
+        for kind, counter in self.counters.items():
+            key = counter.extract(record)
+            if key:
+                values[kind] = value = hash64(key)
+                counter.add(key, value)
+
+        admitted = self.router.admit(record)
+        if admitted is None:
+            return
+        path_rule = admitted[1]
+        for trackers in (self._global_trackers, self.rule_trackers[path_rule.name] if path_rule is not None else ()):
+            for tracker in trackers:
+                if tracker.kind in values:
+                    tracker.add(now, values[tracker.kind])
+
+    def finish(self) -> None:
+        """
+        Closes the last window; call once the log is consumed.
+        """
+        self._close_window()
+        for trackers in self.rule_trackers.values():
+            for tracker in trackers:
+                tracker.close_window()
+
+    def report(self, top: int = 20) -> Dict[str, Any]:
+        """
+        Summarizes the analysis.
+
+        Args:
+            top: Number of keys listed per kind.
+
+        Returns:
+            A JSON-serializable report: per key kind, the keys with the most
+            requests, each with its estimated request count and peak rate
+            in requests per minute; per rule, the distinct keys it tracked
+            per window and the expected_keys recommended for it, and the
+            requests_per_minute and burst recommended at the percentile.
+        """
+        per_minute = 60000 / self.window_ms
+        report: Dict[str, Any] = {
+            'records': self.records,
+            'duration': (self.end - self.start) / 1000 if self.start is not None else 0.0,
+            'window': self.window_ms // 1000,
+            'keys': {},
+        }
+        for kind, counter in self.counters.items():
+            report['keys'][kind] = [
+                {'key': key, 'requests': count, 'peak_rpm': round(counter.peaks.get(key, 0) * per_minute, 1)}
+                for key, count in counter.totals.most_common(top)
+            ]
+        report['capacity'] = [cardinality.report() for cardinality, _ in self.rule_trackers.values()]
+        report['percentile'] = self.percentile
+        report['limits'] = [rates.report(self.percentile) for _, rates in self.rule_trackers.values()]
+        return report
+
+    def recommended_settings(self) -> Dict[Optional[str], Dict[str, int]]:
+        """
+        Returns the recommended settings that differ from the configured ones, per rule.
+
+        Returns:
+            {path or None for the global rule: {setting: value}}, covering
+            expected_keys, requests_per_minute and burst, as taken by
+            config_patch.update_rule_settings.
+        """
+        updates: Dict[Optional[str], Dict[str, int]] = {}
+        for cardinality, rates in self.rule_trackers.values():
+            rule = cardinality.rule
+            recommended = dict(cardinality.report(), **rates.report(self.percentile))
+            settings = {setting: recommended[f'recommended_{setting}']
+                        for setting in (EXPECTED_KEYS_KEY, REQUESTS_PER_MINUTE_KEY, BURST_KEY)
+                        if recommended[f'recommended_{setting}'] is not None
+                        and recommended[f'recommended_{setting}'] != getattr(rule, setting)}
+            if settings:
+                updates[rule.path] = settings
+        return updates
+
+    def offenders(self, threshold_rpm: float, kind: str = 'ip') -> List[Tuple[str, float]]:
+        """
+        Returns the keys whose peak rate reached a threshold.
+
+        Args:
+            threshold_rpm: The rate, in requests per minute.
+            kind: The key kind (e.g., 'ip').
+
+        Returns:
+            (key, peak requests per minute) tuples, highest first.
+        """
+        per_minute = 60000 / self.window_ms
+        rates = ((key, peak * per_minute) for key, peak in self.counters[kind].peaks.items())
+        return sorted(((key, rate) for key, rate in rates if rate >= threshold_rpm), key=lambda item: (-item[1], item[0]))
+
+    def _close_window(self) -> None:
+        for counter in self.counters.values():
+            counter.close_window()
+
+def limit_by_headers(ruleset: Ruleset) -> List[str]:
+    """
+    Returns the lowercase names of the headers the rules limit by, in rule order.
+    """
+    rules = ([ruleset.global_rule] if ruleset.global_rule else []) + list(ruleset.paths)
+    headers: List[str] = []
+    for rule in rules:
+        if rule.limit_by == 'header_name' and rule.limit_by_header.lower() not in headers:
+            headers.append(rule.limit_by_header.lower())
+    return headers
+
+def key_kind(rule: RuleSpec) -> str:
+    """
+    Returns the key kind a rule limits by: 'ip', 'user_agent' or 'header:<name>'.
+    """
+    if rule.limit_by == 'user_agent':
+        return 'user_agent'
+    elif rule.limit_by == 'header_name':
+        return f'header:{rule.limit_by_header.lower()}'
+    return 'ip'
+
+def round_up(value: int, digits: int) -> int:
+    """
+    Rounds a positive integer up to a number of significant digits (e.g., 1234 -> 1300).
+    """
+    scale = 10 ** max(len(str(value)) - digits, 0)
+    return -(-value // scale) * scale
+
+def analyze(ruleset: Ruleset, records: Iterable[LogRecord], capacity: int = DEFAULT_HEAVY_HITTERS,
+            window_seconds: int = DEFAULT_WINDOW_SECONDS) -> LogAnalyzer:
+    """
+    Analyzes a stream of records.
+
+    Args:
+        ruleset: The compiled Ruleset.
+        records: The log records, in time order.
+        capacity: Keys tracked per kind.
+        window_seconds: Length of the windows peak rates are measured over.
+
+    Returns:
+        The finished LogAnalyzer.
+    """
+    analyzer = LogAnalyzer(ruleset, capacity, window_seconds)
+    for record in records:
+        analyzer.feed(record)
+    analyzer.finish()
+    return analyzer
+
+def propose_blacklist(ruleset: Ruleset, offenders: Iterable[str], ipv4_prefix: int = 32,
+                      ipv6_prefix: int = 128) -> List[str]:
+    """
+    Merges offending addresses into the configured blacklist.
+
+    Offenders may be widened to their enclosing network (e.g., /24). A
+    network that would cover a whitelisted address is not widened.
+    Whitelisted and invalid addresses are skipped. The result is aggregated
+    into the fewest CIDRs.
+
+    Args:
+        ruleset: The compiled Ruleset.
+        offenders: The offending client addresses.
+        ipv4_prefix: Prefix length IPv4 offenders are widened to.
+        ipv6_prefix: Prefix length IPv6 offenders are widened to.
+
+    Returns:
+        The proposed blacklist.ips entries.
+    """
+    whitelist = IPIndex(ruleset.whitelist.ips)
+    whitelisted = [parse_interval(ip) for ip in ruleset.whitelist.ips]
+    entries = list(ruleset.blacklist.ips)
+    for ip in offenders:
+        if parse_interval(ip) is None or ip in whitelist:
+            continue
+        address = ipaddress.ip_address(ip)
+        network = ipaddress.ip_network(f'{address}/{ipv4_prefix if address.version == 4 else ipv6_prefix}', strict=False)
+        first, last = int(network.network_address), int(network.broadcast_address)
+        if any(interval and interval[0] == network.version and interval[1] <= last and first <= interval[2]
+               for interval in whitelisted):
+            entries.append(ip)
+        else:
+            entries.append(str(network))
+    return aggregate_ips(entries)
+
+def iter_blacklist_proposal(entries: List[str], threshold_rpm: float, new_offenders: int) -> Iterator[str]:
+    """
+    Renders a blacklist proposal as a config.yaml section.
+
+    Args:
+        entries: The proposed blacklist.ips entries.
+        threshold_rpm: The threshold offenders were selected with.
+        new_offenders: Number of offending addresses found.
+
+    Yields:
+        The YAML lines.
+    """
+    yield f'# Blacklist proposal: {new_offenders} client addresses peaked at or above {threshold_rpm:g} requests per minute'
+    yield 'blacklist:'
+    yield '  enabled: true'
+    if not entries:
+        yield '  ips: []'
+        return
+    yield '  ips:'
+    for entry in entries:
+        yield f'    - {entry}'
+
+def format_analysis(report: Dict[str, Any]) -> Iterator[str]:
+    """
+    Renders an analysis report as a table per key kind, then the state capacity and recommended limits of every rule.
+
+    Args:
+        report: The report returned by LogAnalyzer.report.
+
+    Yields:
+        The report lines.
+    """
+    yield (f"Analyzed {report['records']} requests over {report['duration']:.1f}s "
+           f"(peak rates over {report['window']}s windows, counts are upper-bound estimates)")
+    for kind, keys in report['keys'].items():
+        yield ''
+        yield f'[{kind}]'
+        if not keys:
+            yield '  no values logged'
+            continue
+        names = [entry['key'] if len(entry['key']) <= MAX_KEY_WIDTH else entry['key'][:MAX_KEY_WIDTH - 3] + '...'
+                 for entry in keys]
+        width = max([len('key')] + [len(name) for name in names])
+        yield f"{'key':<{width}}  {'requests':>10}  {'peak rpm':>10}"
+        for name, entry in zip(names, keys):
+            yield f"{name:<{width}}  {entry['requests']:>10}  {entry['peak_rpm']:>10}"
+
+    capacity = report.get('capacity')
+    if not capacity:
+        return
+    yield ''
+    yield '[capacity] distinct keys per rule window (estimated)'
+    width = max(len('rule'), max(len(entry['rule']) for entry in capacity))
+    yield (f"{'rule':<{width}}  {'limit_by':<12}  {'window':>7}  {'peak':>8}  {'mean':>10}  {'total':>8}  "
+           f"{'expected_keys':>13}  {'recommended':>11}")
+    for entry in capacity:
+        expected = entry['expected_keys'] if entry['expected_keys'] is not None else '-'
+        recommended = entry['recommended_expected_keys'] if entry['recommended_expected_keys'] is not None else '-'
+        yield (f"{entry['rule']:<{width}}  {entry['limit_by']:<12}  {str(entry['window']) + 's':>7}  "
+               f"{entry['peak_keys']:>8}  {entry['mean_keys']:>10}  {entry['total_keys']:>8}  "
+               f"{expected:>13}  {recommended:>11}")
+
+    limits = report.get('limits')
+    if not limits:
+        return
+    yield ''
+    yield f"[limits] per-key requests per window and per second, at p{report['percentile']:g} (estimated)"
+    width = max(len('rule'), max(len(entry['rule']) for entry in limits))
+    yield (f"{'rule':<{width}}  {'limit_by':<12}  {'window':>7}  {'key windows':>11}  {'rpm':>6}  {'burst':>6}  "
+           f"{'recommended rpm':>15}  {'recommended burst':>17}")
+    for entry in limits:
+        rate = entry['recommended_requests_per_minute'] if entry['recommended_requests_per_minute'] is not None else '-'
+        burst = entry['recommended_burst'] if entry['recommended_burst'] is not None else '-'
+        yield (f"{entry['rule']:<{width}}  {entry['limit_by']:<12}  {str(entry['window']) + 's':>7}  "
+               f"{entry['key_windows']:>11}  {entry['requests_per_minute']:>6}  {entry['burst']:>6}  "
+               f"{rate:>15}  {burst:>17}")
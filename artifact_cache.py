@@ -0,0 +1,164 @@
+# artifact_cache.py
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+from ruleset import Ruleset
+
+# Bump when the cache file layout changes; older caches are then ignored
+CACHE_FORMAT = 1
+CACHE_FILE = '.limits-cache.json'
+
+# Read size used when digesting existing outputs
+DIGEST_CHUNK_SIZE = 1 << 20
+
+# Modules every generator's output depends on besides its own: the
+# compiled Ruleset and line writer, IP aggregation and config constants
+SHARED_GENERATOR_MODULES = ('ruleset', 'ip_index', 'ratelimit')
+
+logger = logging.getLogger(__name__)
+
+class ArtifactCache:
+    """
+    Records, per backend, the fingerprint its output was generated from and
+    the digest of the bytes written.
+
+    A backend is fresh when its fingerprint is unchanged and the output file
+    on disk still has the recorded digest, in which case generation can be
+    skipped entirely. The cache is a small JSON file stored next to the outputs.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Path of the cache file. A missing or unreadable file yields an empty cache.
+        """
+        self.path = path
+        self.entries: Dict[str, Dict[str, str]] = {}
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('format') == CACHE_FORMAT:
+                self.entries = data.get('backends', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable generation cache {path}: {e}")
+
+    def is_fresh(self, backend: str, fingerprint: str, output_path: str) -> bool:
+        """
+        Checks whether a backend's output is up to date.
+
+        Args:
+            backend: The backend name.
+            fingerprint: The current fingerprint (see config_fingerprint).
+            output_path: The path of the backend's generated file.
+
+        Returns:
+            True if the output was generated from the same fingerprint and is unchanged on disk.
+        """
+        entry = self.entries.get(backend)
+        if not entry or entry.get('fingerprint') != fingerprint:
+            return False
+        return file_digest(output_path) == entry.get('output')
+
+    def record(self, backend: str, fingerprint: str, output_digest: str) -> None:
+        """
+        Records the output generated for a backend.
+
+        Args:
+            backend: The backend name.
+            fingerprint: The fingerprint the output was generated from.
+            output_digest: The SHA-256 hex digest of the backend's file.
+        """
+        self.entries[backend] = {'fingerprint': fingerprint, 'output': output_digest}
+
+    def save(self) -> None:
+        """
+        Writes the cache file.
+        """
+        with open(self.path, 'w') as f:
+            json.dump({'format': CACHE_FORMAT, 'backends': self.entries}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+def config_fingerprint(ruleset: Ruleset, module_name: str) -> str:
+    """
+    Fingerprints everything a backend's output depends on.
+
+    The normalized config is the Ruleset's repr, which is deterministic and
+    ignores formatting, comments and disabled rules of config.yaml. The
+    generator version is the digest of the sources of the generator module
+    and of SHARED_GENERATOR_MODULES, so changes to an emitter or to the code
+    they share invalidate the outputs without a manual version bump.
+
+    Args:
+        ruleset: The compiled Ruleset.
+        module_name: The generator module (e.g., 'ratelimit2nginx'); modules are located, not imported.
+
+    Returns:
+        A hex digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(ruleset).encode())
+    for name in (module_name,) + SHARED_GENERATOR_MODULES:
+        spec = importlib.util.find_spec(name)
+        if spec is not None and spec.origin:
+            digest.update(f'{name}:{file_digest(spec.origin)}\n'.encode())
+    return digest.hexdigest()
+
+def file_digest(path: str) -> Optional[str]:
+    """
+    Computes the SHA-256 digest of a file, reading it in chunks.
+
+    Args:
+        path: The file path.
+
+    Returns:
+        The hex digest, or None if the file does not exist.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+def write_lines_if_changed(path: str, lines: Iterable[str]) -> Tuple[bool, str]:
+    """
+    Streams lines to a file, replacing it only if the content differs from
+    what is already on disk.
+
+    The lines are written to a temporary file in the same directory while
+    being digested, so memory use does not depend on the output size. The
+    file is then renamed over the target, or discarded if the digests match.
+
+    Args:
+        path: The file path; parent directories are created as needed.
+        lines: The lines, without trailing newlines.
+
+    Returns:
+        A (written, SHA-256 hex digest of the content) tuple.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            for line in lines:
+                chunk = f'{line}\n'.encode()
+                digest.update(chunk)
+                f.write(chunk)
+        if file_digest(path) == digest.hexdigest():
+            os.remove(tmp_path)
+            return False, digest.hexdigest()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True, digest.hexdigest()
@@ -0,0 +1,131 @@
+# async_limiter.py
+import asyncio
+import heapq
+import logging
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from limiter import ALLOWED, DEFAULT_MAX_KEYS, LIMITED, RateLimiter
+from ruleset import Ruleset
+
+# Waiters due within this many seconds of a timer run are released together
+TIMER_SLACK = 0.001
+
+logger = logging.getLogger(__name__)
+
+class AsyncRateLimiter(RateLimiter):
+    """
+    RateLimiter for asyncio services, able to hold requests until they are allowed.
+
+    In fail-fast mode acquire answers at once, like check. In wait mode a
+    limited request borrows the next token of its bucket and waits for it:
+    every waiter is given its own slot, so a herd of requests on one key is
+    released at the rule's rate instead of retrying in bursts. Waiters are
+    plain futures kept in a single timer heap, served by one event loop
+    timer; no task or sleep is created per request.
+
+    The limiter belongs to the event loop of its first acquire.
+    """
+
+    def __init__(self, config: Union[Ruleset, Dict[str, Any]], wait: bool = False, timeout: Optional[float] = None,
+                 max_keys: int = DEFAULT_MAX_KEYS):
+        """
+        Args:
+            config: The compiled Ruleset, or a validated configuration dictionary.
+            wait: Default mode of acquire: wait until allowed, or fail fast.
+            timeout: Default longest wait in seconds in wait mode; unbounded if None.
+            max_keys: The most buckets kept per rule (see limiter.Rule).
+        """
+        super().__init__(config, max_keys)
+        self.wait = wait
+        self.timeout = timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # (deadline, sequence, future) entries; the sequence keeps equal deadlines in order
+        self._timers: List[Tuple[float, int, asyncio.Future]] = []
+        self._sequence = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_deadline = 0.0
+
+    async def acquire(self, key: str, path: str, wait: Optional[bool] = None, timeout: Optional[float] = None,
+                      client_ip: Optional[str] = None) -> str:
+        """
+        Decides whether a request may proceed, waiting for a token in wait mode.
+
+        Args:
+            key: The value the matching rule limits by (IP, User-Agent or header value).
+            path: The request path.
+            wait: Wait until allowed instead of failing fast; defaults to the limiter's mode.
+            timeout: Longest wait in seconds; defaults to the limiter's timeout. A request
+                that would wait longer is limited at once, without taking a token.
+            client_ip: The client address for whitelist/blacklist checks (see RateLimiter.check).
+
+        Returns:
+            ALLOWED, LIMITED or BLOCKED. Blacklisted clients are blocked at once in either mode.
+        """
+        loop = self._bind_loop()
+        rule = self.match(path)
+        decision = self._screen(rule, key, client_ip)
+        if decision is not None:
+            return decision
+
+        now = loop.time()
+        if not (self.wait if wait is None else wait):
+            return ALLOWED if rule.consume(key, now) else LIMITED
+
+        delay = rule.reserve(key, now, self.timeout if timeout is None else timeout)
+        if delay is None:
+            return LIMITED
+        if delay <= 0:
+            return ALLOWED
+
+        waiter = loop.create_future()
+        self._schedule(now + delay, waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The slot is given back for the requests queued behind this one
+            rule.refund(key)
+            raise
+        return ALLOWED
+
+    @property
+    def waiting(self) -> int:
+        """
+        Number of requests currently waiting for a token.
+        """
+        return sum(1 for _, _, waiter in self._timers if not waiter.done())
+
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        elif self._loop is not loop:
+            raise RuntimeError('AsyncRateLimiter is bound to a different event loop')
+        return loop
+
+    def _schedule(self, deadline: float, waiter: asyncio.Future) -> None:
+        """
+        Adds a waiter to the timer heap, moving the loop timer earlier if needed.
+        """
+        self._sequence += 1
+        heapq.heappush(self._timers, (deadline, self._sequence, waiter))
+        if self._timer is None or deadline < self._timer_deadline:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = self._loop.call_at(deadline, self._release)
+            self._timer_deadline = deadline
+
+    def _release(self) -> None:
+        """
+        Wakes the waiters that are due and rearms the loop timer for the next one.
+        """
+        self._timer = None
+        timers = self._timers
+        due = self._loop.time() + TIMER_SLACK
+        while timers and timers[0][0] <= due:
+            waiter = heapq.heappop(timers)[2]
+            # Cancelled waiters are skipped here rather than removed from the heap
+            if not waiter.done():
+                waiter.set_result(None)
+        if timers:
+            self._timer_deadline = timers[0][0]
+            self._timer = self._loop.call_at(self._timer_deadline, self._release)
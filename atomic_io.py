@@ -0,0 +1,110 @@
+# atomic_io.py
+import logging
+import os
+import shlex
+import subprocess
+import tempfile
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+def write_file_atomic(path: str, content: bytes) -> bool:
+    """
+    Replaces a file with new content atomically, unless it already has that content.
+
+    The content goes to a temporary file in the same directory, which is
+    fsynced and renamed over the destination, so readers (and a proxy
+    reloading at the wrong moment) see either the old or the new file, never
+    a partial one. An existing file's permission bits are kept.
+
+    Args:
+        path: The destination file; parent directories are created as needed.
+        content: The bytes to write.
+
+    Returns:
+        True if the file was written, False if it already had this content.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+        mode: Optional[int] = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = None
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode if mode is not None else 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_directory(directory)
+    return True
+
+def copy_file_atomic(source: str, dest: str) -> bool:
+    """
+    Copies a file with write_file_atomic.
+
+    Args:
+        source: The file to copy.
+        dest: The destination file.
+
+    Returns:
+        True if the destination was written, False if it was already identical.
+    """
+    with open(source, 'rb') as f:
+        return write_file_atomic(dest, f.read())
+
+def run_reload_hook(env_var: str) -> bool:
+    """
+    Runs the reload command configured in an environment variable, if any.
+
+    The command is split like a shell command line but run without a shell,
+    e.g. `systemctl reload nginx` or `nginx -s reload`.
+
+    Args:
+        env_var: The environment variable holding the command (e.g., 'NGINX_RELOAD_COMMAND').
+
+    Returns:
+        True if no command is configured or it succeeded, False if it failed.
+    """
+    command = os.environ.get(env_var)
+    if not command:
+        return True
+
+    logger.info(f"Running reload command: {command}")
+    try:
+        result = subprocess.run(shlex.split(command), check=False)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error: could not run reload command from {env_var}: {e}")
+        return False
+    if result.returncode != 0:
+        logger.error(f"Error: reload command exited with status {result.returncode}")
+        return False
+    return True
+
+def _fsync_directory(directory: str) -> None:
+    """
+    Flushes a directory entry so a rename survives a crash. Not supported on every platform.
+
+    Args:
+        directory: The directory to flush.
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,164 @@
+# config_patch.py
+import difflib
+import logging
+import re
+from typing import Dict, Any, Iterator, List, Optional
+
+import yaml
+
+from ratelimit import GLOBAL_SECTION, PATHS_SECTION
+
+# A block-style 'key: value  # comment' line
+SETTING_PATTERN = re.compile(r'^(?P<indent>\s*)(?P<key>[A-Za-z_]+):(?P<space>\s*)(?P<value>[^#]*?)(?P<comment>\s+#.*)?$')
+
+logger = logging.getLogger(__name__)
+
+def update_rule_settings(content: str, updates: Dict[Optional[str], Dict[str, Any]]) -> str:
+    """
+    Sets rule settings in the text of a config.yaml, keeping its comments and layout.
+
+    Existing settings get their value replaced in place, trailing comments
+    included; missing settings are added after the rule's last setting.
+    Rules written as flow mappings (e.g., `/api: {burst: 5}`) or not found
+    in the file are skipped with a warning.
+
+    Args:
+        content: The config.yaml text.
+        updates: Settings to set per rule, keyed by path (None for the global rule).
+
+    Returns:
+        The updated text.
+    """
+    lines = content.splitlines(keepends=True)
+    pending = {rule: dict(settings) for rule, settings in updates.items() if settings}
+    insertions = []  # (line index, text)
+
+    for rule, block_start, block_end, indent in _iter_rule_blocks(lines):
+        settings = pending.pop(rule, None)
+        if settings is None:
+            continue
+        last_setting = block_start
+        for index in range(block_start + 1, block_end):
+            match = SETTING_PATTERN.match(lines[index].rstrip('\n'))
+            if not match or len(match.group('indent')) != indent:
+                continue
+            last_setting = index
+            key = match.group('key')
+            if key in settings:
+                newline = '\n' if lines[index].endswith('\n') else ''
+                lines[index] = (f"{match.group('indent')}{key}:{match.group('space') or ' '}{_format_value(settings.pop(key))}"
+                                f"{match.group('comment') or ''}{newline}")
+        if not lines[last_setting].endswith('\n'):
+            lines[last_setting] += '\n'
+        insertions.append((last_setting + 1, ''.join(f"{' ' * indent}{key}: {_format_value(value)}\n"
+                                                     for key, value in settings.items())))
+
+    for rule in pending:
+        logger.warning(f"Cannot update {'the global rule' if rule is None else f'path {rule}'}: "
+                       f"no block-style section for it in the configuration")
+
+    for index, text in sorted(insertions, reverse=True):
+        if text:
+            lines.insert(index, text)
+    return ''.join(lines)
+
+def config_diff(path: str, old: str, new: str) -> Iterator[str]:
+    """
+    Renders the change of a config file as a unified diff, applicable with `patch -p0` or `git apply`.
+
+    Args:
+        path: The file path shown in the diff headers.
+        old: The current text.
+        new: The updated text.
+
+    Yields:
+        The diff lines, without trailing newlines; nothing if the texts are equal.
+    """
+    for line in difflib.unified_diff(old.splitlines(), new.splitlines(), path, path, lineterm=''):
+        yield line
+
+def _iter_rule_blocks(lines: List[str]) -> Iterator[tuple]:
+    """
+    Locates the block-style mapping of every rule.
+
+    Yields:
+        (path or None for global, index of the rule's key line, index after
+        its last line, indentation of its settings) tuples.
+    """
+    section = None
+    rule: Any = None
+    block_start = None
+    block_indent = 0
+    settings_indent = None
+
+    def close(end):
+        if block_start is not None and settings_indent is not None:
+            return rule, block_start, end, settings_indent
+        return None
+
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        indent = len(line) - len(line.lstrip())
+
+        if block_start is not None and indent > block_indent:
+            if settings_indent is None:
+                settings_indent = indent
+            continue
+        if block_start is not None:
+            block = close(_block_end(lines, block_start, index))
+            if block:
+                yield block
+            block_start = None
+
+        key = _mapping_key(stripped)
+        if indent == 0:
+            section = key
+            if section == GLOBAL_SECTION and _opens_block(stripped):
+                rule, block_start, block_indent, settings_indent = None, index, 0, None
+        elif section == PATHS_SECTION and key is not None and _opens_block(stripped):
+            rule, block_start, block_indent, settings_indent = key, index, indent, None
+
+    if block_start is not None:
+        block = close(_block_end(lines, block_start, len(lines)))
+        if block:
+            yield block
+
+def _block_end(lines: List[str], block_start: int, next_key: int) -> int:
+    """
+    Returns the index after a block's last non-blank, non-comment line before the next key.
+    """
+    end = next_key
+    while end > block_start + 1 and (not lines[end - 1].strip() or lines[end - 1].strip().startswith('#')):
+        end -= 1
+    return end
+
+def _mapping_key(stripped: str) -> Any:
+    """
+    Returns the key of a 'key: value' line, or None if it is not a mapping entry.
+    """
+    try:
+        parsed = yaml.safe_load(stripped)
+    except yaml.YAMLError:
+        return None
+    if isinstance(parsed, dict) and len(parsed) == 1:
+        return next(iter(parsed))
+    return None
+
+def _opens_block(stripped: str) -> bool:
+    """
+    Checks whether a mapping entry has its value on the following, indented lines.
+    """
+    parsed = yaml.safe_load(stripped)
+    return isinstance(parsed, dict) and next(iter(parsed.values())) is None
+
+def _format_value(value: Any) -> str:
+    """
+    Renders a scalar setting as YAML.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return yaml.safe_dump(value, default_flow_style=True).strip().replace('\n...', '')
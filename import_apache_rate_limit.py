@@ -1,48 +1,57 @@
 # import_apache_rate_limit.py
 import os
-import shutil
 import logging
 from typing import Optional
-from pathlib import Path
+
+from atomic_io import copy_file_atomic, run_reload_hook
 
 # Constants
 SOURCE_FILE = 'rate_limit_rules/apache/apache_rate_limit.conf'
 DEST_ENV_VAR = 'APACHE_RATE_LIMIT_FILE'
+RELOAD_ENV_VAR = 'APACHE_RELOAD_COMMAND'
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def import_apache_rate_limit() -> None:
+def import_apache_rate_limit() -> bool:
     """
     Imports the generated Apache rate limit configuration to the destination file.
     The destination file path should be in the environment variable APACHE_RATE_LIMIT_FILE.
+
+    The file is replaced atomically and only when its content changed; the
+    command in APACHE_RELOAD_COMMAND, if set, is then run to reload Apache.
+
+    Returns:
+        True if the destination file changed, False otherwise.
     """
     dest_file = os.environ.get(DEST_ENV_VAR)
 
     if not dest_file:
         logger.error("Error: APACHE_RATE_LIMIT_FILE environment variable not set.")
-        return
+        return False
 
     try:
-        # Ensure the destination directory exists before attempting to copy
-        dest_path = Path(dest_file)
-        dest_dir = dest_path.parent
-        
-        if not dest_dir.exists():
-            logger.info(f"Creating destination directory: {dest_dir}")
-            dest_dir.mkdir(parents=True, exist_ok=True)
-
-        shutil.copyfile(SOURCE_FILE, dest_file)
+        # The destination directory is created if it does not exist yet
+        if not copy_file_atomic(SOURCE_FILE, dest_file):
+            logger.info(f"Apache rate limit configuration at {dest_file} is up to date")
+            return False
         logger.info(f"Successfully imported Apache rate limit configuration to {dest_file}")
     except FileNotFoundError as e:
         logger.error(f"Error: Source file not found: {SOURCE_FILE}")
+        return False
     except PermissionError as e:
         logger.error(f"Error: Permission denied while copying to {dest_file}")
+        return False
     except OSError as e:
         logger.error(f"Error: Failed to create destination directory or copy file: {e}")
+        return False
     except Exception as e:
         logger.error(f"Unexpected error copying the file: {e}")
+        return False
+
+    run_reload_hook(RELOAD_ENV_VAR)
+    return True
 
 if __name__ == "__main__":
     import_apache_rate_limit()
@@ -2,11 +2,47 @@
 import os
 import re
 import logging
-from typing import Optional
+from typing import List, Optional, Set, Tuple
+
+from atomic_io import copy_file_atomic, run_reload_hook, write_file_atomic
 
 # Constants
 SOURCE_FILE = 'rate_limit_rules/haproxy/haproxy_rate_limit.conf'
 DEST_ENV_VAR = 'HAPROXY_RATE_LIMIT_FILE'
+ACL_SOURCE_DIR = 'rate_limit_rules/haproxy'
+ACL_FILES = ('whitelist.lst', 'blacklist.lst', 'paths.map', 'paths_reg.map')
+ACL_DIR_ENV_VAR = 'HAPROXY_ACL_DIR'
+RELOAD_ENV_VAR = 'HAPROXY_RELOAD_COMMAND'
+FRONTEND_ENV_VAR = 'HAPROXY_FRONTEND'
+DEFAULT_FRONTEND = 'http-in'
+STICK_TABLES_MARKER = '# Stick tables (top-level sections, keep outside the frontend)'
+
+# Markers delimiting the sections managed by this script; everything between
+# them is replaced on every import
+BLOCK_BEGIN = '# BEGIN limits'
+BLOCK_END = '# END limits'
+STICK_TABLES_BEGIN = '# BEGIN limits stick tables'
+STICK_TABLES_END = '# END limits stick tables'
+
+FRONTEND_PATTERN = re.compile(r'frontend\s+(\S+)')
+BACKEND_PATTERN = re.compile(r'backend\s+(\S+)')
+
+# Rules spliced unmarked right after the frontend line by importers
+# predating the managed sections, in every generator version
+LEGACY_RULE_PATTERN = re.compile(
+    r'(acl (whitelist|blacklist) src \S.*'
+    r'|http-request allow if whitelist'
+    r'|http-request deny if blacklist'
+    r'|acl \w+_rate_limit (src_conn_rate_ge|req\.hdr\([^)]*\),rate_ge) \d+'
+    r'|http-request deny if (global_rate_limit|is_\w+ \w+_rate_limit)'
+    r'|acl is_\w+ path_(beg|reg) \S+'
+    r'|http-request track-sc[01] \S+ table st_\w+( if .*)?'
+    r'|http-request deny deny_status 429 if .*sc_http_req_rate\([01]\).*'
+    r'|http-request set-var\(txn\.rl_(rule|limit)\) .*)$')
+ACL_NAME_PATTERN = re.compile(r'acl\s+(\S+)')
+TABLE_PATTERN = re.compile(r'\btable\s+(\S+)')
+# Identifiers of an `if` condition, once its `{ ... }` anonymous ACLs are removed
+CONDITION_NAME_PATTERN = re.compile(r'[A-Za-z_][\w.-]*')
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,16 +59,229 @@ def indent_content(content: str, indent: str = '    ') -> str:
             indented.append(line)
     return ''.join(indented)
 
-def import_haproxy_rate_limit() -> None:
+def install_acl_files(dest_file: str) -> bool:
+    """
+    Copies the generated ACL and map files, if any, to the HAProxy host.
+    The target directory is taken from HAPROXY_ACL_DIR and defaults to the
+    directory of the destination file. Files are replaced atomically and
+    only when their content changed.
+
+    Returns:
+        True if any file changed, False otherwise.
+    """
+    acl_dir = os.environ.get(ACL_DIR_ENV_VAR) or os.path.dirname(os.path.abspath(dest_file))
+
+    changed = False
+    for file_name in ACL_FILES:
+        source_path = os.path.join(ACL_SOURCE_DIR, file_name)
+        if not os.path.exists(source_path):
+            continue
+        if copy_file_atomic(source_path, os.path.join(acl_dir, file_name)):
+            logger.info(f"Installed HAProxy ACL file {file_name} to {acl_dir}")
+            changed = True
+    return changed
+
+def _referenced_names(line: str) -> Set[str]:
+    """
+    Returns the ACLs and stick tables a rule line defines or refers to.
+    """
+    match = ACL_NAME_PATTERN.match(line)
+    if match:
+        return {match.group(1)}
+    names = set(TABLE_PATTERN.findall(line))
+    _, found, condition = line.partition(' if ')
+    if found:
+        names.update(CONDITION_NAME_PATTERN.findall(re.sub(r'\{[^}]*\}', ' ', condition)))
+    return names
+
+def _is_own_legacy_block(rules: List[str], generated: Set[str], managed_names: Set[str]) -> bool:
+    """
+    Checks whether unmarked rule lines were inserted by an earlier import of the current rules.
+
+    Every line must be one the generator emits now, or a generated-looking
+    line referring only to the ACLs and stick tables of the current rules;
+    at least one line must refer to them, so hand-written rules are never
+    taken for generated ones.
+    """
+    own = False
+    for rule in rules:
+        if rule in generated:
+            own = True
+            continue
+        if not LEGACY_RULE_PATTERN.match(rule):
+            return False
+        names = _referenced_names(rule)
+        if not names <= managed_names:
+            return False
+        own = own or bool(names)
+    return own
+
+def _drop_legacy_rules(scanned: List[str], generated: Set[str], managed_names: Set[str],
+                       lines: List[str]) -> Tuple[int, int]:
+    """
+    Keeps the scanned lines in the output unless they are an earlier import of the current rules.
+
+    Returns:
+        (removed, kept) counts of rule lines.
+    """
+    rules = [line.strip() for line in scanned if line.strip()]
+    if rules and _is_own_legacy_block(rules, generated, managed_names):
+        return len(rules), 0
+    lines.extend(scanned)
+    return 0, len(rules)
+
+def replace_managed_sections(content: str, block: str, stick_tables: str, frontend: Optional[str] = None) -> str:
+    """
+    Replaces the managed sections of an HAProxy configuration in a single pass.
+
+    The rules go between `# BEGIN limits` / `# END limits` inside the target
+    frontend, and the stick-table backends between `# BEGIN limits stick tables`
+    / `# END limits stick tables` at top level. Existing sections are replaced
+    where they are; a rules section found in another frontend is moved. Without
+    existing sections, the rules go right after the frontend line and the stick
+    tables at the end of the file, so repeated imports never duplicate rules.
+
+    Importers predating the markers inserted the rules, unmarked, right after
+    the frontend line on every run, and appended the stick tables to the file.
+    Unmarked rules right after the target frontend line are removed with a
+    warning when they only define or refer to the ACLs (`is_<rule>`) and
+    stick tables (`st_<rule>`) of the current rules; other generated-looking
+    lines there are kept and reported, since removing part of them could
+    leave a dangling ACL. Unmarked backends redefining a managed stick table
+    are removed with a warning.
+
+    Args:
+        content: The current configuration.
+        block: The rules, one per line.
+        stick_tables: The stick-table backends, or an empty string.
+        frontend: The frontend to manage; defaults to the first one. If the file
+            has no frontend at all, a `frontend http-in` section is added.
+
+    Returns:
+        The updated configuration.
+
+    Raises:
+        ValueError: If a managed section is not terminated, or the requested frontend does not exist.
+    """
+    lines = []
+    frontend_at = None   # index after the target frontend line
+    block_at = None      # index of the existing rules section in the target frontend
+    tables_at = None     # index of the existing stick-tables section
+    in_target = False
+    skip_until = None
+    managed_backends = {match.group(1) for match in map(BACKEND_PATTERN.match, stick_tables.splitlines()) if match}
+    generated = {line.strip() for line in block.splitlines() if line.strip()}
+    managed_names = managed_backends | {match.group(1) for match in map(ACL_NAME_PATTERN.match, generated) if match}
+    legacy_scan: Optional[List[str]] = None   # lines right after the target frontend line, while they look generated
+    legacy_rules = 0
+    foreign_rules = 0
+    legacy_backend = False
+    legacy_backends = 0
+
+    for line in content.splitlines(keepends=True):
+        stripped = line.strip()
+        if skip_until is not None:
+            if stripped == skip_until:
+                skip_until = None
+            continue
+        if legacy_scan is not None:
+            if not stripped or LEGACY_RULE_PATTERN.match(stripped) or stripped in generated:
+                legacy_scan.append(line)
+                continue
+            removed, kept = _drop_legacy_rules(legacy_scan, generated, managed_names, lines)
+            legacy_rules += removed
+            foreign_rules += kept
+            legacy_scan = None
+        if legacy_backend:
+            if not stripped or line[0].isspace():
+                continue
+            legacy_backend = False
+        if stripped == BLOCK_BEGIN:
+            if in_target and block_at is None:
+                block_at = len(lines)
+            skip_until = BLOCK_END
+            continue
+        if stripped == STICK_TABLES_BEGIN:
+            if tables_at is None:
+                tables_at = len(lines)
+            skip_until = STICK_TABLES_END
+            continue
+
+        # Unindented, non-comment lines start a new section
+        if stripped and not line[0].isspace() and not stripped.startswith('#'):
+            backend_match = BACKEND_PATTERN.match(line)
+            if backend_match and backend_match.group(1) in managed_backends:
+                legacy_backend = True
+                legacy_backends += 1
+                continue
+            match = FRONTEND_PATTERN.match(line)
+            in_target = bool(match) and frontend_at is None and (frontend is None or match.group(1) == frontend)
+            if in_target:
+                frontend_at = len(lines) + 1
+                legacy_scan = []
+        lines.append(line)
+
+    if skip_until is not None:
+        raise ValueError(f"'{skip_until}' marker is missing")
+    if legacy_scan:
+        removed, kept = _drop_legacy_rules(legacy_scan, generated, managed_names, lines)
+        legacy_rules += removed
+        foreign_rules += kept
+    if legacy_rules:
+        logger.warning(f"Removed {legacy_rules} unmarked rate limit lines left by an earlier import")
+    if foreign_rules:
+        logger.warning(f"Kept {foreign_rules} unmarked lines after the frontend line that look like rate limit "
+                       f"rules but do not match the current rules; remove them by hand if an earlier import "
+                       f"left them")
+    if legacy_backends:
+        logger.warning(f"Removed {legacy_backends} unmarked stick-table backends redefined by the managed section")
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+
+    block = block.strip('\n')
+    stick_tables = stick_tables.strip('\n')
+    managed_block = indent_content(f'{BLOCK_BEGIN}\n{block}\n{BLOCK_END}\n')
+    managed_tables = f'{STICK_TABLES_BEGIN}\n{stick_tables}\n{STICK_TABLES_END}\n' if stick_tables.strip() else ''
+
+    if block_at is None and frontend_at is None:
+        if frontend is not None:
+            raise ValueError(f"frontend '{frontend}' not found")
+        lines.append(f'\nfrontend {DEFAULT_FRONTEND}\n')
+        frontend_at = len(lines)
+
+    # Insert from the back so earlier indexes stay valid
+    insertions = [(block_at if block_at is not None else frontend_at, managed_block)]
+    if managed_tables:
+        if tables_at is None:
+            separator = '\n' if lines and lines[-1].strip() else ''
+            insertions.append((len(lines), separator + managed_tables))
+        else:
+            insertions.append((tables_at, managed_tables))
+    for index, text in sorted(insertions, key=lambda insertion: insertion[0], reverse=True):
+        lines.insert(index, text)
+    return ''.join(lines)
+
+def import_haproxy_rate_limit() -> bool:
     """
     Imports the generated HAProxy rate limit configuration to the destination file.
     The destination file path should be in the environment variable HAPROXY_RATE_LIMIT_FILE.
+
+    The rules are kept in marker-delimited sections (see replace_managed_sections),
+    so importing again replaces them instead of adding a second copy. The
+    frontend to manage can be set with HAPROXY_FRONTEND; it defaults to the
+    first frontend of the file.
+
+    The file is rewritten atomically and only when its content changed; the
+    command in HAPROXY_RELOAD_COMMAND, if set, is then run to reload HAProxy.
+
+    Returns:
+        True if the destination file or an ACL file changed, False otherwise.
     """
     dest_file = os.environ.get(DEST_ENV_VAR)
 
     if not dest_file:
         logger.error("Error: HAPROXY_RATE_LIMIT_FILE environment variable not set.")
-        return
+        return False
 
     try:
         with open(SOURCE_FILE, 'r') as source:
@@ -41,33 +290,42 @@ def import_haproxy_rate_limit() -> None:
         # Guard against empty source content to prevent config corruption
         if not config_content.strip():
             logger.warning("Source file is empty; skipping import.")
-            return
+            return False
+
+        # Install the ACL files first so the config never references missing files
+        acl_changed = install_acl_files(dest_file)
 
-        with open(dest_file, 'r+') as dest:
+        # Stick-table backends are top-level sections and go outside the frontend
+        config_content, _, stick_tables = config_content.partition(STICK_TABLES_MARKER)
+
+        with open(dest_file, 'r') as dest:
             content = dest.read()
-            # Regex to find the first frontend block, or add one if not present
-            match = re.search(r'frontend\s+(\w+)', content)
-            if match:
-                start = match.start()
-                # Indent config content to match frontend block's context
-                indented_config = indent_content(config_content)
-                new_content = content[:start + len(match.group(0))] + '\n' + indented_config + '\n' + content[start + len(match.group(0)):]
-            else:
-                # Add new frontend block with indented config
-                indented_config = indent_content(config_content)
-                new_content = content + '\nfrontend http-in\n' + indented_config
-
-            dest.seek(0)
-            dest.write(new_content)
-            dest.truncate()
-
-        logger.info(f"Successfully imported HAProxy rate limit configuration to {dest_file}")
+
+        new_content = replace_managed_sections(content, config_content, stick_tables,
+                                               os.environ.get(FRONTEND_ENV_VAR) or None)
+
+        config_changed = write_file_atomic(dest_file, new_content.encode())
+        if config_changed:
+            logger.info(f"Successfully imported HAProxy rate limit configuration to {dest_file}")
+        else:
+            logger.info(f"HAProxy rate limit configuration at {dest_file} is up to date")
     except FileNotFoundError:
         logger.error(f"Error: Source file not found: {SOURCE_FILE}")
+        return False
     except PermissionError:
         logger.error(f"Error: Permission denied while writing to {dest_file}")
+        return False
+    except ValueError as e:
+        logger.error(f"Error: cannot update {dest_file}: {e}")
+        return False
     except Exception as e:
         logger.error(f"Error writing to the file: {e}")
+        return False
+
+    if config_changed or acl_changed:
+        run_reload_hook(RELOAD_ENV_VAR)
+        return True
+    return False
 
 if __name__ == "__main__":
     import_haproxy_rate_limit()
@@ -1,37 +1,53 @@
 # import_nginx_rate_limit.py
 import os
-import shutil
 import logging
 from typing import Optional
 
+from atomic_io import copy_file_atomic, run_reload_hook
+
 # Constants
 SOURCE_FILE = 'rate_limit_rules/nginx/nginx_rate_limit.conf'
 DEST_ENV_VAR = 'NGINX_RATE_LIMIT_FILE'
+RELOAD_ENV_VAR = 'NGINX_RELOAD_COMMAND'
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def import_nginx_rate_limit() -> None:
+def import_nginx_rate_limit() -> bool:
     """
     Imports the generated Nginx rate limit configuration to the destination file.
     The destination file path should be in the environment variable NGINX_RATE_LIMIT_FILE.
+
+    The file is replaced atomically and only when its content changed; the
+    command in NGINX_RELOAD_COMMAND, if set, is then run to reload Nginx.
+
+    Returns:
+        True if the destination file changed, False otherwise.
     """
     dest_file = os.environ.get(DEST_ENV_VAR)
 
     if not dest_file:
         logger.error("Error: NGINX_RATE_LIMIT_FILE environment variable not set.")
-        return
+        return False
 
     try:
-        shutil.copyfile(SOURCE_FILE, dest_file)
+        if not copy_file_atomic(SOURCE_FILE, dest_file):
+            logger.info(f"Nginx rate limit configuration at {dest_file} is up to date")
+            return False
         logger.info(f"Successfully imported Nginx rate limit configuration to {dest_file}")
     except FileNotFoundError:
         logger.error(f"Error: Source file not found: {SOURCE_FILE}")
+        return False
     except PermissionError:
         logger.error(f"Error: Permission denied while copying to {dest_file}")
+        return False
     except Exception as e:
         logger.error(f"Error copying the file: {e}")
+        return False
+
+    run_reload_hook(RELOAD_ENV_VAR)
+    return True
 
 if __name__ == "__main__":
     import_nginx_rate_limit()
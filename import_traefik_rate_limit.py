@@ -1,59 +1,126 @@
 # import_traefik_rate_limit.py
 import os
-import re
 import logging
 from typing import Optional
 
+from atomic_io import run_reload_hook, write_file_atomic
+
 # Constants
 SOURCE_FILE = 'rate_limit_rules/traefik/traefik_rate_limit.conf'
 DEST_ENV_VAR = 'TRAEFIK_RATE_LIMIT_FILE'
+RELOAD_ENV_VAR = 'TRAEFIK_RELOAD_COMMAND'
+
+# Markers delimiting the section managed by this script; everything between
+# them is replaced on every import
+BLOCK_BEGIN = '# BEGIN limits'
+BLOCK_END = '# END limits'
+
+# Tables defined by the generated configuration
+MANAGED_TABLES = ('[http.middlewares]', '[http.routers]')
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def import_traefik_rate_limit() -> None:
+def replace_managed_section(content: str, block: str) -> str:
+    """
+    Replaces the `# BEGIN limits` / `# END limits` section of a Traefik
+    configuration in a single pass, or appends it if the file has none.
+
+    Args:
+        content: The current configuration.
+        block: The generated configuration.
+
+    Returns:
+        The updated configuration.
+
+    Raises:
+        ValueError: If the managed section is not terminated, or a table it
+            defines is also defined outside it (TOML rejects duplicate tables).
+    """
+    lines = []
+    block_at = None
+    skipping = False
+
+    for line in content.splitlines(keepends=True):
+        stripped = line.strip()
+        if skipping:
+            skipping = stripped != BLOCK_END
+            continue
+        if stripped == BLOCK_BEGIN:
+            if block_at is None:
+                block_at = len(lines)
+            skipping = True
+            continue
+        if stripped.split('#', 1)[0].strip() in MANAGED_TABLES:
+            raise ValueError(f"{stripped} is also defined outside the managed section; "
+                             f"move those entries to a separate file")
+        lines.append(line)
+
+    if skipping:
+        raise ValueError(f"'{BLOCK_END}' marker is missing")
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+
+    block = block.strip('\n')
+    managed_block = f'{BLOCK_BEGIN}\n{block}\n{BLOCK_END}\n'
+    if block_at is None:
+        separator = '\n' if lines and lines[-1].strip() else ''
+        lines.append(separator + managed_block)
+    else:
+        lines.insert(block_at, managed_block)
+    return ''.join(lines)
+
+def import_traefik_rate_limit() -> bool:
     """
     Imports the generated Traefik rate limit configuration to the destination file.
     The destination file path should be in the environment variable TRAEFIK_RATE_LIMIT_FILE.
+
+    The generated configuration is kept in a marker-delimited section (see
+    replace_managed_section), so importing again replaces it instead of
+    splicing it into the file a second time.
+
+    The file is rewritten atomically and only when its content changed; the
+    command in TRAEFIK_RELOAD_COMMAND, if set, is then run. Traefik's file
+    provider usually watches the file, in which case no command is needed.
+
+    Returns:
+        True if the destination file changed, False otherwise.
     """
     dest_file = os.environ.get(DEST_ENV_VAR)
 
     if not dest_file:
         logger.error("Error: TRAEFIK_RATE_LIMIT_FILE environment variable not set.")
-        return
+        return False
 
     try:
         with open(SOURCE_FILE, 'r') as source:
             config_content = source.read()
 
-        with open(dest_file, 'r+') as dest:
+        with open(dest_file, 'r') as dest:
             content = dest.read()
-            # Regex to find the http middlewares block, or create one if none
-            match = re.search(r'\[http\.middlewares\]', content)
-            if match:
-                start = match.start()
-                # Find the next block (or the end of file)
-                next_block_match = re.search(r'(\n\[[\w\.]+\])', content[start + 1:])
-                if next_block_match:
-                    end = start + 1 + next_block_match.start()
-                    new_content = content[:start + 1] + config_content + '\n' + content[end:]
-                else:
-                    new_content = content[:start + 1] + config_content + '\n'
-            else:
-                new_content = content + '\n[http.middlewares]\n' + config_content
-
-            dest.seek(0)
-            dest.write(new_content)
-            dest.truncate()
 
+        new_content = replace_managed_section(content, config_content)
+
+        if not write_file_atomic(dest_file, new_content.encode()):
+            logger.info(f"Traefik rate limit configuration at {dest_file} is up to date")
+            return False
         logger.info(f"Successfully imported Traefik rate limit configuration to {dest_file}")
     except FileNotFoundError:
         logger.error(f"Error: Source file not found: {SOURCE_FILE}")
+        return False
     except PermissionError:
         logger.error(f"Error: Permission denied while writing to {dest_file}")
+        return False
+    except ValueError as e:
+        logger.error(f"Error: cannot update {dest_file}: {e}")
+        return False
     except Exception as e:
         logger.error(f"Error writing to the file: {e}")
+        return False
+
+    run_reload_hook(RELOAD_ENV_VAR)
+    return True
 
 if __name__ == "__main__":
     import_traefik_rate_limit()
@@ -0,0 +1,160 @@
+# ip_index.py
+import ipaddress
+import logging
+import socket
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Address families indexed separately, keyed by IP version
+_FAMILIES = {4: socket.AF_INET, 6: socket.AF_INET6}
+
+class IPIndex:
+    """
+    Lookup structure for the 'ips' of a whitelist/blacklist section.
+
+    Single addresses and IPv4/IPv6 networks are turned into integer intervals,
+    merged where they overlap or touch, and stored as two sorted arrays per
+    address family. A lookup is one binary search, so it stays fast with
+    hundreds of thousands of entries.
+    """
+
+    def __init__(self, ips: Iterable[Any] = ()):
+        """
+        Args:
+            ips: Addresses and networks in any form accepted by ipaddress.ip_network.
+                Invalid entries are logged and skipped.
+        """
+        intervals: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        for ip in ips:
+            parsed = parse_interval(ip)
+            if parsed is None:
+                logger.warning(f"Ignoring invalid IP or network: {ip}")
+                continue
+            version, start, end = parsed
+            intervals[version].append((start, end))
+
+        self._starts: Dict[int, List[int]] = {}
+        self._ends: Dict[int, List[int]] = {}
+        for version, ranges in intervals.items():
+            merged = _merge_intervals(ranges)
+            self._starts[version] = [start for start, _ in merged]
+            self._ends[version] = [end for _, end in merged]
+
+    def __contains__(self, ip: str) -> bool:
+        """
+        Checks whether an address is covered by any indexed entry.
+
+        Args:
+            ip: The textual IPv4 or IPv6 address.
+
+        Returns:
+            True if the address is covered, False otherwise (including invalid addresses).
+        """
+        for version, family in _FAMILIES.items():
+            try:
+                packed = socket.inet_pton(family, ip)
+            except (OSError, TypeError):
+                continue
+            value = int.from_bytes(packed, 'big')
+            starts = self._starts[version]
+            position = bisect_right(starts, value) - 1
+            return position >= 0 and value <= self._ends[version][position]
+        return False
+
+    def __len__(self) -> int:
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def __bool__(self) -> bool:
+        return bool(self._starts[4] or self._starts[6])
+
+    def ranges(self, version: int) -> Iterator[Tuple[int, int]]:
+        """
+        Iterates over the merged, sorted intervals of one address family.
+
+        Args:
+            version: 4 or 6.
+
+        Returns:
+            An iterator of inclusive (first, last) integer address pairs.
+        """
+        return zip(self._starts[version], self._ends[version])
+
+def aggregate_ips(ips: Iterable[Any]) -> List[str]:
+    """
+    Reduces a whitelist/blacklist to the minimal set of addresses and networks.
+
+    Duplicates and entries covered by a broader network are dropped and
+    adjacent networks are collapsed, so generated configs carry as few ACL
+    entries as possible. Single hosts are written without a prefix length.
+
+    Args:
+        ips: Addresses and networks as listed in config.yaml.
+
+    Returns:
+        The aggregated entries, IPv4 first, each family in address order.
+    """
+    index = IPIndex(ips)
+    aggregated = []
+    for version, address_class in ((4, ipaddress.IPv4Address), (6, ipaddress.IPv6Address)):
+        for start, end in index.ranges(version):
+            for network in ipaddress.summarize_address_range(address_class(start), address_class(end)):
+                if network.num_addresses == 1:
+                    aggregated.append(str(network.network_address))
+                else:
+                    aggregated.append(str(network))
+    return aggregated
+
+def parse_interval(ip: Any) -> Optional[Tuple[int, int, int]]:
+    """
+    Converts an address or network to an inclusive integer interval.
+
+    Plain 'address' and 'address/prefixlen' entries are parsed with inet_pton,
+    which is much cheaper than building ipaddress objects for large lists;
+    anything else (netmask notation, for example) goes through ipaddress.
+
+    Args:
+        ip: An address or network, e.g. '192.168.1.10', '10.0.0.0/8' or '2001:db8::/32'.
+
+    Returns:
+        A (version, first, last) tuple, or None if the entry is invalid.
+    """
+    text = str(ip).strip()
+    address, _, prefix = text.partition('/')
+    for version, family in _FAMILIES.items():
+        try:
+            packed = socket.inet_pton(family, address)
+        except OSError:
+            continue
+        bits = len(packed) * 8
+        if prefix and not (prefix.isdigit() and int(prefix) <= bits):
+            break
+        host_bits = bits - int(prefix) if prefix else 0
+        start = int.from_bytes(packed, 'big') >> host_bits << host_bits
+        return version, start, start | ((1 << host_bits) - 1)
+
+    try:
+        network = ipaddress.ip_network(text, strict=False)
+    except ValueError:
+        return None
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+def _merge_intervals(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Sorts intervals and merges the ones that overlap or are adjacent.
+
+    Args:
+        ranges: Inclusive (first, last) integer pairs.
+
+    Returns:
+        The disjoint, sorted intervals covering the same addresses.
+    """
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
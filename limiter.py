@@ -0,0 +1,305 @@
+# limiter.py
+import heapq
+import logging
+import time
+from typing import Dict, Any, List, Optional, Union
+
+from ip_index import IPIndex
+from path_router import PathRouter
+from ratelimit import load_config
+from ruleset import RuleSpec, Ruleset, ensure_ruleset
+
+# Decisions returned by RateLimiter.check
+ALLOWED = 'allowed'
+LIMITED = 'limited'
+BLOCKED = 'blocked'
+
+# Seconds between sweeps of the buckets that have refilled
+SWEEP_INTERVAL_SECONDS = 60.0
+
+# Buckets kept per rule; past this, the least recently used half is dropped
+DEFAULT_MAX_KEYS = 1000000
+
+logger = logging.getLogger(__name__)
+
+class Rule:
+    """
+    A single token-bucket rule built from the compiled global rule or one path rule.
+
+    The bucket holds up to `burst` + 1 tokens and refills at
+    `requests_per_minute` tokens per `window`: like Nginx `limit_req ...
+    burst=<burst> nodelay`, a burst of `burst` requests on top of the one
+    the rate allows passes. Bucket state is a two-item list [tokens, last_seen]
+    that is updated in place, so a decision allocates nothing once a key
+    has been seen.
+
+    A bucket that has refilled is indistinguishable from a new one, so
+    every SWEEP_INTERVAL_SECONDS those are dropped. Keys are often client
+    controlled (User-Agent, headers), so the buckets are also capped at
+    max_keys: once a sweep cannot bring them below it, the least recently
+    used half is dropped, and those keys start over with a full bucket.
+    """
+
+    __slots__ = ('name', 'rate', 'capacity', 'limit_by', 'limit_by_header', 'max_keys', 'buckets', 'next_sweep')
+
+    def __init__(self, spec: RuleSpec, max_keys: int = DEFAULT_MAX_KEYS):
+        """
+        Args:
+            spec: The compiled rule.
+            max_keys: The most buckets kept at once.
+        """
+        self.name = spec.name
+        self.rate = spec.requests_per_minute / spec.window_seconds
+        self.capacity = float(spec.burst + 1)
+        self.limit_by = spec.limit_by
+        self.limit_by_header = spec.limit_by_header
+        self.max_keys = max_keys
+        self.buckets: Dict[str, List[float]] = {}
+        self.next_sweep = float('-inf')
+
+    def consume(self, key: str, now: float) -> bool:
+        """
+        Takes one token from the bucket of the given key.
+
+        Args:
+            key: The value the rule limits by (IP, User-Agent or header value).
+            now: The current time in seconds.
+
+        Returns:
+            True if a token was available, False if the request must be limited.
+        """
+        if now >= self.next_sweep or len(self.buckets) >= self.max_keys:
+            self.sweep(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = [self.capacity - 1.0, now]
+            return True
+
+        tokens = bucket[0] + (now - bucket[1]) * self.rate
+        if tokens > self.capacity:
+            tokens = self.capacity
+        bucket[1] = now
+        if tokens >= 1.0:
+            bucket[0] = tokens - 1.0
+            return True
+        bucket[0] = tokens
+        return False
+
+    def reserve(self, key: str, now: float, max_delay: Optional[float] = None) -> Optional[float]:
+        """
+        Takes one token from the bucket of the given key, borrowing it if none is available.
+
+        A borrowed token leaves the bucket negative, so later reservations
+        queue behind it and each is given its own slot.
+
+        Args:
+            key: The value the rule limits by.
+            now: The current time in seconds.
+            max_delay: The longest acceptable wait in seconds; unbounded by default.
+
+        Returns:
+            The number of seconds until the token is due (0.0 if available now),
+            or None if that exceeds max_delay, in which case nothing is taken.
+        """
+        if now >= self.next_sweep or len(self.buckets) >= self.max_keys:
+            self.sweep(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = [self.capacity - 1.0, now]
+            return 0.0
+
+        tokens = bucket[0] + (now - bucket[1]) * self.rate
+        if tokens > self.capacity:
+            tokens = self.capacity
+        bucket[1] = now
+        delay = 0.0 if tokens >= 1.0 else (1.0 - tokens) / self.rate if self.rate > 0 else None
+        if delay is None or max_delay is not None and delay > max_delay:
+            bucket[0] = tokens
+            return None
+        bucket[0] = tokens - 1.0
+        return delay
+
+    def sweep(self, now: float) -> None:
+        """
+        Drops the buckets that have refilled, then the least recently used half if still at max_keys.
+
+        Args:
+            now: The current time in seconds.
+        """
+        self.next_sweep = now + SWEEP_INTERVAL_SECONDS
+        rate, capacity = self.rate, self.capacity
+        full = [key for key, (tokens, last) in self.buckets.items() if tokens + (now - last) * rate >= capacity]
+        for key in full:
+            del self.buckets[key]
+        if len(self.buckets) >= self.max_keys:
+            logger.warning(f"Rule {self.name} holds {len(self.buckets)} active keys; "
+                           f"dropping the least recently used half")
+            self.buckets = dict(heapq.nlargest(self.max_keys // 2, self.buckets.items(), key=lambda item: item[1][1]))
+
+    def refund(self, key: str) -> None:
+        """
+        Returns a reserved token that will not be used (e.g., its waiter was cancelled).
+
+        Args:
+            key: The value the rule limits by.
+        """
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket[0] = min(self.capacity, bucket[0] + 1.0)
+
+    def retry_after(self, key: str, now: float) -> float:
+        """
+        Computes how long the given key has to wait for its next token.
+
+        Args:
+            key: The value the rule limits by.
+            now: The current time in seconds.
+
+        Returns:
+            The number of seconds until a token is available (0.0 if one is available now).
+        """
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return 0.0
+        tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1.0 or self.rate <= 0:
+            return 0.0
+        return (1.0 - tokens) / self.rate
+
+class RateLimiter:
+    """
+    In-process rate limiter enforcing the limits defined in config.yaml.
+
+    Each request is matched against the 'paths' section the same way the
+    generated Nginx configuration does: the first matching regex path wins,
+    otherwise the longest matching prefix, otherwise the global rule.
+    Whitelisted clients always pass and blacklisted clients are blocked,
+    mirroring the order used by the HAProxy generator.
+    """
+
+    def __init__(self, config: Union[Ruleset, Dict[str, Any]], max_keys: int = DEFAULT_MAX_KEYS):
+        """
+        Args:
+            config: The compiled Ruleset, or a validated configuration dictionary.
+            max_keys: The most buckets kept per rule (see Rule).
+        """
+        ruleset = ensure_ruleset(config)
+        self.global_rule = Rule(ruleset.global_rule, max_keys) if ruleset.global_rule else None
+        self.router = PathRouter(((spec.path, Rule(spec, max_keys)) for spec in ruleset.paths),
+                                 default=self.global_rule)
+
+        # Disabled lists compile to no entries, so their index is empty
+        self.whitelist = IPIndex(ruleset.whitelist.ips)
+        self.blacklist = IPIndex(ruleset.blacklist.ips)
+
+    def match(self, path: str) -> Optional[Rule]:
+        """
+        Finds the rule that applies to a request path.
+
+        Args:
+            path: The request path.
+
+        Returns:
+            The matching rule, or None if no rule is enabled for the path.
+        """
+        return self.router.lookup(path)
+
+    def is_whitelisted(self, ip: str) -> bool:
+        """
+        Checks an address against the enabled whitelist.
+
+        Args:
+            ip: The client address.
+
+        Returns:
+            True if the whitelist is enabled and covers the address.
+        """
+        return ip in self.whitelist
+
+    def is_blacklisted(self, ip: str) -> bool:
+        """
+        Checks an address against the enabled blacklist.
+
+        Args:
+            ip: The client address.
+
+        Returns:
+            True if the blacklist is enabled and covers the address.
+        """
+        return ip in self.blacklist
+
+    def check(self, key: str, path: str, now: Optional[float] = None, client_ip: Optional[str] = None) -> str:
+        """
+        Decides whether a request may proceed and consumes a token if it does.
+
+        Args:
+            key: The value the matching rule limits by (IP, User-Agent or header value).
+            path: The request path.
+            now: The current time in seconds; defaults to time.monotonic().
+            client_ip: The client address for whitelist/blacklist checks. Defaults
+                to `key` when the matching rule limits by IP.
+
+        Returns:
+            ALLOWED, LIMITED or BLOCKED.
+        """
+        rule = self.match(path)
+        decision = self._screen(rule, key, client_ip)
+        if decision is not None:
+            return decision
+        if now is None:
+            now = time.monotonic()
+        return ALLOWED if rule.consume(key, now) else LIMITED
+
+    def retry_after(self, key: str, path: str, now: Optional[float] = None) -> float:
+        """
+        Computes how long a limited key has to wait before its next request on a path.
+
+        Args:
+            key: The value the matching rule limits by.
+            path: The request path.
+            now: The current time in seconds; defaults to time.monotonic().
+
+        Returns:
+            The number of seconds to wait (0.0 if a request would be allowed now).
+        """
+        rule = self.match(path)
+        if rule is None:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        return rule.retry_after(key, now)
+
+    def _screen(self, rule: Optional[Rule], key: str, client_ip: Optional[str]) -> Optional[str]:
+        """
+        Decides a request without touching any bucket, when the lists or a missing rule settle it.
+
+        Returns:
+            ALLOWED or BLOCKED, or None if the rule's bucket decides.
+        """
+        if self.whitelist or self.blacklist:
+            if client_ip is None and rule is not None and rule.limit_by == 'ip':
+                client_ip = key
+            if client_ip is not None:
+                if client_ip in self.whitelist:
+                    return ALLOWED
+                if client_ip in self.blacklist:
+                    return BLOCKED
+        if rule is None:
+            return ALLOWED
+        return None
+
+    @classmethod
+    def from_file(cls, config_path: str = 'config.yaml') -> Optional['RateLimiter']:
+        """
+        Builds a limiter from a configuration file.
+
+        Args:
+            config_path: Path to the configuration file.
+
+        Returns:
+            A RateLimiter, or None if the configuration could not be loaded.
+        """
+        config = load_config(config_path)
+        if config is None:
+            return None
+        return cls(config)
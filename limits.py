@@ -0,0 +1,426 @@
+# limits.py
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from artifact_cache import CACHE_FILE, ArtifactCache, config_fingerprint, write_lines_if_changed
+from ratelimit import load_config
+from ruleset import Ruleset, compile_config, write_lines
+
+# Backend name -> (generator module, line emitter). Modules are only
+# imported when their backend is requested.
+BACKENDS: Dict[str, Tuple[str, str]] = {
+    'nginx': ('ratelimit2nginx', 'iter_nginx_config'),
+    'apache': ('ratelimit2apache', 'iter_apache_config'),
+    'traefik': ('ratelimit2traefik', 'iter_traefik_config'),
+    'haproxy': ('ratelimit2haproxy', 'iter_haproxy_config'),
+}
+DEFAULT_OUTPUT_DIR = 'rate_limit_rules'
+EXECUTORS = ('process', 'thread')
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def iter_backend(backend: str, ruleset: Ruleset) -> Iterator[str]:
+    """
+    Runs the line emitter of one backend, importing its module on first use.
+
+    Args:
+        backend: A key of BACKENDS (e.g., 'nginx').
+        ruleset: The compiled Ruleset.
+
+    Returns:
+        An iterator over the generated configuration lines.
+    """
+    module_name, function_name = BACKENDS[backend]
+    emitter = getattr(importlib.import_module(module_name), function_name)
+    return emitter(ruleset)
+
+def emit_backend(backend: str, ruleset: Ruleset, path: str) -> Tuple[bool, str]:
+    """
+    Streams the configuration of one backend to its file.
+
+    Args:
+        backend: A key of BACKENDS.
+        ruleset: The compiled Ruleset.
+        path: The output file.
+
+    Returns:
+        A (written, SHA-256 hex digest of the output) tuple; the file is only
+        replaced when its content changed.
+    """
+    return write_lines_if_changed(path, iter_backend(backend, ruleset))
+
+def generate_backends(ruleset: Ruleset, backends: List[str], output_dir: str, jobs: Optional[int] = None,
+                      executor: str = 'process') -> Dict[str, Tuple[bool, str]]:
+    """
+    Generates the configuration files of several backends concurrently.
+
+    The config is parsed and compiled once by the caller; each worker streams
+    one backend straight to its file, so only a small result travels back.
+    A single backend, or jobs=1, runs in the calling process.
+
+    Args:
+        ruleset: The compiled Ruleset.
+        backends: The backends to generate, as keys of BACKENDS.
+        output_dir: The output root (see backend_output_path).
+        jobs: Maximum number of workers; defaults to one per backend, capped at the CPU count.
+        executor: 'process' to emit in worker processes, 'thread' to use a thread pool.
+
+    Returns:
+        A dictionary mapping each backend to its emit_backend result, in the requested order.
+    """
+    if jobs is None:
+        jobs = min(len(backends), os.cpu_count() or 1)
+    if jobs <= 1 or len(backends) <= 1:
+        return {backend: emit_backend(backend, ruleset, backend_output_path(output_dir, backend)) for backend in backends}
+
+    pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with pool_class(max_workers=jobs) as pool:
+        futures = {
+            backend: pool.submit(emit_backend, backend, ruleset, backend_output_path(output_dir, backend))
+            for backend in backends
+        }
+        return {backend: future.result() for backend, future in futures.items()}
+
+def backend_output_path(output_dir: str, backend: str) -> str:
+    """
+    Returns the path a backend's configuration is written to.
+
+    Args:
+        output_dir: The output root (e.g., 'rate_limit_rules').
+        backend: A key of BACKENDS.
+
+    Returns:
+        The path of `<output_dir>/<backend>/<backend>_rate_limit.conf`.
+    """
+    return os.path.join(output_dir, backend, f'{backend}_rate_limit.conf')
+
+def _parse_backends(value: str) -> List[str]:
+    """
+    Parses a comma-separated backend list for argparse.
+
+    Args:
+        value: The option value, e.g. 'nginx,haproxy' or 'all'.
+
+    Returns:
+        The selected backends, without duplicates.
+    """
+    if value == 'all':
+        return list(BACKENDS)
+    backends = []
+    for backend in (name.strip() for name in value.split(',')):
+        if backend not in BACKENDS:
+            raise argparse.ArgumentTypeError(f"unknown backend '{backend}' (choose from {', '.join(BACKENDS)})")
+        if backend not in backends:
+            backends.append(backend)
+    return backends
+
+def _cmd_generate(args: argparse.Namespace) -> int:
+    """
+    Implements `limits generate`.
+
+    Args:
+        args: The parsed command-line arguments.
+
+    Returns:
+        The process exit code.
+    """
+    config = load_config(args.config)
+    if config is None:
+        return 1
+    ruleset = compile_config(config)
+
+    if args.stdout:
+        for backend in args.backends:
+            write_lines(iter_backend(backend, ruleset), sys.stdout)
+        return 0
+
+    # Skip backends whose fingerprint and output file are unchanged since the last run
+    cache = ArtifactCache(os.path.join(args.output_dir, CACHE_FILE))
+    fingerprints = {backend: config_fingerprint(ruleset, BACKENDS[backend][0]) for backend in args.backends}
+    stale = [
+        backend for backend in args.backends
+        if args.force or not cache.is_fresh(backend, fingerprints[backend], backend_output_path(args.output_dir, backend))
+    ]
+    for backend in args.backends:
+        if backend not in stale:
+            logger.info(f"{backend} configuration is up to date")
+
+    if stale:
+        results = generate_backends(ruleset, stale, args.output_dir, args.jobs, args.executor)
+        for backend, (written, output_digest) in results.items():
+            if written:
+                logger.info(f"Wrote {backend} configuration to {backend_output_path(args.output_dir, backend)}")
+            else:
+                logger.info(f"{backend} configuration is unchanged")
+            cache.record(backend, fingerprints[backend], output_digest)
+        cache.save()
+    return 0
+
+def _parse_models(value: str) -> List[str]:
+    """
+    Parses a comma-separated list of simulation models for argparse.
+
+    Args:
+        value: The option value, e.g. 'nginx,haproxy'.
+
+    Returns:
+        The selected models, without duplicates.
+    """
+    from simulator import MODELS
+
+    models = []
+    for model in (name.strip() for name in value.split(',')):
+        if model not in MODELS:
+            raise argparse.ArgumentTypeError(f"unknown model '{model}' (choose from {', '.join(MODELS)})")
+        if model not in models:
+            models.append(model)
+    return models
+
+def _parse_percentile(value: str) -> float:
+    """
+    Parses a percentile (above 0, up to 100) for argparse.
+
+    Args:
+        value: The option value, e.g. '99.9'.
+
+    Returns:
+        The percentile.
+    """
+    try:
+        percentile = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid percentile '{value}'")
+    if not 0 < percentile <= 100:
+        raise argparse.ArgumentTypeError(f"percentile must be above 0 and at most 100, got {value}")
+    return percentile
+
+def _cmd_simulate(args: argparse.Namespace) -> int:
+    """
+    Implements `limits simulate`.
+
+    Args:
+        args: The parsed command-line arguments.
+
+    Returns:
+        The process exit code.
+    """
+    from simulator import create_simulator, format_report, iter_log_records, open_log
+
+    if args.compare:
+        if args.jobs != 1:
+            logger.error("Error: --compare replays every config in one process and cannot be combined with --jobs")
+            return 1
+        return _compare_configs(args)
+
+    config = load_config(args.config)
+    if config is None:
+        return 1
+    ruleset = compile_config(config)
+
+    try:
+        with open_log(args.log) as log:
+            if args.jobs == 1:
+                simulator = create_simulator(args.engine, ruleset, args.models)
+                for record in iter_log_records(log, args.format):
+                    simulator.feed(record)
+            else:
+                from parallel_simulator import simulate_parallel
+                simulator = simulate_parallel(ruleset, log, args.format, args.models, args.engine, args.jobs or None)
+    except (ImportError, RuntimeError) as e:
+        logger.error(f"Error: {e}")
+        return 1
+    except OSError as e:
+        logger.error(f"Error: cannot read access log {args.log}: {e}")
+        return 1
+
+    report = simulator.report(args.top)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        write_lines(format_report(report), sys.stdout)
+    return 0
+
+def _compare_configs(args: argparse.Namespace) -> int:
+    """
+    Implements `limits simulate --compare`: replays the log once through the
+    baseline config and every candidate, then prints the reject deltas.
+
+    Args:
+        args: The parsed command-line arguments.
+
+    Returns:
+        The process exit code.
+    """
+    from simulator import create_simulator, feed_all, format_comparison, iter_log_records, open_log
+
+    labels = [args.config] + args.compare
+    simulators = []
+    try:
+        for config_path in labels:
+            config = load_config(config_path)
+            if config is None:
+                return 1
+            simulators.append(create_simulator(args.engine, compile_config(config), args.models))
+        with open_log(args.log) as log:
+            feed_all(simulators, iter_log_records(log, args.format))
+    except (ImportError, RuntimeError) as e:
+        logger.error(f"Error: {e}")
+        return 1
+    except OSError as e:
+        logger.error(f"Error: cannot read access log {args.log}: {e}")
+        return 1
+
+    reports = [simulator.report(args.top) for simulator in simulators]
+    if args.json:
+        json.dump({'configs': labels, 'reports': reports}, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        write_lines(format_comparison(labels, reports), sys.stdout)
+    return 0
+
+def _cmd_analyze(args: argparse.Namespace) -> int:
+    """
+    Implements `limits analyze`.
+
+    Args:
+        args: The parsed command-line arguments.
+
+    Returns:
+        The process exit code.
+    """
+    from analyzer import LogAnalyzer, format_analysis, iter_blacklist_proposal, propose_blacklist
+    from simulator import iter_log_records, open_log
+
+    config = load_config(args.config)
+    if config is None:
+        return 1
+    ruleset = compile_config(config)
+
+    analyzer = LogAnalyzer(ruleset, max(args.capacity, args.top), args.window, args.percentile)
+    try:
+        with open_log(args.log) as log:
+            for record in iter_log_records(log, args.format):
+                analyzer.feed(record)
+    except OSError as e:
+        logger.error(f"Error: cannot read access log {args.log}: {e}")
+        return 1
+    analyzer.finish()
+
+    offenders = analyzer.offenders(args.threshold)
+    proposal = list(iter_blacklist_proposal(
+        propose_blacklist(ruleset, (ip for ip, _ in offenders), args.ipv4_prefix, args.ipv6_prefix),
+        args.threshold, len(offenders)))
+    if args.blacklist_out:
+        with open(args.blacklist_out, 'w') as f:
+            write_lines(proposal, f)
+        logger.info(f"Wrote blacklist proposal to {args.blacklist_out}")
+
+    patch: List[str] = []
+    if args.config_patch:
+        from config_patch import config_diff, update_rule_settings
+
+        with open(args.config) as f:
+            content = f.read()
+        patch = list(config_diff(args.config, content, update_rule_settings(content, analyzer.recommended_settings())))
+        if args.config_patch != '-':
+            with open(args.config_patch, 'w') as f:
+                write_lines(patch, f)
+            logger.info(f"Wrote recommended settings for {args.config} to {args.config_patch}")
+
+    report = analyzer.report(args.top)
+    if args.json:
+        report['offenders'] = [{'ip': ip, 'peak_rpm': round(rate, 1)} for ip, rate in offenders]
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        write_lines(format_analysis(report), sys.stdout)
+        if not args.blacklist_out:
+            write_lines([''] + proposal, sys.stdout)
+    if args.config_patch == '-':
+        # Keeps --json output parseable
+        write_lines(patch, sys.stderr if args.json else sys.stdout)
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the command-line parser of the `limits` tool.
+
+    Returns:
+        The argument parser.
+    """
+    parser = argparse.ArgumentParser(prog='limits', description='Rate limit configuration tooling driven by config.yaml.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help='Generate web server configurations.')
+    generate.add_argument('--config', default='config.yaml', help='Path to the configuration file (default: config.yaml).')
+    generate.add_argument('--backends', type=_parse_backends, default=list(BACKENDS),
+                          help=f"Comma-separated backends to generate, or 'all' (default: {','.join(BACKENDS)}).")
+    generate.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                          help=f'Root directory of the generated files (default: {DEFAULT_OUTPUT_DIR}).')
+    generate.add_argument('--stdout', action='store_true', help='Print the configurations instead of writing files.')
+    generate.add_argument('--force', action='store_true',
+                          help=f'Regenerate every backend, ignoring the {CACHE_FILE} generation cache.')
+    generate.add_argument('--jobs', type=int, help='Number of parallel workers (default: one per backend).')
+    generate.add_argument('--executor', choices=EXECUTORS, default='process',
+                          help='Run the emitters in worker processes or threads (default: process).')
+    generate.set_defaults(func=_cmd_generate)
+
+    simulate = subparsers.add_parser('simulate', help='Replay an access log through the configured limits.')
+    simulate.add_argument('log', help="Access log to replay, JSONL or combined format ('-' for stdin, .gz supported).")
+    simulate.add_argument('--config', default='config.yaml', help='Path to the configuration file (default: config.yaml).')
+    simulate.add_argument('--compare', action='append', metavar='CONFIG',
+                          help='Candidate configuration to evaluate against --config in the same pass; repeatable.')
+    simulate.add_argument('--format', choices=('auto', 'jsonl', 'combined'), default='auto',
+                          help='Log format (default: detected from the first line).')
+    simulate.add_argument('--models', type=_parse_models, default=['nginx', 'haproxy'],
+                          help='Comma-separated proxy semantics to model (default: nginx,haproxy).')
+    simulate.add_argument('--engine', choices=('scalar', 'vector'), default='scalar',
+                          help='Replay record by record, or in NumPy batches (default: scalar).')
+    simulate.add_argument('--jobs', type=int, default=1,
+                          help='Worker processes, each replaying a partition of the keys; 0 for one per CPU (default: 1).')
+    simulate.add_argument('--top', type=int, default=10, help='Most limited keys listed per rule (default: 10).')
+    simulate.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    simulate.set_defaults(func=_cmd_simulate)
+
+    analyze = subparsers.add_parser('analyze', help='Find the heaviest clients of an access log and propose blacklist entries.')
+    analyze.add_argument('log', help="Access log to analyze, JSONL or combined format ('-' for stdin, .gz supported).")
+    analyze.add_argument('--config', default='config.yaml', help='Path to the configuration file (default: config.yaml).')
+    analyze.add_argument('--format', choices=('auto', 'jsonl', 'combined'), default='auto',
+                         help='Log format (default: detected from the first line).')
+    analyze.add_argument('--top', type=int, default=20, help='Keys listed per kind (default: 20).')
+    analyze.add_argument('--capacity', type=int, default=100, help='Keys tracked per kind (default: 100).')
+    analyze.add_argument('--window', type=int, default=60,
+                         help='Seconds over which peak rates are measured (default: 60).')
+    analyze.add_argument('--threshold', type=float, default=600,
+                         help='Peak requests per minute from which a client address is an offender (default: 600).')
+    analyze.add_argument('--ipv4-prefix', type=int, default=32, choices=range(8, 33), metavar='{8..32}',
+                         help='Widen IPv4 offenders to networks of this prefix length (default: 32).')
+    analyze.add_argument('--ipv6-prefix', type=int, default=128, choices=range(16, 129), metavar='{16..128}',
+                         help='Widen IPv6 offenders to networks of this prefix length (default: 128).')
+    analyze.add_argument('--blacklist-out', metavar='PATH',
+                         help='Write the blacklist proposal to this file instead of printing it.')
+    analyze.add_argument('--config-patch', metavar='PATH',
+                         help="Write a diff of --config applying the recommended expected_keys, requests_per_minute "
+                              "and burst of each rule ('-' for stdout).")
+    analyze.add_argument('--percentile', type=_parse_percentile, default=99.9,
+                         help='Percentile of per-key request rates the recommended limits allow (default: 99.9).')
+    analyze.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    analyze.set_defaults(func=_cmd_analyze)
+
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# middleware.py
+import abc
+import logging
+import math
+import time
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple, Union
+
+from ip_index import IPIndex
+from limiter import DEFAULT_MAX_KEYS, RateLimiter, Rule
+from ruleset import Ruleset
+
+# Request paths whose resolved route is cached; the cache is reset when full
+ROUTE_CACHE_SIZE = 65536
+
+# Responses to limited and blacklisted requests
+LIMITED_STATUS = 429
+BLOCKED_STATUS = 403
+LIMITED_BODY = b'Too Many Requests\n'
+BLOCKED_BODY = b'Forbidden\n'
+
+logger = logging.getLogger(__name__)
+
+class _Enforcer(abc.ABC):
+    """
+    Decides requests for the middlewares, from the client address, path and headers.
+
+    The lists are checked first, as in the generated proxy configurations:
+    whitelisted clients always pass and blacklisted ones are refused with
+    403 whatever the rule limits by. Each request path is resolved once to
+    its rule and the header its key comes from; later requests on the same
+    path only do a dictionary lookup. Like Nginx, a request whose key is
+    empty (e.g., a missing header) is not limited. Keys may be client
+    controlled, so the buckets of each rule are capped (see limiter.Rule).
+    """
+
+    def __init__(self, limiter: Union[RateLimiter, Ruleset, Dict[str, Any]], trusted_proxies: Iterable[str] = (),
+                 max_keys: int = DEFAULT_MAX_KEYS):
+        """
+        Args:
+            limiter: The RateLimiter to enforce, or the config to build one from.
+            trusted_proxies: Addresses and networks of the proxies in front of the
+                service. A request from one of them is attributed to the last
+                untrusted address of its X-Forwarded-For header.
+            max_keys: The most buckets kept per rule when building the RateLimiter.
+        """
+        self.limiter = limiter if isinstance(limiter, RateLimiter) else RateLimiter(limiter, max_keys)
+        self.trusted_proxies = IPIndex(trusted_proxies)
+        # path -> (rule or None, header the key comes from or None for the client address)
+        self.routes: Dict[str, Tuple[Optional[Rule], Any]] = {}
+
+    def decide(self, path: str, client_ip: str, header: Callable[[Any], str]) -> Optional[Tuple[int, int]]:
+        """
+        Applies the limits to a request.
+
+        Args:
+            path: The request path.
+            client_ip: The client address.
+            header: Returns the value of a request header from its key (see _header_key).
+
+        Returns:
+            None if the request may proceed, else the (status, Retry-After seconds) of the refusal.
+        """
+        limiter = self.limiter
+        if limiter.whitelist and client_ip in limiter.whitelist:
+            return None
+        if limiter.blacklist and client_ip in limiter.blacklist:
+            return BLOCKED_STATUS, 0
+
+        try:
+            rule, header_key = self.routes[path]
+        except KeyError:
+            rule, header_key = self._route(path)
+        if rule is None:
+            return None
+        key = client_ip if header_key is None else header(header_key)
+        if not key:
+            return None
+        now = time.monotonic()
+        if rule.consume(key, now):
+            return None
+        return LIMITED_STATUS, max(1, int(math.ceil(rule.retry_after(key, now))))
+
+    def client_address(self, peer: str, forwarded_for: str) -> str:
+        """
+        Returns the client address of a request, looking past trusted proxies.
+
+        Args:
+            peer: The address of the connection's peer.
+            forwarded_for: The X-Forwarded-For header, empty if absent.
+        """
+        if not forwarded_for or not self.trusted_proxies or peer not in self.trusted_proxies:
+            return peer
+        hops = [hop.strip() for hop in forwarded_for.split(',')]
+        for hop in reversed(hops):
+            if hop not in self.trusted_proxies:
+                return hop
+        return hops[0]
+
+    def _route(self, path: str) -> Tuple[Optional[Rule], Any]:
+        rule = self.limiter.match(path)
+        if rule is None or rule.limit_by == 'ip':
+            route = rule, None
+        elif rule.limit_by == 'user_agent':
+            route = rule, self._header_key('user-agent')
+        else:
+            route = rule, self._header_key(rule.limit_by_header)
+        if len(self.routes) >= ROUTE_CACHE_SIZE:
+            self.routes.clear()
+        self.routes[path] = route
+        return route
+
+    @abc.abstractmethod
+    def _header_key(self, name: str) -> Any:
+        """
+        Returns how the server interface names a header (e.g., b'user-agent' or 'HTTP_USER_AGENT').
+        """
+
+class RateLimitMiddleware(_Enforcer):
+    """
+    ASGI middleware enforcing the limits of config.yaml.
+
+    Limited requests get a 429 with Retry-After and blacklisted clients a
+    403; other requests, and non-HTTP scopes, go to the wrapped application.
+
+        app = RateLimitMiddleware(app, RateLimiter.from_file('config.yaml'))
+    """
+
+    def __init__(self, app: Callable, limiter: Union[RateLimiter, Ruleset, Dict[str, Any]],
+                 trusted_proxies: Iterable[str] = (), max_keys: int = DEFAULT_MAX_KEYS):
+        """
+        Args:
+            app: The ASGI application.
+            limiter: See _Enforcer.
+            trusted_proxies: See _Enforcer.
+            max_keys: See _Enforcer.
+        """
+        super().__init__(limiter, trusted_proxies, max_keys)
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = scope['headers']
+
+        def header(name: bytes) -> str:
+            for key, value in headers:
+                if key == name:
+                    return value.decode('latin-1')
+            return ''
+
+        client = scope.get('client')
+        peer = client[0] if client else ''
+        client_ip = self.client_address(peer, header(b'x-forwarded-for')) if self.trusted_proxies else peer
+        # The proxies in front see the full path, mount point included; some
+        # servers already include root_path in path
+        path, root_path = scope['path'], scope.get('root_path', '')
+        if root_path and not path.startswith(root_path):
+            path = root_path + path
+        refusal = self.decide(path, client_ip, header)
+        if refusal is None:
+            await self.app(scope, receive, send)
+            return
+
+        status, retry_after = refusal
+        body = LIMITED_BODY if status == LIMITED_STATUS else BLOCKED_BODY
+        response_headers = [(b'content-type', b'text/plain; charset=utf-8'),
+                            (b'content-length', str(len(body)).encode('latin-1'))]
+        if retry_after:
+            response_headers.append((b'retry-after', str(retry_after).encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _header_key(self, name: str) -> bytes:
+        return name.lower().encode('latin-1')
+
+class WSGIRateLimitMiddleware(_Enforcer):
+    """
+    WSGI middleware enforcing the limits of config.yaml.
+
+    Limited requests get a 429 with Retry-After and blacklisted clients a
+    403; other requests go to the wrapped application.
+
+        app = WSGIRateLimitMiddleware(app, RateLimiter.from_file('config.yaml'))
+    """
+
+    def __init__(self, app: Callable, limiter: Union[RateLimiter, Ruleset, Dict[str, Any]],
+                 trusted_proxies: Iterable[str] = (), max_keys: int = DEFAULT_MAX_KEYS):
+        """
+        Args:
+            app: The WSGI application.
+            limiter: See _Enforcer.
+            trusted_proxies: See _Enforcer.
+            max_keys: See _Enforcer.
+        """
+        super().__init__(limiter, trusted_proxies, max_keys)
+        self.app = app
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        peer = environ.get('REMOTE_ADDR', '')
+        client_ip = (self.client_address(peer, environ.get('HTTP_X_FORWARDED_FOR', ''))
+                     if self.trusted_proxies else peer)
+        # The proxies in front see the full path, mount point included
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        refusal = self.decide(path or '/', client_ip, lambda key: environ.get(key, ''))
+        if refusal is None:
+            return self.app(environ, start_response)
+
+        status, retry_after = refusal
+        body = LIMITED_BODY if status == LIMITED_STATUS else BLOCKED_BODY
+        response_headers: List[Tuple[str, str]] = [('Content-Type', 'text/plain; charset=utf-8'),
+                                                   ('Content-Length', str(len(body)))]
+        if retry_after:
+            response_headers.append(('Retry-After', str(retry_after)))
+        start_response('429 Too Many Requests' if status == LIMITED_STATUS else '403 Forbidden', response_headers)
+        return [body]
+
+    def _header_key(self, name: str) -> str:
+        return 'HTTP_' + name.upper().replace('-', '_')
@@ -0,0 +1,352 @@
+# parallel_simulator.py
+import logging
+import os
+import struct
+import traceback
+import zlib
+from array import array
+from itertools import accumulate
+from multiprocessing import get_context, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Iterable, Iterator, List, NoReturn, Optional, TextIO, Tuple
+
+from ruleset import RuleSpec, Ruleset
+from simulator import (HAPROXY_MODEL, MODELS, Simulator, create_simulator, detect_log_format, extract_key,
+                       get_log_parser, iter_log_records)
+
+# Characters of log text parsed by one worker at a time
+DEFAULT_BLOCK_SIZE = 4 << 20
+
+# Header of a partition segment: record count, key text size in bytes
+SEGMENT_HEADER = struct.Struct('<qq')
+
+logger = logging.getLogger(__name__)
+
+class _WorkerFailure:
+    """
+    Reply of a worker whose command raised, carrying the formatted traceback.
+    """
+
+    __slots__ = ('traceback',)
+
+    def __init__(self, traceback_text: str):
+        self.traceback = traceback_text
+
+class _Partition:
+    """
+    Admitted requests of one block that belong to one key partition, in log order.
+    """
+
+    __slots__ = ('times', 'rules', 'lengths', 'keys')
+
+    def __init__(self):
+        self.times = array('q')
+        self.rules = array('i')
+        self.lengths = array('i')
+        self.keys: List[str] = []
+
+    def append(self, now: int, rule_index: int, global_key: str, path_key: str) -> None:
+        self.times.append(now)
+        self.rules.append(rule_index)
+        self.lengths.append(len(global_key))
+        self.lengths.append(len(path_key))
+        self.keys.append(global_key)
+        self.keys.append(path_key)
+
+    def share(self) -> Optional[Tuple[str, int]]:
+        """
+        Copies the requests into a new shared-memory segment; the reader unlinks it.
+
+        Returns:
+            The (segment name, size) tuple, or None if the partition is empty.
+        """
+        if not self.times:
+            return None
+        text = ''.join(self.keys).encode('utf-8', 'surrogatepass')
+        data = b''.join((SEGMENT_HEADER.pack(len(self.times), len(text)), self.times.tobytes(),
+                         self.rules.tobytes(), self.lengths.tobytes(), text))
+        return _share_bytes(data)
+
+def can_partition(ruleset: Ruleset, models: Iterable[str]) -> bool:
+    """
+    Checks whether a replay can be split by key.
+
+    Under the nginx model each request is limited by a single rule, so
+    requests can always be partitioned by that rule's key. Under the haproxy
+    model a request goes through the global rule and then its path rule, so
+    both must limit by the same key.
+
+    Args:
+        ruleset: The compiled Ruleset.
+        models: The models to evaluate.
+
+    Returns:
+        True if the limiter state of every partition is independent.
+    """
+    if HAPROXY_MODEL not in models:
+        return True
+    rules = ([ruleset.global_rule] if ruleset.global_rule else []) + list(ruleset.paths)
+    return len({_key_source(rule) for rule in rules}) <= 1
+
+def simulate_parallel(ruleset: Ruleset, stream: TextIO, log_format: str = 'auto', models: Iterable[str] = MODELS,
+                      engine: str = 'scalar', jobs: Optional[int] = None,
+                      block_size: int = DEFAULT_BLOCK_SIZE) -> Simulator:
+    """
+    Replays an access log with one worker process per key partition.
+
+    The log is read in blocks of lines that go to the workers through
+    shared memory. Each worker parses one block per round, and splits the
+    admitted requests by a hash of their limit_by key into one shared-memory
+    segment per partition. Each worker then replays the segments of its
+    own partition in log order. Limiter state never leaves its worker. The
+    statistics are merged at the end: request counts, rejections and first
+    rejects match a single-process replay. The most limited keys match too
+    while no rule has more than 2 * TOP_KEYS_CAPACITY distinct limited keys
+    in a worker. Past that, each worker prunes its keys to the largest
+    counts (see simulator.TopKeys), so the tail of the list may differ
+    from a single-process replay.
+
+    When the requests cannot be partitioned by key (see can_partition), the
+    log is replayed in this process.
+
+    Args:
+        ruleset: The compiled Ruleset.
+        stream: The log text stream (see simulator.open_log).
+        log_format: 'jsonl', 'combined', or 'auto' to detect it from the first non-empty line.
+        models: The models to evaluate.
+        engine: The replay engine of each worker (see simulator.ENGINES).
+        jobs: Number of worker processes; defaults to the CPU count.
+        block_size: Approximate characters of log text per block.
+
+    Returns:
+        A simulator holding the merged totals and statistics; call report() on it.
+
+    Raises:
+        ImportError: If the engine's optional dependencies are missing.
+        RuntimeError: If a worker raised or exited early; the message holds its traceback or exit code.
+    """
+    models = tuple(models)
+    jobs = jobs or os.cpu_count() or 1
+    # Also checks that the engine is available before any worker starts
+    merged = create_simulator(engine, ruleset, models)
+    if jobs > 1 and not can_partition(ruleset, models):
+        logger.warning("Global and path rules limit by different keys, which the haproxy model cannot partition; replaying in one process")
+        jobs = 1
+    if jobs <= 1:
+        for record in iter_log_records(stream, log_format):
+            merged.feed(record)
+        merged.flush()
+        return merged
+
+    lines = stream.readlines(block_size)
+    if log_format == 'auto':
+        log_format = detect_log_format(next((line for line in lines if line.strip()), ''))
+
+    # Segments are unlinked by the process that reads them; starting the
+    # resource tracker first makes the workers share it with this process,
+    # so those segments are not reported as leaked at exit
+    resource_tracker.ensure_running()
+    context = get_context()
+    connections = []
+    workers = []
+    for _ in range(jobs):
+        parent_end, worker_end = context.Pipe()
+        worker = context.Process(target=_worker, args=(worker_end, ruleset, models, engine, jobs, log_format),
+                                 daemon=True)
+        worker.start()
+        worker_end.close()
+        connections.append(parent_end)
+        workers.append(worker)
+
+    malformed = 0
+    try:
+        while lines:
+            # Each round, every worker parses one block, then replays its partition of all of them
+            blocks = [lines]
+            while len(blocks) < jobs:
+                lines = stream.readlines(block_size)
+                if not lines:
+                    break
+                blocks.append(lines)
+            segments = [_share_bytes(''.join(block).encode('utf-8', 'surrogatepass')) for block in blocks]
+            for index, segment in enumerate(segments):
+                _send(connections, workers, index, ('parse', segment))
+            outputs = [_receive(connections, workers, index) for index in range(len(segments))]
+            for index in range(jobs):
+                _send(connections, workers, index, ('replay', [output[index] for output in outputs]))
+            # Read the next round while the workers replay
+            lines = stream.readlines(block_size)
+            for index in range(jobs):
+                _receive(connections, workers, index)
+
+        for index in range(jobs):
+            _send(connections, workers, index, ('finish', None))
+        for index in range(jobs):
+            simulator, worker_malformed = _receive(connections, workers, index)
+            merged.merge(simulator)
+            malformed += worker_malformed
+    finally:
+        for connection in connections:
+            connection.close()
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+    if malformed:
+        logger.warning(f"Skipped {malformed} malformed log lines")
+    return merged
+
+def _worker(connection, ruleset: Ruleset, models: Tuple[str, ...], engine: str, jobs: int, log_format: str) -> None:
+    """
+    Serves parse and replay requests of simulate_parallel until told to finish.
+
+    Messages are (command, argument) tuples:
+
+    * ('parse', segment): parse a block of log text, admit its records and
+      reply with one partition segment (or None) per worker.
+    * ('replay', segments): replay this worker's partition of the last
+      blocks, in order, and reply None.
+    * ('finish', None): reply with (simulator, malformed line count) and exit.
+
+    A command that raises is answered with a _WorkerFailure and ends the worker.
+    """
+    try:
+        _serve(connection, ruleset, models, engine, jobs, log_format)
+    except EOFError:
+        # The parent is gone
+        pass
+    except Exception:
+        try:
+            connection.send(_WorkerFailure(traceback.format_exc()))
+        except OSError:
+            pass
+    finally:
+        connection.close()
+
+def _serve(connection, ruleset: Ruleset, models: Tuple[str, ...], engine: str, jobs: int, log_format: str) -> None:
+    """
+    Runs the command loop of _worker.
+    """
+    simulator = create_simulator(engine, ruleset, models)
+    parse = get_log_parser(log_format)
+    global_rule = ruleset.global_rule
+    path_index = {rule.name: index for index, rule in enumerate(ruleset.paths)}
+    malformed = 0
+
+    while True:
+        command, argument = connection.recv()
+        if command == 'parse':
+            partitions = [_Partition() for _ in range(jobs)]
+            for line in _read_shared(argument).decode('utf-8', 'surrogatepass').split('\n'):
+                if not line.strip():
+                    continue
+                record = parse(line)
+                if record is None:
+                    malformed += 1
+                    continue
+                admitted = simulator.admit(record)
+                if admitted is None:
+                    continue
+                now, path_rule = admitted
+                global_key = extract_key(global_rule, record) if global_rule is not None else ''
+                if path_rule is None:
+                    rule_index, path_key, partition_key = -1, '', global_key
+                else:
+                    rule_index, path_key = path_index[path_rule.name], extract_key(path_rule, record)
+                    partition_key = path_key
+                partitions[zlib.crc32(partition_key.encode('utf-8', 'surrogatepass')) % jobs].append(
+                    now, rule_index, global_key, path_key)
+            connection.send([partition.share() for partition in partitions])
+        elif command == 'replay':
+            for segment in argument:
+                if segment is None:
+                    continue
+                for now, rule_index, global_key, path_key in _iter_segment(segment):
+                    simulator.replay(now, ruleset.paths[rule_index] if rule_index >= 0 else None, global_key, path_key)
+            connection.send(None)
+        else:
+            simulator.flush()
+            connection.send((simulator, malformed))
+            return
+
+def _send(connections: List[Any], workers: List[Any], index: int, message: Any) -> None:
+    """
+    Sends a command to a worker, failing clearly if it has exited.
+    """
+    try:
+        connections[index].send(message)
+    except OSError:
+        _raise_exited(workers, index)
+
+def _receive(connections: List[Any], workers: List[Any], index: int) -> Any:
+    """
+    Receives the reply of a worker, raising its error if it failed or exited.
+    """
+    try:
+        reply = connections[index].recv()
+    except (EOFError, OSError):
+        _raise_exited(workers, index)
+    if isinstance(reply, _WorkerFailure):
+        raise RuntimeError(f"replay worker {index} failed:\n{reply.traceback.rstrip()}")
+    return reply
+
+def _raise_exited(workers: List[Any], index: int) -> NoReturn:
+    """
+    Raises the error of a worker whose pipe broke, with its exit code.
+    """
+    workers[index].join(timeout=5)
+    raise RuntimeError(f"replay worker {index} exited with code {workers[index].exitcode}") from None
+
+def _iter_segment(segment: Tuple[str, int]) -> Iterator[Tuple[int, int, str, str]]:
+    """
+    Reads and unlinks a partition segment.
+
+    Yields:
+        (time, path rule index or -1, global key, path key) tuples, in log order.
+    """
+    data = _read_shared(segment)
+    count, text_size = SEGMENT_HEADER.unpack_from(data)
+    times, rules, lengths = array('q'), array('i'), array('i')
+    offset = SEGMENT_HEADER.size
+    for values, items in ((times, count), (rules, count), (lengths, 2 * count)):
+        end = offset + items * values.itemsize
+        values.frombytes(data[offset:end])
+        offset = end
+    text = data[offset:offset + text_size].decode('utf-8', 'surrogatepass')
+    bounds = list(accumulate(lengths, initial=0))
+    for index in range(count):
+        yield (times[index], rules[index], text[bounds[2 * index]:bounds[2 * index + 1]],
+               text[bounds[2 * index + 1]:bounds[2 * index + 2]])
+
+def _key_source(rule: RuleSpec) -> Tuple[str, str]:
+    """
+    Returns what a rule limits by, e.g. ('header_name', 'x-api-key').
+    """
+    if rule.limit_by == 'header_name':
+        return rule.limit_by, rule.limit_by_header.lower()
+    return rule.limit_by, ''
+
+def _share_bytes(data: bytes) -> Tuple[str, int]:
+    """
+    Copies bytes into a new shared-memory segment.
+
+    Returns:
+        The (segment name, size) tuple.
+    """
+    segment = SharedMemory(create=True, size=max(len(data), 1))
+    segment.buf[:len(data)] = data
+    segment.close()
+    return segment.name, len(data)
+
+def _read_shared(segment: Tuple[str, int]) -> bytes:
+    """
+    Copies the content of a shared-memory segment and unlinks it.
+    """
+    name, size = segment
+    shared = SharedMemory(name=name)
+    try:
+        return bytes(shared.buf[:size])
+    finally:
+        shared.close()
+        shared.unlink()
@@ -0,0 +1,110 @@
+# path_router.py
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Tuple
+
+from ratelimit import is_regex_path
+
+# Key under which a trie node stores the value of the prefix ending there
+_TERMINAL = None
+
+# Constructs that break or change meaning once a pattern is wrapped in a group
+# of a larger alternation: global inline flags, numbered backreferences and
+# numbered conditionals
+_UNCOMBINABLE = re.compile(r'\(\?[aiLmsux]+\)|\\[1-9]|\(\?\(\d')
+
+logger = logging.getLogger(__name__)
+
+class PathRouter:
+    """
+    Compiled matcher for the 'paths' section of config.yaml.
+
+    Plain prefixes are stored in a character trie and the regex paths are
+    merged into a single alternation, so a lookup costs one walk over the
+    request path plus one regex match, however many rules there are. A
+    pattern that cannot be merged safely (global inline flags such as
+    `(?i)`, numbered backreferences, a group name used by another pattern)
+    is matched on its own, at its place in config order.
+
+    Precedence follows Nginx location matching: the first regex path (in
+    config order) that matches wins, otherwise the longest matching prefix,
+    otherwise the default value.
+    """
+
+    def __init__(self, routes: Iterable[Tuple[str, Any]], default: Any = None):
+        """
+        Args:
+            routes: (path, value) pairs in config order.
+            default: The value returned when no path matches.
+        """
+        self.default = default
+        self._root: Dict[Any, Any] = {}
+        # (pattern, value per alternative group or None if matched alone, value if alone), in config order
+        self._regexes: List[Tuple[Pattern, Optional[Dict[str, Any]], Any]] = []
+        merged: List[Tuple[str, Any]] = []
+        merged_names: set = set()
+
+        for path, value in routes:
+            if is_regex_path(path):
+                try:
+                    names = set(re.compile(path).groupindex)
+                except re.error as e:
+                    logger.error(f"Error: Invalid regex path {path}: {e}")
+                    continue
+                if _UNCOMBINABLE.search(path):
+                    self._merge(merged)
+                    merged, merged_names = [], set()
+                    self._regexes.append((re.compile(path), None, value))
+                    continue
+                if names & merged_names:
+                    self._merge(merged)
+                    merged, merged_names = [], set()
+                merged.append((path, value))
+                merged_names |= names
+            else:
+                node = self._root
+                for char in path:
+                    node = node.setdefault(char, {})
+                node.setdefault(_TERMINAL, value)
+
+        self._merge(merged)
+
+    def lookup(self, path: str) -> Any:
+        """
+        Finds the value of the most specific rule matching a request path.
+
+        Args:
+            path: The request path.
+
+        Returns:
+            The value of the matching rule, or the default value.
+        """
+        for regex, values, value in self._regexes:
+            match = regex.match(path)
+            if match is not None:
+                return value if values is None else values[match.lastgroup]
+
+        node = self._root
+        best = node.get(_TERMINAL, self.default)
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            if _TERMINAL in node:
+                best = node[_TERMINAL]
+        return best
+
+    def _merge(self, routes: List[Tuple[str, Any]]) -> None:
+        """
+        Compiles consecutive regex paths into one alternation, or each on its own if that fails.
+        """
+        if not routes:
+            return
+        values = {f'_r{index}': value for index, (_, value) in enumerate(routes)}
+        try:
+            regex = re.compile('|'.join(f'(?P<_r{index}>{path})' for index, (path, _) in enumerate(routes)))
+        except re.error as e:
+            logger.warning(f"Cannot merge regex paths into one pattern ({e}); matching them one by one")
+            self._regexes.extend((re.compile(path), None, value) for path, value in routes)
+            return
+        self._regexes.append((regex, values, None))
@@ -1,4 +1,7 @@
 # ratelimit.py
+import hashlib
+import os
+import pickle
 import yaml
 import logging
 from typing import Dict, Any, List, Optional
@@ -13,32 +16,77 @@ IPS_KEY = 'ips'
 ENABLED_KEY = 'enabled'
 LIMIT_BY_KEY = 'limit_by'
 LOG_LEVEL_KEY = 'log_level'
+REQUESTS_PER_MINUTE_KEY = 'requests_per_minute'
+WINDOW_KEY = 'window'
+BURST_KEY = 'burst'
+LIMIT_BY_HEADER_KEY = 'limit_by_header'
+EXPECTED_KEYS_KEY = 'expected_keys'
 
 # Valid values for certain fields
 VALID_LIMIT_BY_VALUES = {'ip', 'user_agent', 'header_name'}
 VALID_LOG_LEVELS = {'debug', 'info', 'warning', 'error'}
 
+# Window suffixes and their length in seconds
+WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+DEFAULT_WINDOW_SECONDS = 60
+
+# libyaml's loader is much faster than the pure-Python one; use it when PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Sidecar cache of the validated config, stored next to the config file as
+# .<name>.cache. Bump the format when the cached layout changes.
+CONFIG_CACHE_FORMAT = 2
+CONFIG_CACHE_SUFFIX = '.cache'
+
+# Characters that mark a 'paths' key as a regular expression rather than a prefix
+REGEX_PATH_CHARS = frozenset('^$*+?()[]{}|\\')
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def load_config(config_path: str = 'config.yaml') -> Optional[Dict[str, Any]]:
+def load_config(config_path: str = 'config.yaml', use_cache: bool = True) -> Optional[Dict[str, Any]]:
     """
     Load rate limit settings from config.yaml and validate them.
 
+    The validated config is kept in a pickle sidecar next to the file, keyed
+    by the SHA-256 of its content, so repeated loads of an unchanged file
+    skip YAML parsing and validation; the file is still read and hashed on
+    every load, which costs far less than parsing. The sidecar is unpickled,
+    so the config directory must only be writable by trusted users.
+
     Args:
         config_path: Path to the configuration file.
+        use_cache: Whether to read and write the sidecar cache.
 
     Returns:
         A dictionary containing the validated configuration, or None if loading fails.
     """
     try:
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-            if config is None:
-                logger.error("Error: config file is empty")
-                return None
-            return _validate_config(config)
+        with open(config_path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        cache_path = _config_cache_path(config_path)
+        cached = _read_config_cache(cache_path) if use_cache else None
+        if cached and cached['sha256'] == digest:
+            return cached['config']
+
+        config = yaml.load(content, Loader=YAML_LOADER)
+        if config is None:
+            logger.error("Error: config file is empty")
+            return None
+        config = _validate_config(config)
+        if config is None:
+            return None
+
+        if use_cache:
+            _write_config_cache(cache_path, {
+                'format': CONFIG_CACHE_FORMAT,
+                'loader': _loader_version(),
+                'sha256': digest,
+                'config': config,
+            })
+        return config
     except FileNotFoundError:
         logger.error(f"Error: config file not found at {config_path}")
         return None
@@ -46,6 +94,73 @@ def load_config(config_path: str = 'config.yaml') -> Optional[Dict[str, Any]]:
         logger.error(f"Error parsing YAML: {e}")
         return None
 
+def _config_cache_path(config_path: str) -> str:
+    """
+    Returns the sidecar cache path of a configuration file.
+
+    Args:
+        config_path: Path to the configuration file.
+
+    Returns:
+        The path of `.<name>.cache` in the same directory.
+    """
+    directory, name = os.path.split(config_path)
+    return os.path.join(directory, f'.{name}{CONFIG_CACHE_SUFFIX}')
+
+def _loader_version() -> str:
+    """
+    Fingerprints this module's source, so cached configs are invalidated when
+    the validation rules or their defaults change.
+
+    Returns:
+        A hex digest.
+    """
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _read_config_cache(cache_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Reads the sidecar cache of a configuration file.
+
+    Args:
+        cache_path: The sidecar cache path.
+
+    Returns:
+        The cache record, or None if it is missing, unreadable or was written
+        by another cache format or loader version.
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.debug(f"Ignoring unreadable config cache {cache_path}: {e}")
+        return None
+    if not isinstance(cached, dict) or cached.get('format') != CONFIG_CACHE_FORMAT or cached.get('loader') != _loader_version():
+        return None
+    return cached
+
+def _write_config_cache(cache_path: str, record: Dict[str, Any]) -> None:
+    """
+    Writes the sidecar cache atomically; failures (e.g., a read-only directory) are ignored.
+
+    Args:
+        cache_path: The sidecar cache path.
+        record: The cache record.
+    """
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.debug(f"Could not write config cache {cache_path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
 def _validate_config(config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """
     Validates the loaded configuration, setting default values and ensuring
@@ -90,15 +205,19 @@ def _validate_global_section(config: Dict[str, Any]) -> bool:
 
     global_settings = config[GLOBAL_SECTION]
     global_settings.setdefault(ENABLED_KEY, True)
-    global_settings.setdefault('requests_per_minute', 60)
-    global_settings.setdefault('burst', 20)
-    global_settings.setdefault('window', '1m')
+    global_settings.setdefault(REQUESTS_PER_MINUTE_KEY, 60)
+    global_settings.setdefault(BURST_KEY, 20)
+    global_settings.setdefault(WINDOW_KEY, '1m')
     global_settings.setdefault(LIMIT_BY_KEY, 'ip')
 
     if global_settings[LIMIT_BY_KEY] not in VALID_LIMIT_BY_VALUES:
         logger.error(f"Error: Invalid '{LIMIT_BY_KEY}' value in global section")
         return False
 
+    if not _is_valid_expected_keys(global_settings.get(EXPECTED_KEYS_KEY)):
+        logger.error(f"Error: '{EXPECTED_KEYS_KEY}' must be a positive integer in global section")
+        return False
+
     return True
 
 def _validate_paths_section(paths_config: Dict[str, Any]) -> bool:
@@ -117,17 +236,35 @@ def _validate_paths_section(paths_config: Dict[str, Any]) -> bool:
 
     for path, settings in paths_config.items():
         settings.setdefault(ENABLED_KEY, True)
-        settings.setdefault('requests_per_minute', 60)
-        settings.setdefault('burst', 20)
-        settings.setdefault('window', '1m')
+        settings.setdefault(REQUESTS_PER_MINUTE_KEY, 60)
+        settings.setdefault(BURST_KEY, 20)
+        settings.setdefault(WINDOW_KEY, '1m')
         settings.setdefault(LIMIT_BY_KEY, 'ip')
 
         if settings[LIMIT_BY_KEY] not in VALID_LIMIT_BY_VALUES:
             logger.error(f"Error: Invalid '{LIMIT_BY_KEY}' value for path {path}")
             return False
 
+        if not _is_valid_expected_keys(settings.get(EXPECTED_KEYS_KEY)):
+            logger.error(f"Error: '{EXPECTED_KEYS_KEY}' must be a positive integer for path {path}")
+            return False
+
     return True
 
+def _is_valid_expected_keys(expected_keys: Any) -> bool:
+    """
+    Checks the optional 'expected_keys' setting of a rule.
+
+    Args:
+        expected_keys: The value of 'expected_keys', or None if it is not set.
+
+    Returns:
+        True if the setting is absent or a positive integer, False otherwise.
+    """
+    if expected_keys is None:
+        return True
+    return isinstance(expected_keys, int) and not isinstance(expected_keys, bool) and expected_keys > 0
+
 def _validate_list_section(list_config: Dict[str, Any], section_name: str) -> bool:
     """
     Validates the 'whitelist' or 'blacklist' section of the configuration.
@@ -166,6 +303,41 @@ def _validate_advanced_section(advanced_config: Dict[str, Any]) -> bool:
 
     return True
 
+def parse_window_seconds(window: Any) -> int:
+    """
+    Converts a window setting to a number of seconds.
+
+    Args:
+        window: The window value (e.g., '1m', '30s', '2h' or a bare number of seconds).
+
+    Returns:
+        The window length in seconds, or DEFAULT_WINDOW_SECONDS if it cannot be parsed.
+    """
+    if isinstance(window, (int, float)) and not isinstance(window, bool):
+        return int(window) if window > 0 else DEFAULT_WINDOW_SECONDS
+
+    window = str(window).strip()
+    amount, unit = window, 1
+    if window[-1:] in WINDOW_UNITS:
+        amount, unit = window[:-1], WINDOW_UNITS[window[-1]]
+
+    if not amount.isdigit() or int(amount) == 0:
+        logger.warning(f"Invalid window '{window}', falling back to {DEFAULT_WINDOW_SECONDS}s")
+        return DEFAULT_WINDOW_SECONDS
+    return int(amount) * unit
+
+def is_regex_path(path: str) -> bool:
+    """
+    Tells whether a 'paths' key is a regular expression or a plain prefix.
+
+    Args:
+        path: The path key from the 'paths' section.
+
+    Returns:
+        True if the path contains regex metacharacters, False otherwise.
+    """
+    return any(char in REGEX_PATH_CHARS for char in path)
+
 if __name__ == '__main__':
     config = load_config()
     if config:
@@ -1,251 +1,399 @@
 # ratelimit2haproxy.py
-import yaml
+import argparse
+import math
+import os
+import posixpath
 import logging
-import re
-from typing import Dict, Any, List, Optional
-
-# Constants for repeated strings
-GLOBAL_SECTION = 'global'
-PATHS_SECTION = 'paths'
-WHITELIST_SECTION = 'whitelist'
-BLACKLIST_SECTION = 'blacklist'
-ADVANCED_SECTION = 'advanced'
-IPS_KEY = 'ips'
-ENABLED_KEY = 'enabled'
-LIMIT_BY_KEY = 'limit_by'
-LOG_LEVEL_KEY = 'log_level'
-REQUESTS_PER_MINUTE_KEY = 'requests_per_minute'
-WINDOW_KEY = 'window'
-BURST_KEY = 'burst'
-
-# Valid values for certain fields
-VALID_LIMIT_BY_VALUES = {'ip', 'user_agent', 'header_name'}
-VALID_LOG_LEVELS = {'debug', 'info', 'warning', 'error'}
+import sys
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Tuple, Union
+
+from ratelimit import load_config
+from ruleset import RuleSpec, Ruleset, compile_config, ensure_ruleset, write_lines
+
+# External ACL files for the whitelist/blacklist
+WHITELIST_ACL_FILE = 'whitelist.lst'
+BLACKLIST_ACL_FILE = 'blacklist.lst'
+DEFAULT_ACL_DIR = '/etc/haproxy'
+
+# Map files resolving request paths to rules
+PATHS_MAP_FILE = 'paths.map'
+PATHS_REGEX_MAP_FILE = 'paths_reg.map'
+
+# Stick-table settings
+STICK_TABLES_MARKER = '# Stick tables (top-level sections, keep outside the frontend)'
+DEFAULT_TABLE_SIZE = '100k'
+TABLE_SIZE_HEADROOM = 1.25
+STRING_KEY_LENGTH = 128
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def load_config(config_path: str = 'config.yaml') -> Optional[Dict[str, Any]]:
+def generate_haproxy_config(config: Union[Ruleset, Dict[str, Any]], acl_dir: Optional[str] = None,
+                            map_dir: Optional[str] = None) -> str:
     """
-    Load rate limit settings from config.yaml.
+    Generates HAProxy rate limiting configuration from the loaded config.
 
     Args:
-        config_path: Path to the configuration file.
+        config: The compiled Ruleset, or a validated configuration dictionary.
+        acl_dir: See iter_haproxy_config.
+        map_dir: See iter_haproxy_config.
 
     Returns:
-        A dictionary containing the validated configuration, or None if loading fails.
+        A string containing the generated HAProxy configuration.
     """
-    try:
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-            if config is None:
-                logger.error("Error: config file is empty")
-                return None
-            return _validate_config(config)
-    except FileNotFoundError:
-        logger.error(f"Error: config file not found at {config_path}")
-        return None
-    except yaml.YAMLError as e:
-        logger.error(f"Error parsing YAML: {e}")
-        return None
+    return "\n".join(iter_haproxy_config(config, acl_dir, map_dir))
 
-def _validate_config(config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+def iter_haproxy_config(config: Union[Ruleset, Dict[str, Any]], acl_dir: Optional[str] = None,
+                        map_dir: Optional[str] = None) -> Iterator[str]:
     """
-    Validates the loaded configuration, setting default values and ensuring
-    required keys are present.
+    Emits the HAProxy rate limiting configuration line by line.
 
     Args:
-        config: The raw configuration dictionary loaded from the YAML file.
+        config: The compiled Ruleset, or a validated configuration dictionary.
+        acl_dir: If set, the whitelist/blacklist are referenced as external ACL
+            files in this directory (see iter_haproxy_acl_files) instead of
+            being written inline, one `acl` line per entry.
+        map_dir: If set, path rules are resolved with a single lookup in the map
+            files of this directory (see iter_haproxy_path_maps) instead of
+            one ACL and deny rule per path.
+
+    Yields:
+        The configuration lines, without trailing newlines.
+    """
+    ruleset = ensure_ruleset(config)
 
-    Returns:
-        A validated configuration dictionary, or None if validation fails.
+    # Whitelist Configuration
+    if ruleset.whitelist.enabled:
+        if acl_dir:
+            yield f'acl whitelist src -f {posixpath.join(acl_dir, WHITELIST_ACL_FILE)}'
+        else:
+            for ip in ruleset.whitelist.ips:
+                yield f'acl whitelist src {ip}'
+        yield 'http-request allow if whitelist'
+
+    # Blacklist Configuration
+    if ruleset.blacklist.enabled:
+        if acl_dir:
+            yield f'acl blacklist src -f {posixpath.join(acl_dir, BLACKLIST_ACL_FILE)}'
+        else:
+            for ip in ruleset.blacklist.ips:
+                yield f'acl blacklist src {ip}'
+        yield 'http-request deny if blacklist'
+
+    # Global rate limiting settings, tracked on counter 0
+    global_rule = ruleset.global_rule
+    if global_rule:
+        fetch, _ = _get_track_key(global_rule)
+        yield f'http-request track-sc0 {fetch} table st_global'
+        yield f'http-request deny deny_status 429 if {{ sc_http_req_rate(0) gt {global_rule.requests_per_minute} }}'
+
+    # Path-specific limits, tracked on counter 1. A request only belongs to its
+    # most specific rule, so each rule excludes the earlier ones that may match.
+    if map_dir:
+        yield from _iter_path_map_rules(ruleset, map_dir)
+    else:
+        earlier: List[RuleSpec] = []
+        for rule in ruleset.paths_by_precedence:
+            fetch, _ = _get_track_key(rule)
+            if rule.is_regex:
+                yield f'acl is_{rule.ident} path_reg {_anchored(rule.path)}'
+            else:
+                yield f'acl is_{rule.ident} path_beg {rule.path}'
+            condition = ' '.join([f'is_{rule.ident}'] + [f'!is_{other.ident}'
+                                                         for other in _shadowing_rules(rule, earlier)])
+            yield f'http-request track-sc1 {fetch} table st_{rule.ident} if {condition}'
+            yield f'http-request deny deny_status 429 if {condition} {{ sc_http_req_rate(1) gt {rule.requests_per_minute} }}'
+            earlier.append(rule)
+
+    # Stick tables are top-level sections and must be placed outside the frontend
+    if global_rule or ruleset.paths:
+        yield STICK_TABLES_MARKER
+        yield from _iter_stick_tables(ruleset, bool(map_dir))
+
+def generate_haproxy_acl_files(config: Union[Ruleset, Dict[str, Any]]) -> Dict[str, str]:
     """
-    if not _validate_global_section(config):
-        return None
+    Generates the external ACL files referenced by `acl ... src -f`.
 
-    if PATHS_SECTION in config and not _validate_paths_section(config[PATHS_SECTION]):
-        return None
+    Args:
+        config: The compiled Ruleset, or a validated configuration dictionary.
 
-    if WHITELIST_SECTION in config and not _validate_list_section(config[WHITELIST_SECTION], WHITELIST_SECTION):
-        return None
+    Returns:
+        A dictionary mapping file names to their content, for each enabled list.
+    """
+    return {file_name: ''.join(f'{line}\n' for line in lines)
+            for file_name, lines in iter_haproxy_acl_files(config).items()}
 
-    if BLACKLIST_SECTION in config and not _validate_list_section(config[BLACKLIST_SECTION], BLACKLIST_SECTION):
-        return None
+def iter_haproxy_acl_files(config: Union[Ruleset, Dict[str, Any]]) -> Dict[str, Iterator[str]]:
+    """
+    Emits the external ACL files referenced by `acl ... src -f`.
 
-    if ADVANCED_SECTION in config and not _validate_advanced_section(config[ADVANCED_SECTION]):
-        return None
+    HAProxy loads these files into its tree-based address lookup, and their
+    entries can be changed at runtime over the stats socket (`add acl` /
+    `del acl`) without a reload.
 
-    return config
+    Args:
+        config: The compiled Ruleset, or a validated configuration dictionary.
 
-def _validate_global_section(config: Dict[str, Any]) -> bool:
+    Returns:
+        A dictionary mapping file names to an iterator over their lines, for each enabled list.
+    """
+    ruleset = ensure_ruleset(config)
+    acl_files = {}
+    for ip_list, file_name in ((ruleset.whitelist, WHITELIST_ACL_FILE), (ruleset.blacklist, BLACKLIST_ACL_FILE)):
+        if ip_list.enabled:
+            acl_files[file_name] = iter(ip_list.ips)
+    return acl_files
+
+def generate_haproxy_path_maps(config: Union[Ruleset, Dict[str, Any]]) -> Dict[str, str]:
     """
-    Validates the 'global' section of the configuration.
+    Generates the map files resolving a request path to its rule.
 
     Args:
-        config: The configuration dictionary.
+        config: The compiled Ruleset, or a validated configuration dictionary.
 
     Returns:
-        True if the global section is valid, False otherwise.
+        A dictionary mapping file names to their content.
     """
-    if GLOBAL_SECTION not in config:
-        logger.error("Error: 'global' section is missing in config")
-        return False
+    return {file_name: ''.join(f'{line}\n' for line in lines)
+            for file_name, lines in iter_haproxy_path_maps(config).items()}
 
-    global_settings = config[GLOBAL_SECTION]
-    global_settings.setdefault(ENABLED_KEY, True)
-    global_settings.setdefault(REQUESTS_PER_MINUTE_KEY, 60)
-    global_settings.setdefault(BURST_KEY, 20)
-    global_settings.setdefault(WINDOW_KEY, '1m')
-    global_settings.setdefault(LIMIT_BY_KEY, 'ip')
+def iter_haproxy_path_maps(config: Union[Ruleset, Dict[str, Any]]) -> Dict[str, Iterator[str]]:
+    """
+    Emits the map files resolving a request path to its rule.
 
-    if global_settings[LIMIT_BY_KEY] not in VALID_LIMIT_BY_VALUES:
-        logger.error(f"Error: Invalid '{LIMIT_BY_KEY}' value in global section")
-        return False
+    Prefix paths go to paths.map (matched with map_beg, longest prefix first)
+    and regex paths to paths_reg.map (matched with map_reg, in config order).
+    Each value reads `<rule id>:<table group>:<requests_per_minute>`.
 
-    return True
+    Args:
+        config: The compiled Ruleset, or a validated configuration dictionary.
 
-def _validate_paths_section(paths_config: Dict[str, Any]) -> bool:
+    Returns:
+        A dictionary mapping file names to an iterator over their lines.
+    """
+    ruleset = ensure_ruleset(config)
+    groups = _path_map_groups(ruleset)
+    path_maps = {PATHS_MAP_FILE: (f'{rule.path} {_path_map_value(rule, groups)}'
+                                  for rule in ruleset.paths_by_precedence if not rule.is_regex)}
+    if any(rule.is_regex for rule in ruleset.paths):
+        path_maps[PATHS_REGEX_MAP_FILE] = (f'{_anchored(rule.path)} {_path_map_value(rule, groups)}'
+                                           for rule in ruleset.paths_by_precedence if rule.is_regex)
+    return path_maps
+
+def _path_map_groups(ruleset: Ruleset) -> Dict[Tuple[str, int], Tuple[int, RuleSpec]]:
     """
-    Validates the 'paths' section of the configuration.
+    Assigns every enabled path rule to a stick-table group.
+
+    Rules sharing the same key and window share one table; their counters stay
+    separate because the tracked key is suffixed with the rule id.
 
     Args:
-        paths_config: The 'paths' section of the configuration.
+        ruleset: The compiled Ruleset.
 
     Returns:
-        True if the paths section is valid, False otherwise.
+        A dictionary mapping each (sample fetch, window in seconds) to its group
+        number and the first rule of the group, in precedence order.
     """
-    if not isinstance(paths_config, dict):
-        logger.error("Error: 'paths' must be a dictionary")
-        return False
+    groups: Dict[Tuple[str, int], Tuple[int, RuleSpec]] = {}
+    for rule in ruleset.paths_by_precedence:
+        groups.setdefault(_path_group_key(rule), (len(groups), rule))
+    return groups
 
-    for path, settings in paths_config.items():
-        settings.setdefault(ENABLED_KEY, True)
-        settings.setdefault(REQUESTS_PER_MINUTE_KEY, 60)
-        settings.setdefault(BURST_KEY, 20)
-        settings.setdefault(WINDOW_KEY, '1m')
-        settings.setdefault(LIMIT_BY_KEY, 'ip')
+def _path_group_key(rule: RuleSpec) -> Tuple[str, int]:
+    """
+    Returns the key grouping path rules into shared stick tables.
 
-        if settings[LIMIT_BY_KEY] not in VALID_LIMIT_BY_VALUES:
-            logger.error(f"Error: Invalid '{LIMIT_BY_KEY}' value for path {path}")
-            return False
+    Args:
+        rule: The compiled path rule.
 
-    return True
+    Returns:
+        A (sample fetch, window in seconds) tuple.
+    """
+    return _get_track_key(rule)[0], rule.window_seconds
 
-def _validate_list_section(list_config: Dict[str, Any], section_name: str) -> bool:
+def _path_map_value(rule: RuleSpec, groups: Dict[Tuple[str, int], Tuple[int, RuleSpec]]) -> str:
     """
-    Validates the 'whitelist' or 'blacklist' section of the configuration.
+    Formats the map value of a path rule.
 
     Args:
-        list_config: The 'whitelist' or 'blacklist' section of the configuration.
-        section_name: The name of the section being validated.
+        rule: The compiled path rule.
+        groups: The table groups (see _path_map_groups).
 
     Returns:
-        True if the section is valid, False otherwise.
+        The value `<rule id>:<table group>:<requests_per_minute>`.
+    """
+    return f'{rule.ident}:{groups[_path_group_key(rule)][0]}:{rule.requests_per_minute}'
+
+def _iter_path_map_rules(ruleset: Ruleset, map_dir: str) -> Iterator[str]:
     """
-    list_config.setdefault(ENABLED_KEY, False)
-    if IPS_KEY in list_config:
-        if not isinstance(list_config[IPS_KEY], list):
-            logger.error(f"Error: '{IPS_KEY}' in '{section_name}' must be a list")
-            return False
+    Emits the map-based path rules: one lookup resolves the rule, then one
+    tracking rule per table group and a single deny rule apply it.
+
+    Args:
+        ruleset: The compiled Ruleset.
+        map_dir: Directory holding the map files on the HAProxy host.
+
+    Yields:
+        The frontend lines.
+    """
+    if not ruleset.paths:
+        return
+
+    if any(rule.is_regex for rule in ruleset.paths):
+        yield f'http-request set-var(txn.rl_rule) path,map_reg({posixpath.join(map_dir, PATHS_REGEX_MAP_FILE)})'
+        yield (f'http-request set-var(txn.rl_rule) path,map_beg({posixpath.join(map_dir, PATHS_MAP_FILE)}) '
+               'unless { var(txn.rl_rule) -m found }')
     else:
-        list_config[IPS_KEY] = []
+        yield f'http-request set-var(txn.rl_rule) path,map_beg({posixpath.join(map_dir, PATHS_MAP_FILE)})'
+    yield 'http-request set-var(txn.rl_limit) var(txn.rl_rule),field(3,:) if { var(txn.rl_rule) -m found }'
+
+    for (fetch, _), (group, _) in _path_map_groups(ruleset).items():
+        yield (f'http-request track-sc1 {fetch},concat(@,txn.rl_rule) table st_paths_{group} '
+               f'if {{ var(txn.rl_rule),field(2,:) -m str {group} }}')
 
-    return True
+    yield ('http-request deny deny_status 429 if { var(txn.rl_limit) -m found } '
+           '{ sc_http_req_rate(1),sub(txn.rl_limit) gt 0 }')
 
-def _validate_advanced_section(advanced_config: Dict[str, Any]) -> bool:
+def _iter_stick_tables(ruleset: Ruleset, map_mode: bool) -> Iterator[str]:
     """
-    Validates the 'advanced' section of the configuration.
+    Emits the stick-table backends tracked by the frontend rules, in the same
+    order as the rules that reference them.
 
     Args:
-        advanced_config: The 'advanced' section of the configuration.
+        ruleset: The compiled Ruleset.
+        map_mode: Whether path rules share per-group tables (see _iter_path_map_rules).
 
-    Returns:
-        True if the advanced section is valid, False otherwise.
+    Yields:
+        The backend sections.
     """
-    advanced_config.setdefault(LOG_LEVEL_KEY, 'info')
-    if advanced_config[LOG_LEVEL_KEY] not in VALID_LOG_LEVELS:
-        logger.error(f"Error: Invalid '{LOG_LEVEL_KEY}' value in advanced section")
-        return False
-
-    return True
+    if ruleset.global_rule:
+        yield _generate_stick_table('st_global', _get_track_key(ruleset.global_rule)[1], ruleset.global_rule)
+    if map_mode:
+        members: Dict[Tuple[str, int], List[RuleSpec]] = {}
+        for rule in ruleset.paths_by_precedence:
+            members.setdefault(_path_group_key(rule), []).append(rule)
+        for group_key, (group, rule) in _path_map_groups(ruleset).items():
+            yield _generate_stick_table(f'st_paths_{group}', f'string len {STRING_KEY_LENGTH}', rule,
+                                        members[group_key])
+    else:
+        for rule in ruleset.paths_by_precedence:
+            yield _generate_stick_table(f'st_{rule.ident}', _get_track_key(rule)[1], rule)
 
-def generate_haproxy_config(config: Dict[str, Any]) -> str:
+def _shadowing_rules(rule: RuleSpec, earlier: Sequence[RuleSpec]) -> List[RuleSpec]:
     """
-    Generates HAProxy rate limiting configuration from the loaded config.
+    Returns the rules of higher precedence that may match the requests of a rule.
+
+    Regex paths may match any request, so they always shadow later rules;
+    a prefix path is only shadowed by the longer prefixes nested in it
+    (e.g., /api/v2 shadows /api).
 
     Args:
-        config: The validated configuration dictionary.
+        rule: The compiled path rule.
+        earlier: The rules preceding it in paths_by_precedence.
 
     Returns:
-        A string containing the generated HAProxy configuration.
+        The shadowing rules, in precedence order.
     """
-    haproxy_config = []
+    if rule.is_regex:
+        return [other for other in earlier if other.is_regex]
+    return [other for other in earlier if other.is_regex or other.path.startswith(rule.path)]
 
-    # Whitelist Configuration
-    if config[WHITELIST_SECTION][ENABLED_KEY]:
-        for ip in config[WHITELIST_SECTION][IPS_KEY]:
-            haproxy_config.append(f'acl whitelist src {ip}')
-        haproxy_config.append('http-request allow if whitelist')
+def _get_track_key(rule: RuleSpec) -> Tuple[str, str]:
+    """
+    Determines the sample fetch to track and the matching stick-table key type.
 
-    # Blacklist Configuration
-    if config[BLACKLIST_SECTION][ENABLED_KEY]:
-        for ip in config[BLACKLIST_SECTION][IPS_KEY]:
-            haproxy_config.append(f'acl blacklist src {ip}')
-        haproxy_config.append('http-request deny if blacklist')
+    Args:
+        rule: The compiled rule.
 
-    # Global rate limiting settings
-    global_settings = config[GLOBAL_SECTION]
-    if global_settings[ENABLED_KEY]:
-        global_rpm = global_settings[REQUESTS_PER_MINUTE_KEY]
-        global_limit_by = global_settings[LIMIT_BY_KEY]
-        acl_name = 'global_rate_limit'
+    Returns:
+        A (sample fetch, stick-table type) tuple.
+    """
+    if rule.limit_by == 'user_agent':
+        return 'req.hdr(User-Agent)', f'string len {STRING_KEY_LENGTH}'
+    elif rule.limit_by == 'header_name':
+        return f'req.hdr({rule.limit_by_header})', f'string len {STRING_KEY_LENGTH}'
+    return 'src', 'ip'
+
+def _generate_stick_table(table_name: str, table_type: str, rule: RuleSpec,
+                          rules: Optional[Sequence[RuleSpec]] = None) -> str:
+    """
+    Generates a dedicated backend holding the stick table of one rule.
+
+    Entries expire after one window, so the table only has to hold the keys
+    seen during the last window.
+
+    Args:
+        table_name: The name of the backend declaring the table.
+        table_type: The stick-table key type (e.g., 'ip', 'string len 128').
+        rule: The rule whose window sets the expiry and the rate period.
+        rules: Every rule tracked in the table, if shared; defaults to the rule alone.
 
-        if global_limit_by == 'ip':
-            haproxy_config.append(f'acl {acl_name} src_conn_rate_ge {global_rpm}')
-        elif global_limit_by == 'user_agent':
-            haproxy_config.append(f'acl {acl_name} req.hdr(User-Agent),rate_ge {global_rpm}')
-        elif global_limit_by == 'header_name':
-            header_name = global_settings.get('limit_by_header', 'custom_header')
-            haproxy_config.append(f'acl {acl_name} req.hdr({header_name}),rate_ge {global_rpm}')
+    Returns:
+        The backend section declaring the stick table.
+    """
+    period = f'{rule.window_seconds}s'
+    size = _table_size(rules or [rule])
+    return (f'backend {table_name}\n'
+            f'  stick-table type {table_type} size {size} expire {period} store http_req_rate({period})')
 
-        haproxy_config.append(f'http-request deny if {acl_name}')
+def _table_size(rules: Sequence[RuleSpec]) -> str:
+    """
+    Computes the entry count of a stick table from the expected key counts of its rules.
 
-    # Path-specific limits
-    if PATHS_SECTION in config:
-        for path, limits in config[PATHS_SECTION].items():
-            if limits[ENABLED_KEY]:
-                rpm = limits[REQUESTS_PER_MINUTE_KEY]
-                limit_by = limits[LIMIT_BY_KEY]
-                acl_name = f'{_generate_acl_name(path)}_rate_limit'
-                haproxy_config.append(f'acl is_{_generate_acl_name(path)} path_beg {path}')
+    A shared table keeps one entry per key and rule, so the counts add up.
 
-                if limit_by == 'ip':
-                    haproxy_config.append(f'acl {acl_name} src_conn_rate_ge {rpm}')
-                elif limit_by == 'user_agent':
-                    haproxy_config.append(f'acl {acl_name} req.hdr(User-Agent),rate_ge {rpm}')
-                elif limit_by == 'header_name':
-                    header_name = limits.get('limit_by_header', 'custom_header')
-                    haproxy_config.append(f'acl {acl_name} req.hdr({header_name}),rate_ge {rpm}')
+    Args:
+        rules: The rules tracked in the table.
 
-                haproxy_config.append(f'http-request deny if is_{_generate_acl_name(path)} {acl_name}')
+    Returns:
+        The table size in HAProxy notation (e.g., '500', '125k'), or
+        DEFAULT_TABLE_SIZE if a rule has no expected_keys.
+    """
+    if not all(rule.expected_keys for rule in rules):
+        return DEFAULT_TABLE_SIZE
 
-    return "\n".join(haproxy_config)
+    entries = math.ceil(sum(rule.expected_keys for rule in rules) * TABLE_SIZE_HEADROOM)
+    if entries >= 1 << 20:
+        return f'{math.ceil(entries / (1 << 20))}m'
+    if entries >= 1 << 10:
+        return f'{math.ceil(entries / (1 << 10))}k'
+    return str(entries)
 
-def _generate_acl_name(path: str) -> str:
+def _anchored(pattern: str) -> str:
     """
-    Generates a valid ACL name based on the path.
+    Anchors a regex path at the start of the request path.
 
     Args:
-        path: The path string to convert into an ACL name.
+        pattern: The regex path.
 
     Returns:
-        A valid ACL name with special characters replaced by underscores.
+        The pattern, starting with '^'.
     """
-    return re.sub(r'[^a-zA-Z0-9_]', '_', path).strip('_')
+    return pattern if pattern.startswith('^') else '^' + pattern
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate HAProxy rate limiting configuration from config.yaml.')
+    parser.add_argument('--acl-files', metavar='DIR',
+                        help='Write the whitelist/blacklist to .lst files in DIR and reference them with "acl ... -f".')
+    parser.add_argument('--path-maps', metavar='DIR',
+                        help='Write the path rules to .map files in DIR and resolve them with a single map lookup.')
+    parser.add_argument('--acl-path', metavar='DIR', default=DEFAULT_ACL_DIR,
+                        help=f'Directory the .lst/.map files are installed to on the HAProxy host (default: {DEFAULT_ACL_DIR}).')
+    args = parser.parse_args()
+
     config = load_config()
     if config:
-        haproxy_config = generate_haproxy_config(config)
-        print(haproxy_config)
+        ruleset = compile_config(config)
+        if args.acl_files:
+            for file_name, lines in iter_haproxy_acl_files(ruleset).items():
+                with open(os.path.join(args.acl_files, file_name), 'w') as f:
+                    write_lines(lines, f)
+        if args.path_maps:
+            for file_name, lines in iter_haproxy_path_maps(ruleset).items():
+                with open(os.path.join(args.path_maps, file_name), 'w') as f:
+                    write_lines(lines, f)
+        write_lines(iter_haproxy_config(ruleset,
+                                        args.acl_path if args.acl_files else None,
+                                        args.acl_path if args.path_maps else None),
+                    sys.stdout)
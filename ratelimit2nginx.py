@@ -1,285 +1,241 @@
 # ratelimit2nginx.py
-import yaml
+import argparse
+import ipaddress
+import math
 import logging
 import re
-from typing import Dict, Any, List, Optional
-
-# Constants for repeated strings
-GLOBAL_SECTION = 'global'
-PATHS_SECTION = 'paths'
-WHITELIST_SECTION = 'whitelist'
-BLACKLIST_SECTION = 'blacklist'
-ADVANCED_SECTION = 'advanced'
-IPS_KEY = 'ips'
-ENABLED_KEY = 'enabled'
-LIMIT_BY_KEY = 'limit_by'
-LOG_LEVEL_KEY = 'log_level'
-REQUESTS_PER_MINUTE_KEY = 'requests_per_minute'
-WINDOW_KEY = 'window'
-BURST_KEY = 'burst'
-
-# Valid values for certain fields
-VALID_LIMIT_BY_VALUES = {'ip', 'user_agent', 'header_name'}
-VALID_LOG_LEVELS = {'debug', 'info', 'warning', 'error'}
+import sys
+from typing import Dict, Any, Iterator, Sequence, Union
+
+from ip_index import IPIndex
+from ratelimit import load_config
+from ruleset import RuleSpec, Ruleset, compile_config, ensure_ruleset, write_lines
+
+# Zone sizing: bytes per limit_req state on 64-bit platforms, and the
+# headroom kept above the expected number of keys
+DEFAULT_ZONE_SIZE = '10m'
+MIN_ZONE_SIZE_KB = 32
+ZONE_SIZE_HEADROOM = 1.25
+BINARY_ADDR_STATE_SIZE = 128
+STRING_KEY_STATE_SIZE = 256
+
+# Rule name of the global limit in map-based zone selection
+GLOBAL_RULE_NAME = '_global'
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def load_config(config_path: str = 'config.yaml') -> Optional[Dict[str, Any]]:
+def generate_nginx_config(config: Union[Ruleset, Dict[str, Any]], use_maps: bool = False,
+                          geo_ranges: bool = False) -> str:
     """
-    Load rate limit settings from config.yaml.
+    Generates Nginx rate limiting configuration from the loaded config.
 
     Args:
-        config_path: Path to the configuration file.
+        config: The compiled Ruleset, or a validated configuration dictionary.
+        use_maps: See iter_nginx_config.
+        geo_ranges: See iter_nginx_config.
 
     Returns:
-        A dictionary containing the validated configuration, or None if loading fails.
+        A string containing the generated Nginx configuration.
     """
-    try:
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-            if config is None:
-                logger.error("Error: config file is empty")
-                return None
-            return _validate_config(config)
-    except FileNotFoundError:
-        logger.error(f"Error: config file not found at {config_path}")
-        return None
-    except yaml.YAMLError as e:
-        logger.error(f"Error parsing YAML: {e}")
-        return None
-
-def _validate_config(config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    return "\n".join(iter_nginx_config(config, use_maps, geo_ranges))
+
+def iter_nginx_config(config: Union[Ruleset, Dict[str, Any]], use_maps: bool = False,
+                      geo_ranges: bool = False) -> Iterator[str]:
     """
-    Validates the loaded configuration, setting default values and ensuring
-    required keys are present.
+    Emits the Nginx rate limiting configuration line by line.
 
-    Args:
-        config: The raw configuration dictionary loaded from the YAML file.
+    Zones are sized from the rule's 'expected_keys' setting when present
+    (see _zone_size) and default to 10m otherwise.
 
-    Returns:
-        A validated configuration dictionary, or None if validation fails.
+    Args:
+        config: The compiled Ruleset, or a validated configuration dictionary.
+        use_maps: If True, zones are selected through `map` blocks and applied with
+            http-level `limit_req` directives (see _iter_map_limits) instead of
+            one `location` block per path.
+        geo_ranges: If True, whitelist/blacklist `geo` blocks are written in
+            `ranges` mode from the merged address intervals.
+
+    Yields:
+        The configuration lines, without trailing newlines.
     """
-    if not _validate_global_section(config):
-        return None
+    ruleset = ensure_ruleset(config)
 
-    if PATHS_SECTION in config and not _validate_paths_section(config[PATHS_SECTION]):
-        return None
-
-    if WHITELIST_SECTION in config and not _validate_list_section(config[WHITELIST_SECTION], WHITELIST_SECTION):
-        return None
+    # Whitelist Configuration
+    if ruleset.whitelist.enabled:
+        yield from _iter_geo_block('$whitelist', ruleset.whitelist.ips, geo_ranges)
+        yield 'if ($whitelist) {'
+        yield '   set $limit_bypass 1;'
+        yield '}'
 
-    if BLACKLIST_SECTION in config and not _validate_list_section(config[BLACKLIST_SECTION], BLACKLIST_SECTION):
-        return None
+    # Blacklist Configuration
+    if ruleset.blacklist.enabled:
+        yield from _iter_geo_block('$blacklist', ruleset.blacklist.ips, geo_ranges)
+        yield 'if ($blacklist) {'
+        yield '   return 403;'  # Return 403 for blacklisted IPs
+        yield '}'
 
-    if ADVANCED_SECTION in config and not _validate_advanced_section(config[ADVANCED_SECTION]):
-        return None
+    if use_maps:
+        yield from _iter_map_limits(ruleset)
+        return
 
-    return config
+    # Global rate limiting settings
+    global_rule = ruleset.global_rule
+    if global_rule:
+        yield (f'limit_req_zone {_get_zone_var(global_rule)} zone=default:{_zone_size(global_rule)} '
+               f'rate={global_rule.requests_per_minute}r/{_parse_window(global_rule.window)};')
 
-def _validate_global_section(config: Dict[str, Any]) -> bool:
-    """
-    Validates the 'global' section of the configuration.
+    # Path-specific rate limiting settings
+    for rule in ruleset.paths:
+        yield (f'limit_req_zone {_get_zone_var(rule)} zone={rule.ident}:{_zone_size(rule)} '
+               f'rate={rule.requests_per_minute}r/{_parse_window(rule.window)};')
 
-    Args:
-        config: The configuration dictionary.
+    # Server block
+    yield 'server {'
 
-    Returns:
-        True if the global section is valid, False otherwise.
-    """
-    if GLOBAL_SECTION not in config:
-        logger.error("Error: 'global' section is missing in config")
-        return False
+    if ruleset.whitelist.enabled:
+        yield '  if ($limit_bypass) {'
+        yield '      return 200;'
+        yield '  }'
 
-    global_settings = config[GLOBAL_SECTION]
-    global_settings.setdefault(ENABLED_KEY, True)
-    global_settings.setdefault(REQUESTS_PER_MINUTE_KEY, 60)
-    global_settings.setdefault(BURST_KEY, 20)
-    global_settings.setdefault(WINDOW_KEY, '1m')
-    global_settings.setdefault(LIMIT_BY_KEY, 'ip')
+    # Default location
+    if global_rule:
+        yield '  location / {'
+        yield f'    limit_req zone=default burst={global_rule.burst} nodelay;'
+        yield '    ... # Your other configurations here'
+        yield '  }'
 
-    if global_settings[LIMIT_BY_KEY] not in VALID_LIMIT_BY_VALUES:
-        logger.error(f"Error: Invalid '{LIMIT_BY_KEY}' value in global section")
-        return False
+    # Path-specific locations
+    for rule in ruleset.paths:
+        yield f'  location {rule.path} {{'
+        yield f'    limit_req zone={rule.ident} burst={rule.burst} nodelay;'
+        yield '    ... # Your other configurations here'
+        yield '  }'
 
-    return True
+    yield '}'
 
-def _validate_paths_section(paths_config: Dict[str, Any]) -> bool:
+def _iter_map_limits(ruleset: Ruleset) -> Iterator[str]:
     """
-    Validates the 'paths' section of the configuration.
+    Emits map-based zone selection for the http context.
+
+    A first map resolves the request URI to a rule name (regex paths first,
+    then prefixes from longest to shortest, like PathRouter). One map per zone
+    then turns that rule name into the zone key, which is empty when the zone
+    does not apply; Nginx does not account requests with an empty key. All
+    zones are applied by a single set of http-level `limit_req` directives,
+    so existing locations stay untouched. Whitelisted clients get no rule.
 
     Args:
-        paths_config: The 'paths' section of the configuration.
+        ruleset: The compiled Ruleset.
 
-    Returns:
-        True if the paths section is valid, False otherwise.
+    Yields:
+        The configuration lines.
     """
-    if not isinstance(paths_config, dict):
-        logger.error("Error: 'paths' must be a dictionary")
-        return False
-
-    for path, settings in paths_config.items():
-        settings.setdefault(ENABLED_KEY, True)
-        settings.setdefault(REQUESTS_PER_MINUTE_KEY, 60)
-        settings.setdefault(BURST_KEY, 20)
-        settings.setdefault(WINDOW_KEY, '1m')
-        settings.setdefault(LIMIT_BY_KEY, 'ip')
-
-        if settings[LIMIT_BY_KEY] not in VALID_LIMIT_BY_VALUES:
-            logger.error(f"Error: Invalid '{LIMIT_BY_KEY}' value for path {path}")
-            return False
-
-    return True
-
-def _validate_list_section(list_config: Dict[str, Any], section_name: str) -> bool:
+    global_rule = ruleset.global_rule
+    zones = [(rule.ident, rule.ident, rule) for rule in ruleset.paths_by_precedence]
+    if global_rule:
+        # 'default' is a keyword inside map blocks, so the global rule gets its own name
+        zones.append(('default', GLOBAL_RULE_NAME, global_rule))
+    if not zones:
+        return
+
+    whitelist = ruleset.whitelist.enabled
+    yield 'map $whitelist$uri $limits_rule {' if whitelist else 'map $uri $limits_rule {'
+    yield '  default "";'
+    prefix = '0' if whitelist else ''
+    for rule in ruleset.paths_by_precedence:
+        if rule.is_regex:
+            pattern = prefix + rule.path[1:] if rule.path.startswith('^') else prefix + rule.path
+        else:
+            pattern = prefix + re.escape(rule.path)
+        yield f'  "~^{pattern}" {rule.ident};'
+    if global_rule:
+        yield f'  "~^{prefix}" {GLOBAL_RULE_NAME};' if whitelist else f'  "~" {GLOBAL_RULE_NAME};'
+    yield '}'
+
+    for zone_name, rule_name, rule in zones:
+        yield f'map $limits_rule $rl_key_{zone_name} {{'
+        yield '  default "";'
+        yield f'  {rule_name} {_get_zone_var(rule)};'
+        yield '}'
+
+    for zone_name, _, rule in zones:
+        rate = f'{rule.requests_per_minute}r/{_parse_window(rule.window)}'
+        yield f'limit_req_zone $rl_key_{zone_name} zone={zone_name}:{_zone_size(rule)} rate={rate};'
+
+    for zone_name, _, rule in zones:
+        yield f'limit_req zone={zone_name} burst={rule.burst} nodelay;'
+
+def _iter_geo_block(variable: str, ips: Sequence[str], use_ranges: bool) -> Iterator[str]:
     """
-    Validates the 'whitelist' or 'blacklist' section of the configuration.
+    Emits a `geo` block setting a variable to 1 for the listed addresses.
+
+    In ranges mode the merged IPv4 intervals are written as `start-end` entries,
+    which Nginx searches faster than a list of networks. Nginx only supports
+    IPv4 ranges, so lists containing IPv6 entries fall back to CIDR notation.
 
     Args:
-        list_config: The 'whitelist' or 'blacklist' section of the configuration.
-        section_name: The name of the section being validated.
+        variable: The variable to set (e.g., '$whitelist').
+        ips: The aggregated addresses and networks of the list.
+        use_ranges: Whether to emit the block in `ranges` mode.
 
-    Returns:
-        True if the section is valid, False otherwise.
+    Yields:
+        The configuration lines.
     """
-    list_config.setdefault(ENABLED_KEY, False)
-    if IPS_KEY in list_config:
-        if not isinstance(list_config[IPS_KEY], list):
-            logger.error(f"Error: '{IPS_KEY}' in '{section_name}' must be a list")
-            return False
+    yield f'geo {variable} {{'
+    index = IPIndex(ips) if use_ranges else None
+    if index is not None and next(index.ranges(6), None) is None:
+        yield '  ranges;'
+        yield '  default 0;'
+        for start, end in index.ranges(4):
+            yield f'  {ipaddress.IPv4Address(start)}-{ipaddress.IPv4Address(end)} 1;'
     else:
-        list_config[IPS_KEY] = []
-
-    return True
-
-def _validate_advanced_section(advanced_config: Dict[str, Any]) -> bool:
-    """
-    Validates the 'advanced' section of the configuration.
-
-    Args:
-        advanced_config: The 'advanced' section of the configuration.
-
-    Returns:
-        True if the advanced section is valid, False otherwise.
+        if index is not None:
+            logger.warning(f"geo {variable} contains IPv6 entries, which ranges mode does not support; using CIDR notation")
+        yield '  default 0;'
+        for ip in ips:
+            yield f'  {ip} 1;'
+    yield '}'
+
+def _zone_size(rule: RuleSpec) -> str:
     """
-    advanced_config.setdefault(LOG_LEVEL_KEY, 'info')
-    if advanced_config[LOG_LEVEL_KEY] not in VALID_LOG_LEVELS:
-        logger.error(f"Error: Invalid '{LOG_LEVEL_KEY}' value in advanced section")
-        return False
+    Computes the shared memory size of a zone from the rule's expected key count.
 
-    return True
-
-def generate_nginx_config(config: Dict[str, Any]) -> str:
-    """
-    Generates Nginx rate limiting configuration from the loaded config.
+    On 64-bit platforms a limit_req state takes 128 bytes with $binary_remote_addr
+    (about 8 thousand states per megabyte); variable-length keys such as
+    User-Agent need more, so they are budgeted at 256 bytes.
 
     Args:
-        config: The validated configuration dictionary.
+        rule: The compiled rule.
 
     Returns:
-        A string containing the generated Nginx configuration.
+        The zone size in Nginx notation (e.g., '512k', '3m').
     """
-    nginx_config = []
+    if not rule.expected_keys:
+        return DEFAULT_ZONE_SIZE
 
-    # Whitelist Configuration
-    if config[WHITELIST_SECTION][ENABLED_KEY]:
-        nginx_config.append('geo $whitelist {')
-        nginx_config.append('  default 0;')
-        for ip in config[WHITELIST_SECTION][IPS_KEY]:
-            nginx_config.append(f'  {ip} 1;')
-        nginx_config.append('}')
-        nginx_config.append('if ($whitelist) {')
-        nginx_config.append('   set $limit_bypass 1;')
-        nginx_config.append('}')
+    state_size = BINARY_ADDR_STATE_SIZE if rule.limit_by == 'ip' else STRING_KEY_STATE_SIZE
+    size_kb = max(MIN_ZONE_SIZE_KB, math.ceil(rule.expected_keys * state_size * ZONE_SIZE_HEADROOM / 1024))
+    if size_kb >= 1024:
+        return f'{math.ceil(size_kb / 1024)}m'
+    return f'{size_kb}k'
 
-    # Blacklist Configuration
-    if config[BLACKLIST_SECTION][ENABLED_KEY]:
-        nginx_config.append('geo $blacklist {')
-        nginx_config.append('  default 0;')
-        for ip in config[BLACKLIST_SECTION][IPS_KEY]:
-            nginx_config.append(f'  {ip} 1;')
-        nginx_config.append('}')
-        nginx_config.append('if ($blacklist) {')
-        nginx_config.append('   return 403;')  # Return 403 for blacklisted IPs
-        nginx_config.append('}')
-
-    # Global rate limiting settings
-    global_settings = config[GLOBAL_SECTION]
-    if global_settings[ENABLED_KEY]:
-        global_rpm = global_settings[REQUESTS_PER_MINUTE_KEY]
-        global_burst = global_settings[BURST_KEY]
-        global_window = global_settings[WINDOW_KEY]
-        global_limit_by = global_settings[LIMIT_BY_KEY]
-        zone_var = '$binary_remote_addr'
-
-        if global_limit_by == 'user_agent':
-            zone_var = '$http_user_agent'
-        elif global_limit_by == 'header_name':
-            header_name = global_settings.get('limit_by_header', 'custom_header')
-            zone_var = f'$http_{header_name}'
-
-        nginx_config.append(f'limit_req_zone {zone_var} zone=default:10m rate={global_rpm}r/{_parse_window(global_window)};')
-
-    # Path-specific rate limiting settings
-    if PATHS_SECTION in config:
-        for path, limits in config[PATHS_SECTION].items():
-            if limits[ENABLED_KEY]:
-                rpm = limits[REQUESTS_PER_MINUTE_KEY]
-                burst = limits[BURST_KEY]
-                window = limits[WINDOW_KEY]
-                limit_by = limits[LIMIT_BY_KEY]
-                zone_name = _generate_zone_name(path)
-                zone_var = '$binary_remote_addr'
-
-                if limit_by == 'user_agent':
-                    zone_var = '$http_user_agent'
-                elif limit_by == 'header_name':
-                    header_name = limits.get('limit_by_header', 'custom_header')
-                    zone_var = f'$http_{header_name}'
-
-                nginx_config.append(f'limit_req_zone {zone_var} zone={zone_name}:10m rate={rpm}r/{_parse_window(window)};')
-
-    # Server block
-    nginx_config.append('server {')
-
-    if config[WHITELIST_SECTION][ENABLED_KEY]:
-        nginx_config.append('  if ($limit_bypass) {')
-        nginx_config.append('      return 200;')
-        nginx_config.append('  }')
-
-    # Default location
-    if global_settings[ENABLED_KEY]:
-        nginx_config.append('  location / {')
-        nginx_config.append(f'    limit_req zone=default burst={global_burst} nodelay;')
-        nginx_config.append('    ... # Your other configurations here')
-        nginx_config.append('  }')
-
-    # Path-specific locations
-    if PATHS_SECTION in config:
-        for path, limits in config[PATHS_SECTION].items():
-            if limits[ENABLED_KEY]:
-                burst = limits[BURST_KEY]
-                zone_name = _generate_zone_name(path)
-                nginx_config.append(f'  location {path} {{')
-                nginx_config.append(f'    limit_req zone={zone_name} burst={burst} nodelay;')
-                nginx_config.append('    ... # Your other configurations here')
-                nginx_config.append('  }')
-
-    nginx_config.append('}')
-    return "\n".join(nginx_config)
-
-def _generate_zone_name(path: str) -> str:
+def _get_zone_var(rule: RuleSpec) -> str:
     """
-    Generates a valid zone name based on the path.
+    Determines the Nginx variable used as the zone key for the rule's 'limit_by' setting.
 
     Args:
-        path: The path string to convert into a zone name.
+        rule: The compiled rule.
 
     Returns:
-        A valid zone name with special characters replaced by underscores.
+        The corresponding Nginx variable.
     """
-    return re.sub(r'[^a-zA-Z0-9_]', '_', path).strip('_')
+    if rule.limit_by == 'user_agent':
+        return '$http_user_agent'
+    elif rule.limit_by == 'header_name':
+        return f'$http_{rule.limit_by_header}'
+    return '$binary_remote_addr'
 
 def _parse_window(window: str) -> str:
     """
@@ -300,7 +256,14 @@ def _parse_window(window: str) -> str:
     return 'min'
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate Nginx rate limiting configuration from config.yaml.')
+    parser.add_argument('--use-maps', action='store_true',
+                        help='Select zones with map blocks and http-level limit_req instead of one location per path.')
+    parser.add_argument('--geo-ranges', action='store_true',
+                        help='Write whitelist/blacklist geo blocks in ranges mode (IPv4 only).')
+    args = parser.parse_args()
+
     config = load_config()
     if config:
-        nginx_config = generate_nginx_config(config)
-        print(nginx_config)
+        write_lines(iter_nginx_config(compile_config(config), use_maps=args.use_maps, geo_ranges=args.geo_ranges),
+                    sys.stdout)
@@ -0,0 +1,200 @@
+# ruleset.py
+import re
+from dataclasses import dataclass
+from typing import Dict, Any, Iterable, Optional, TextIO, Tuple, Union
+
+from ip_index import aggregate_ips
+from ratelimit import (
+    GLOBAL_SECTION,
+    PATHS_SECTION,
+    WHITELIST_SECTION,
+    BLACKLIST_SECTION,
+    ADVANCED_SECTION,
+    IPS_KEY,
+    ENABLED_KEY,
+    LIMIT_BY_KEY,
+    LIMIT_BY_HEADER_KEY,
+    LOG_LEVEL_KEY,
+    REQUESTS_PER_MINUTE_KEY,
+    WINDOW_KEY,
+    BURST_KEY,
+    EXPECTED_KEYS_KEY,
+    is_regex_path,
+    parse_window_seconds,
+)
+
+# Header used when limit_by is 'header_name' and no limit_by_header is set
+DEFAULT_LIMIT_BY_HEADER = 'custom_header'
+
+class _SlottedSpec:
+    """
+    Pickle support for the frozen, slotted specs below.
+
+    Default pickling restores slots with setattr, which frozen dataclasses
+    reject, so specs are rebuilt through their constructor instead. This lets
+    a Ruleset be handed to worker processes.
+    """
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        return self.__class__, tuple(getattr(self, name) for name in self.__slots__)
+
+@dataclass(frozen=True)
+class RuleSpec(_SlottedSpec):
+    """
+    A normalized rate limit rule: the 'global' section or one enabled 'paths' entry.
+    """
+
+    __slots__ = ('name', 'path', 'ident', 'is_regex', 'requests_per_minute', 'burst', 'window',
+                 'window_seconds', 'limit_by', 'limit_by_header', 'expected_keys')
+
+    name: str
+    path: Optional[str]
+    ident: str
+    is_regex: bool
+    requests_per_minute: int
+    burst: int
+    window: str
+    window_seconds: int
+    limit_by: str
+    limit_by_header: str
+    expected_keys: Optional[int]
+
+@dataclass(frozen=True)
+class IPListSpec(_SlottedSpec):
+    """
+    A whitelist or blacklist, with its entries already aggregated into minimal CIDRs.
+    """
+
+    __slots__ = ('enabled', 'ips')
+
+    enabled: bool
+    ips: Tuple[str, ...]
+
+@dataclass(frozen=True)
+class Ruleset(_SlottedSpec):
+    """
+    Backend-neutral representation of a validated config.yaml.
+
+    It is built once per run by compile_config and handed to every emitter,
+    so windows are parsed, key sources resolved and IP lists aggregated only once.
+    Disabled rules are dropped: `global_rule` is None when the global limit is
+    disabled and `paths` only holds enabled path rules, in config order.
+    """
+
+    __slots__ = ('global_rule', 'paths', 'paths_by_precedence', 'whitelist', 'blacklist', 'log_level')
+
+    global_rule: Optional[RuleSpec]
+    paths: Tuple[RuleSpec, ...]
+    paths_by_precedence: Tuple[RuleSpec, ...]
+    whitelist: IPListSpec
+    blacklist: IPListSpec
+    log_level: str
+
+def compile_config(config: Dict[str, Any]) -> Ruleset:
+    """
+    Compiles a validated configuration dictionary into a Ruleset.
+
+    Args:
+        config: The validated configuration dictionary (see ratelimit.load_config).
+
+    Returns:
+        The compiled Ruleset.
+    """
+    global_settings = config[GLOBAL_SECTION]
+    global_rule = _compile_rule(GLOBAL_SECTION, None, global_settings) if global_settings[ENABLED_KEY] else None
+
+    paths = tuple(
+        _compile_rule(path, path, limits)
+        for path, limits in (config.get(PATHS_SECTION) or {}).items()
+        if limits[ENABLED_KEY]
+    )
+    # Regex paths first (in config order), then prefixes from longest to shortest
+    paths_by_precedence = tuple(sorted(paths, key=lambda rule: (0, 0) if rule.is_regex else (1, -len(rule.path))))
+
+    return Ruleset(
+        global_rule=global_rule,
+        paths=paths,
+        paths_by_precedence=paths_by_precedence,
+        whitelist=_compile_list(config.get(WHITELIST_SECTION)),
+        blacklist=_compile_list(config.get(BLACKLIST_SECTION)),
+        log_level=(config.get(ADVANCED_SECTION) or {}).get(LOG_LEVEL_KEY, 'info'),
+    )
+
+def ensure_ruleset(config: Union[Ruleset, Dict[str, Any]]) -> Ruleset:
+    """
+    Returns the given Ruleset, compiling it first if a configuration dictionary is passed.
+
+    Args:
+        config: A Ruleset or a validated configuration dictionary.
+
+    Returns:
+        The Ruleset.
+    """
+    if isinstance(config, Ruleset):
+        return config
+    return compile_config(config)
+
+def write_lines(lines: Iterable[str], stream: TextIO) -> None:
+    """
+    Writes emitted lines to a file object as they are produced, so a config
+    never has to be held in memory as a whole.
+
+    Args:
+        lines: The lines, without trailing newlines (e.g., from iter_nginx_config).
+        stream: The text file object to write to (e.g., sys.stdout).
+    """
+    stream.writelines(f'{line}\n' for line in lines)
+
+def generate_ident(path: str) -> str:
+    """
+    Generates an identifier usable as a zone, ACL or middleware name from a path.
+
+    Args:
+        path: The path string to convert.
+
+    Returns:
+        The path with special characters replaced by underscores.
+    """
+    return re.sub(r'[^a-zA-Z0-9_]', '_', path).strip('_')
+
+def _compile_rule(name: str, path: Optional[str], settings: Dict[str, Any]) -> RuleSpec:
+    """
+    Normalizes the settings of one rule.
+
+    Args:
+        name: 'global' or the path key.
+        path: The path key, or None for the global rule.
+        settings: The validated settings of the rule.
+
+    Returns:
+        The compiled rule.
+    """
+    return RuleSpec(
+        name=name,
+        path=path,
+        ident=generate_ident(path) if path is not None else GLOBAL_SECTION,
+        is_regex=path is not None and is_regex_path(path),
+        requests_per_minute=settings[REQUESTS_PER_MINUTE_KEY],
+        burst=settings[BURST_KEY],
+        window=str(settings[WINDOW_KEY]),
+        window_seconds=parse_window_seconds(settings[WINDOW_KEY]),
+        limit_by=settings[LIMIT_BY_KEY],
+        limit_by_header=settings.get(LIMIT_BY_HEADER_KEY, DEFAULT_LIMIT_BY_HEADER),
+        expected_keys=settings.get(EXPECTED_KEYS_KEY),
+    )
+
+def _compile_list(list_config: Optional[Dict[str, Any]]) -> IPListSpec:
+    """
+    Normalizes a whitelist/blacklist section.
+
+    Args:
+        list_config: The 'whitelist' or 'blacklist' section, if present.
+
+    Returns:
+        The compiled list; disabled and empty if the section is missing or disabled.
+    """
+    if not list_config or not list_config[ENABLED_KEY]:
+        return IPListSpec(enabled=False, ips=())
+    return IPListSpec(enabled=True, ips=tuple(aggregate_ips(list_config[IPS_KEY])))
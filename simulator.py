@@ -0,0 +1,807 @@
+# simulator.py
+import calendar
+import gzip
+import heapq
+import importlib
+import io
+import json
+import logging
+import re
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from ip_index import IPIndex
+from path_router import PathRouter
+from ruleset import RuleSpec, Ruleset
+
+# Proxy semantics the simulator can model
+NGINX_MODEL = 'nginx'
+HAPROXY_MODEL = 'haproxy'
+MODELS = (NGINX_MODEL, HAPROXY_MODEL)
+
+# Replay engines: name -> (module, simulator class). Modules are only
+# imported when their engine is requested.
+ENGINES = {'scalar': ('simulator', 'Simulator'), 'vector': ('vector_simulator', 'VectorSimulator')}
+
+# Log formats accepted by iter_log_records
+LOG_FORMATS = ('auto', 'jsonl', 'combined')
+
+# Idle limiter state is dropped every minute of log time, once replaying it
+# could no longer change a decision
+SWEEP_INTERVAL_MS = 60000
+
+# Idle state is only swept once older than this, so records logged up to
+# this long before an earlier request (e.g. logs written at request
+# completion) are not affected by sweeping
+REORDER_WINDOW_MS = 60000
+
+# Distinct request paths whose matching rule is remembered; the cache is
+# emptied when full, which keeps it bounded on logs with unique URLs
+ROUTE_CACHE_SIZE = 65536
+
+# Limited keys tracked per rule; counts are exact while a rule has at most
+# twice this many distinct limited keys
+TOP_KEYS_CAPACITY = 1000
+DEFAULT_TOP_KEYS = 10
+
+# Field names looked up in JSONL records, in order of preference
+TIME_FIELDS = ('time', 'timestamp', 'ts', '@timestamp', 'time_local', 'time_iso8601')
+IP_FIELDS = ('ip', 'remote_addr', 'client_ip', 'src')
+PATH_FIELDS = ('path', 'uri', 'url', 'request_uri')
+USER_AGENT_FIELDS = ('user_agent', 'http_user_agent', 'ua')
+
+# Nginx/Apache "combined" log format
+COMBINED_PATTERN = re.compile(r'(\S+) \S+ \S+ \[([^\]]+)\] "(?:\S+ )?(\S+)[^"]*" \S+ \S+(?: "[^"]*" "([^"]*)")?')
+MONTHS = {name: index for index, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+logger = logging.getLogger(__name__)
+
+class LogRecord:
+    """
+    One request of an access log, reduced to the fields the limits depend on.
+    """
+
+    __slots__ = ('timestamp', 'ip', 'path', 'user_agent', 'headers')
+
+    def __init__(self, timestamp: float, ip: str, path: str, user_agent: str = '',
+                 headers: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            timestamp: The request time in seconds since the epoch.
+            ip: The client address.
+            path: The request path, without the query string.
+            user_agent: The User-Agent header, if logged.
+            headers: Other logged request headers, keyed by lowercase name.
+        """
+        self.timestamp = timestamp
+        self.ip = ip
+        self.path = path
+        self.user_agent = user_agent
+        self.headers = headers or {}
+
+class NginxLimit:
+    """
+    Per-key state of one rule under Nginx `limit_req ... burst=<burst> nodelay`.
+
+    Mirrors ngx_http_limit_req_module in integer arithmetic: `excess` counts
+    queued requests in thousandths and drains at the zone rate; a request is
+    rejected, without touching the state, when the new excess would exceed
+    the burst. A key seen for the first time starts with no excess.
+    """
+
+    __slots__ = ('rate', 'burst', 'states')
+
+    def __init__(self, rule: RuleSpec):
+        # Nginx stores rates in thousandths of a request per second
+        self.rate = rule.requests_per_minute * 1000 // rule.window_seconds
+        self.burst = rule.burst * 1000
+        self.states: Dict[str, List[int]] = {}
+
+    def hit(self, key: str, now: int) -> bool:
+        """
+        Applies one request.
+
+        Args:
+            key: The limited key.
+            now: The request time in milliseconds.
+
+        Returns:
+            True if the request is accepted, False if it is rejected.
+        """
+        state = self.states.get(key)
+        if state is None:
+            self.states[key] = [0, now]
+            return True
+        # Like Nginx, time going backwards drains nothing and keeps the last time
+        elapsed = now - state[1]
+        if elapsed < 0:
+            elapsed = 0
+        excess = state[0] - self.rate * elapsed // 1000 + 1000
+        if excess < 0:
+            excess = 0
+        if excess > self.burst:
+            return False
+        state[0] = excess
+        if elapsed:
+            state[1] = now
+        return True
+
+    def sweep(self, now: int) -> None:
+        """
+        Drops keys whose excess has drained so far that their next request
+        would start from zero, exactly like a key seen for the first time.
+
+        Args:
+            now: The earliest time of any request still to be replayed, in milliseconds.
+        """
+        rate = self.rate
+        stale = [key for key, (excess, last) in self.states.items() if excess - rate * (now - last) // 1000 + 1000 <= 0]
+        for key in stale:
+            del self.states[key]
+
+class HAProxyLimit:
+    """
+    Per-key state of one rule under HAProxy `sc_http_req_rate(<window>) gt <rpm>`.
+
+    Mirrors HAProxy's period-based frequency counter: requests are counted in
+    the current period, and the rate is that count plus the previous period's
+    count weighted by the part of the previous period still inside the
+    sliding window. Every tracked request counts, including rejected ones.
+    Entries expire after one window without requests, like the generated
+    stick tables.
+    """
+
+    __slots__ = ('period', 'limit', 'states')
+
+    def __init__(self, rule: RuleSpec):
+        self.period = rule.window_seconds * 1000
+        self.limit = rule.requests_per_minute
+        self.states: Dict[str, List[int]] = {}
+
+    def hit(self, key: str, now: int) -> bool:
+        """
+        Applies one request.
+
+        Args:
+            key: The limited key.
+            now: The request time in milliseconds.
+
+        Returns:
+            True if the request is accepted, False if it is rejected.
+        """
+        period = self.period
+        state = self.states.get(key)
+        # State: [period start, current count, previous count, last request]
+        if state is None or now - state[3] >= period:
+            state = self.states[key] = [now, 0, 0, now]
+        elif now < state[3]:
+            now = state[3]
+        elapsed = now - state[0]
+        if elapsed >= period:
+            if elapsed >= 2 * period:
+                state[2] = 0
+                state[0] = now
+            else:
+                state[2] = state[1]
+                state[0] += period
+            state[1] = 0
+        state[1] += 1
+        state[3] = now
+        return state[1] + state[2] * (period - (now - state[0])) // period <= self.limit
+
+    def sweep(self, now: int) -> None:
+        """
+        Drops expired entries.
+
+        Args:
+            now: The earliest time of any request still to be replayed, in milliseconds.
+        """
+        period = self.period
+        stale = [key for key, state in self.states.items() if now - state[3] >= period]
+        for key in stale:
+            del self.states[key]
+
+class TopKeys:
+    """
+    Bounded counter of the most limited keys.
+
+    When more than twice the capacity is tracked, only the `capacity` largest
+    counts are kept, so memory stays fixed however many keys get limited.
+    """
+
+    __slots__ = ('capacity', 'counts')
+
+    def __init__(self, capacity: int = TOP_KEYS_CAPACITY):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+
+    def add(self, key: str, count: int = 1) -> None:
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + count
+        if len(counts) > 2 * self.capacity:
+            self.counts = dict(self.most_common(self.capacity))
+
+    def merge(self, other: 'TopKeys') -> None:
+        """
+        Adds the counts of another counter, pruning once all of them are combined.
+        """
+        counts = self.counts
+        for key, count in other.counts.items():
+            counts[key] = counts.get(key, 0) + count
+        if len(counts) > 2 * self.capacity:
+            self.counts = dict(self.most_common(self.capacity))
+
+    def most_common(self, n: int) -> List[Tuple[str, int]]:
+        """
+        Returns the n most limited keys, ties broken by key.
+        """
+        return heapq.nsmallest(n, self.counts.items(), key=lambda item: (-item[1], item[0]))
+
+class RuleStats:
+    """
+    Decisions of one rule under one model.
+    """
+
+    __slots__ = ('accepted', 'rejected', 'untracked', 'first_reject', 'top_keys')
+
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.untracked = 0
+        self.first_reject: Optional[int] = None
+        self.top_keys = TopKeys()
+
+    def reject(self, key: str, now: int) -> None:
+        self.rejected += 1
+        if self.first_reject is None or now < self.first_reject:
+            self.first_reject = now
+        self.top_keys.add(key)
+
+    def merge(self, other: 'RuleStats') -> None:
+        self.accepted += other.accepted
+        self.rejected += other.rejected
+        self.untracked += other.untracked
+        if other.first_reject is not None and (self.first_reject is None or other.first_reject < self.first_reject):
+            self.first_reject = other.first_reject
+        self.top_keys.merge(other.top_keys)
+
+class Simulator:
+    """
+    Replays access log records through the limits of a Ruleset.
+
+    Every record is evaluated under each requested model:
+
+    * nginx: the request is limited by the single rule whose location it
+      matches (the most specific path, otherwise the global rule).
+    * haproxy: the global rule is tracked and checked first; if it passes,
+      the most specific path rule is tracked and checked too.
+
+    Whitelisted clients are accepted and blacklisted clients rejected before
+    any limit, as in the generated configurations. Records are consumed one
+    at a time and idle keys are dropped periodically, so memory depends on
+    the number of keys active within a window, not on the log length.
+    """
+
+    def __init__(self, ruleset: Ruleset, models: Iterable[str] = MODELS):
+        """
+        Args:
+            ruleset: The compiled Ruleset.
+            models: The models to evaluate (see MODELS).
+        """
+        self.ruleset = ruleset
+        self.models = tuple(models)
+        self.router = PathRouter(((rule.path, rule) for rule in ruleset.paths), default=None)
+        self.whitelist = IPIndex(ruleset.whitelist.ips) or None
+        self.blacklist = IPIndex(ruleset.blacklist.ips) or None
+        self.routes: Dict[str, Optional[RuleSpec]] = {}
+
+        rules = ([ruleset.global_rule] if ruleset.global_rule else []) + list(ruleset.paths)
+        limit_classes = {NGINX_MODEL: NginxLimit, HAPROXY_MODEL: HAProxyLimit}
+        self.limits = {model: {rule.name: limit_classes[model](rule) for rule in rules} for model in self.models}
+        self.stats = {model: {rule.name: RuleStats() for rule in rules} for model in self.models}
+
+        self.records = 0
+        self.whitelisted = 0
+        self.blacklisted = 0
+        self.unmatched = 0
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self._next_sweep: Optional[int] = None
+
+    def feed(self, record: LogRecord) -> None:
+        """
+        Replays one record.
+
+        Args:
+            record: The log record.
+        """
+        admitted = self.admit(record)
+        if admitted is None:
+            return
+        now, path_rule = admitted
+        global_rule = self.ruleset.global_rule
+        self.replay(now, path_rule,
+                    extract_key(global_rule, record) if global_rule is not None else '',
+                    extract_key(path_rule, record) if path_rule is not None else '')
+
+    def admit(self, record: LogRecord) -> Optional[Tuple[int, Optional[RuleSpec]]]:
+        """
+        Accounts a record in the totals and decides whether it reaches the limits.
+
+        Args:
+            record: The log record.
+
+        Returns:
+            A (time in milliseconds, matched path rule or None) tuple, or None
+            if the record is whitelisted, blacklisted or matches no rule.
+        """
+        now = int(round(record.timestamp * 1000))
+        self.records += 1
+        if self.start is None:
+            self.start = self.end = now
+        elif now < self.start:
+            self.start = now
+        elif now > self.end:
+            self.end = now
+
+        if self.whitelist is not None and record.ip in self.whitelist:
+            self.whitelisted += 1
+            return None
+        if self.blacklist is not None and record.ip in self.blacklist:
+            self.blacklisted += 1
+            return None
+
+        try:
+            path_rule = self.routes[record.path]
+        except KeyError:
+            if len(self.routes) >= ROUTE_CACHE_SIZE:
+                self.routes.clear()
+            path_rule = self.routes[record.path] = self.router.lookup(record.path)
+        if path_rule is None and self.ruleset.global_rule is None:
+            self.unmatched += 1
+            return None
+        return now, path_rule
+
+    def replay(self, now: int, path_rule: Optional[RuleSpec], global_key: str, path_key: str) -> None:
+        """
+        Applies the limits to an admitted request.
+
+        Also advances the limiter clock, sweeping idle state every
+        SWEEP_INTERVAL_MS. Only state idle since before REORDER_WINDOW_MS is
+        swept, so records out of order by less than that are replayed as if
+        nothing had been swept; their decisions still follow log order, not
+        the arrival order the proxy saw.
+
+        Args:
+            now: The request time in milliseconds.
+            path_rule: The matched path rule, if any.
+            global_key: The global rule's key for the request (see extract_key).
+            path_key: The path rule's key for the request.
+        """
+        if self._next_sweep is None:
+            self._next_sweep = now + SWEEP_INTERVAL_MS
+        elif now >= self._next_sweep:
+            self.sweep(now - REORDER_WINDOW_MS)
+            self._next_sweep = now + SWEEP_INTERVAL_MS
+
+        global_rule = self.ruleset.global_rule
+        for model in self.models:
+            if model == NGINX_MODEL:
+                if path_rule is not None:
+                    self._apply(model, path_rule, path_key, now)
+                else:
+                    self._apply(model, global_rule, global_key, now)
+            elif global_rule is None or self._apply(model, global_rule, global_key, now):
+                if path_rule is not None:
+                    self._apply(model, path_rule, path_key, now)
+
+    def sweep(self, now: int) -> None:
+        """
+        Drops limiter state that can no longer influence a decision.
+
+        Args:
+            now: The earliest time of any request still to be replayed, in milliseconds.
+        """
+        for limits in self.limits.values():
+            for limit in limits.values():
+                limit.sweep(now)
+
+    def flush(self) -> None:
+        """
+        Replays buffered requests. Records are replayed as they are fed, so there are none.
+        """
+
+    def merge(self, other: 'Simulator') -> None:
+        """
+        Adds the totals and statistics of a simulator that replayed another
+        part of the same log, e.g. a key partition replayed in another process.
+
+        Args:
+            other: The other simulator, over the same Ruleset and models.
+        """
+        self.records += other.records
+        self.whitelisted += other.whitelisted
+        self.blacklisted += other.blacklisted
+        self.unmatched += other.unmatched
+        if other.start is not None:
+            self.start = other.start if self.start is None else min(self.start, other.start)
+            self.end = other.end if self.end is None else max(self.end, other.end)
+        for model, rules in other.stats.items():
+            for name, stats in rules.items():
+                self.stats[model][name].merge(stats)
+
+    def report(self, top: int = DEFAULT_TOP_KEYS) -> Dict[str, Any]:
+        """
+        Summarizes the replay.
+
+        Args:
+            top: Number of most limited keys listed per rule.
+
+        Returns:
+            A JSON-serializable report: totals, then per model and rule the
+            accepted/rejected/untracked counts, the seconds from the start of
+            the log to the first rejection, and the most limited keys.
+        """
+        report: Dict[str, Any] = {
+            'records': self.records,
+            'duration': (self.end - self.start) / 1000 if self.start is not None else 0.0,
+            'whitelisted': self.whitelisted,
+            'blacklisted': self.blacklisted,
+            'unmatched': self.unmatched,
+            'models': {},
+        }
+        for model, rules in self.stats.items():
+            report['models'][model] = {
+                name: {
+                    'accepted': stats.accepted,
+                    'rejected': stats.rejected,
+                    'untracked': stats.untracked,
+                    'first_reject': (stats.first_reject - self.start) / 1000 if stats.first_reject is not None else None,
+                    'top_keys': stats.top_keys.most_common(top),
+                }
+                for name, stats in rules.items()
+            }
+        return report
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Only the totals and statistics travel between processes; limiter
+        # state is specific to the keys a simulator replayed
+        state = self.__dict__.copy()
+        state['limits'] = {model: {} for model in self.limits}
+        state['routes'] = {}
+        return state
+
+    def _apply(self, model: str, rule: RuleSpec, key: str, now: int) -> bool:
+        """
+        Evaluates one rule for a request under one model and records the decision.
+
+        Returns:
+            True if the request passes the rule (or is not tracked by it), False if it is rejected.
+        """
+        stats = self.stats[model][rule.name]
+        if not key:
+            # Neither proxy accounts requests whose key is empty or missing
+            stats.untracked += 1
+            return True
+        if self.limits[model][rule.name].hit(key, now):
+            stats.accepted += 1
+            return True
+        stats.reject(key, now)
+        return False
+
+def extract_key(rule: RuleSpec, record: LogRecord) -> str:
+    """
+    Returns the value a rule limits by for a record.
+
+    Args:
+        rule: The compiled rule.
+        record: The log record.
+
+    Returns:
+        The client address, User-Agent or configured header value; empty if not logged.
+    """
+    if rule.limit_by == 'user_agent':
+        return record.user_agent
+    elif rule.limit_by == 'header_name':
+        return record.headers.get(rule.limit_by_header.lower(), '')
+    return record.ip
+
+def create_simulator(engine: str, ruleset: Ruleset, models: Iterable[str] = MODELS) -> Simulator:
+    """
+    Creates the simulator of a replay engine, importing its module on first use.
+
+    Args:
+        engine: A key of ENGINES (e.g., 'scalar').
+        ruleset: The compiled Ruleset.
+        models: The models to evaluate.
+
+    Returns:
+        The simulator.
+
+    Raises:
+        ImportError: If the engine's optional dependencies are missing.
+    """
+    module_name, class_name = ENGINES[engine]
+    return getattr(importlib.import_module(module_name), class_name)(ruleset, models)
+
+def simulate(ruleset: Ruleset, records: Iterable[LogRecord], models: Iterable[str] = MODELS,
+             top: int = DEFAULT_TOP_KEYS) -> Dict[str, Any]:
+    """
+    Replays a stream of records and returns the report (see Simulator.report).
+
+    Args:
+        ruleset: The compiled Ruleset.
+        records: The log records, in time order.
+        models: The models to evaluate.
+        top: Number of most limited keys listed per rule.
+
+    Returns:
+        The report.
+    """
+    simulator = Simulator(ruleset, models)
+    for record in records:
+        simulator.feed(record)
+    return simulator.report(top)
+
+def feed_all(simulators: List[Simulator], records: Iterable[LogRecord]) -> None:
+    """
+    Replays every record through several simulators, e.g. one per candidate
+    config, so the log is read and parsed only once for all of them.
+
+    Args:
+        simulators: The simulators.
+        records: The log records, in time order.
+    """
+    for record in records:
+        for simulator in simulators:
+            simulator.feed(record)
+
+def open_log(path: str) -> TextIO:
+    """
+    Opens an access log for streaming; '-' reads stdin and '.gz' files are decompressed.
+
+    Args:
+        path: The log path.
+
+    Returns:
+        A text stream.
+    """
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+def iter_log_records(lines: Iterable[str], log_format: str = 'auto') -> Iterator[LogRecord]:
+    """
+    Parses access log lines lazily.
+
+    Args:
+        lines: The log lines (e.g., an open file).
+        log_format: 'jsonl', 'combined', or 'auto' to detect it from the first non-empty line.
+
+    Yields:
+        The parsed records. Lines that cannot be parsed are skipped and
+        counted in a warning at the end.
+    """
+    parse = None if log_format == 'auto' else get_log_parser(log_format)
+    malformed = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        if parse is None:
+            parse = get_log_parser(detect_log_format(line))
+        record = parse(line)
+        if record is None:
+            malformed += 1
+            continue
+        yield record
+    if malformed:
+        logger.warning(f"Skipped {malformed} malformed log lines")
+
+def detect_log_format(line: str) -> str:
+    """
+    Detects the format of a log from one of its lines.
+
+    Returns:
+        'jsonl' for a JSON object, 'combined' otherwise.
+    """
+    return 'jsonl' if line.lstrip().startswith('{') else 'combined'
+
+def get_log_parser(log_format: str) -> Callable[[str], Optional[LogRecord]]:
+    """
+    Returns the line parser of a log format.
+
+    Args:
+        log_format: 'jsonl' or 'combined'.
+
+    Returns:
+        parse_jsonl_record or parse_combined_record.
+    """
+    return _PARSERS[log_format]
+
+def parse_jsonl_record(line: str) -> Optional[LogRecord]:
+    """
+    Parses one JSON log object.
+
+    The time may be epoch seconds (or milliseconds) or an ISO 8601 string;
+    the path may come from `path`, `uri`, `url` or a `request` line. Headers
+    are read from a `headers` object.
+
+    Args:
+        line: The JSON line.
+
+    Returns:
+        The record, or None if the line is not a usable log entry.
+    """
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(entry, dict):
+        return None
+
+    timestamp = _parse_time(_first_field(entry, TIME_FIELDS))
+    path = _first_field(entry, PATH_FIELDS)
+    if path is None and isinstance(entry.get('request'), str):
+        parts = entry['request'].split()
+        path = parts[1] if len(parts) > 1 else (parts[0] if parts else None)
+    if timestamp is None or not isinstance(path, str):
+        return None
+
+    headers = entry.get('headers')
+    headers = {str(name).lower(): str(value) for name, value in headers.items()} if isinstance(headers, dict) else {}
+    user_agent = _first_field(entry, USER_AGENT_FIELDS) or headers.get('user-agent', '')
+    return LogRecord(timestamp, str(_first_field(entry, IP_FIELDS) or ''), path.split('?', 1)[0],
+                     str(user_agent), headers)
+
+def parse_combined_record(line: str) -> Optional[LogRecord]:
+    """
+    Parses one line in Nginx/Apache "combined" (or "common") log format.
+
+    Args:
+        line: The log line.
+
+    Returns:
+        The record, or None if the line does not match the format.
+    """
+    match = COMBINED_PATTERN.match(line)
+    if not match:
+        return None
+    ip, time_local, target, user_agent = match.groups()
+    timestamp = _parse_time_local(time_local)
+    if timestamp is None:
+        return None
+    return LogRecord(timestamp, ip, target.split('?', 1)[0], user_agent or '')
+
+def format_report(report: Dict[str, Any]) -> Iterator[str]:
+    """
+    Renders a report as a plain-text table per model.
+
+    Args:
+        report: The report returned by Simulator.report.
+
+    Yields:
+        The report lines.
+    """
+    yield (f"Replayed {report['records']} requests over {report['duration']:.1f}s "
+           f"({report['whitelisted']} whitelisted, {report['blacklisted']} blacklisted, {report['unmatched']} without a rule)")
+    for model, rules in report['models'].items():
+        yield ''
+        yield f'[{model}]'
+        width = max([len('rule')] + [len(name) for name in rules])
+        yield f"{'rule':<{width}}  {'accepted':>10}  {'rejected':>10}  {'untracked':>10}  {'first reject':>12}"
+        for name, stats in rules.items():
+            first_reject = f"{stats['first_reject']:.1f}s" if stats['first_reject'] is not None else '-'
+            yield (f"{name:<{width}}  {stats['accepted']:>10}  {stats['rejected']:>10}  "
+                   f"{stats['untracked']:>10}  {first_reject:>12}")
+            if stats['top_keys']:
+                yield '  top limited keys: ' + ', '.join(f'{key} ({count})' for key, count in stats['top_keys'])
+
+def format_comparison(labels: List[str], reports: List[Dict[str, Any]]) -> Iterator[str]:
+    """
+    Renders the reports of several configs over the same log side by side.
+
+    Each model gets a table of rejected requests per rule, one column per
+    config; the columns after the first show the difference to the first
+    (baseline) config. Rules missing from a config are shown as '-'.
+
+    Args:
+        labels: A column label per config (e.g., its path).
+        reports: The report of each config (see Simulator.report), in the same order.
+
+    Yields:
+        The comparison lines.
+    """
+    baseline = reports[0]
+    yield f"Replayed {baseline['records']} requests over {baseline['duration']:.1f}s"
+    for label, report in zip(labels, reports):
+        yield (f"  {label}: {report['whitelisted']} whitelisted, {report['blacklisted']} blacklisted, "
+               f"{report['unmatched']} without a rule")
+
+    for model in baseline['models']:
+        names: List[str] = []
+        for report in reports:
+            names.extend(name for name in report['models'][model] if name not in names)
+        rows = [['rule'] + labels]
+        for name in names:
+            row = [name]
+            base = baseline['models'][model].get(name)
+            for index, report in enumerate(reports):
+                stats = report['models'][model].get(name)
+                if stats is None:
+                    row.append('-')
+                elif index and base is not None:
+                    row.append(f"{stats['rejected']} ({stats['rejected'] - base['rejected']:+d})")
+                else:
+                    row.append(str(stats['rejected']))
+            rows.append(row)
+
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        yield ''
+        yield f'[{model}] rejected requests'
+        for row in rows:
+            yield '  '.join([row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])])
+
+def _first_field(entry: Dict[str, Any], names: Tuple[str, ...]) -> Any:
+    """
+    Returns the first present, non-empty field among names.
+    """
+    for name in names:
+        value = entry.get(name)
+        if value not in (None, ''):
+            return value
+    return None
+
+def _parse_time(value: Any) -> Optional[float]:
+    """
+    Converts a JSONL time field to epoch seconds.
+
+    Args:
+        value: Epoch seconds or milliseconds, an ISO 8601 string, or a "combined" time_local string.
+
+    Returns:
+        The epoch seconds, or None if the value cannot be parsed.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Values this large are epoch milliseconds
+        return value / 1000 if value > 1e11 else float(value)
+    if not isinstance(value, str):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return _parse_time_local(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def _parse_time_local(value: str) -> Optional[float]:
+    """
+    Parses a "combined" log time such as '10/Oct/2000:13:55:36 -0700'.
+
+    Fixed-position slicing is used instead of strptime, which is far too
+    slow for multi-gigabyte logs.
+
+    Args:
+        value: The time string.
+
+    Returns:
+        The epoch seconds, or None if the value cannot be parsed.
+    """
+    try:
+        day, month, year = int(value[0:2]), MONTHS[value[3:6]], int(value[7:11])
+        hour, minute, second = int(value[12:14]), int(value[15:17]), int(value[18:20])
+        offset = value[21:26]
+        offset_seconds = (int(offset[1:3]) * 3600 + int(offset[3:5]) * 60) * (-1 if offset[0] == '-' else 1) if offset else 0
+    except (KeyError, ValueError, IndexError):
+        return None
+    return calendar.timegm((year, month, day, hour, minute, second)) - offset_seconds
+
+_PARSERS = {'jsonl': parse_jsonl_record, 'combined': parse_combined_record}
@@ -0,0 +1,326 @@
+# sketches.py
+import hashlib
+import heapq
+import logging
+import math
+import random
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+# Count-Min sketch dimensions: with width w and depth d, an estimate exceeds
+# the true count by more than e/w of the total with probability below e^-d
+DEFAULT_CMS_WIDTH = 1 << 15
+DEFAULT_CMS_DEPTH = 4
+
+# Keys kept by a heavy-hitter tracker
+DEFAULT_HEAVY_HITTERS = 100
+
+# HyperLogLog precision: 2^p registers, standard error about 1.04 / sqrt(2^p)
+DEFAULT_HLL_PRECISION = 12
+
+# KLL accuracy parameter: rank error around 1.7 / k, about 0.85% at 200
+DEFAULT_KLL_K = 200
+
+# Capacity ratio between successive KLL levels
+KLL_CAPACITY_RATIO = 2 / 3
+
+logger = logging.getLogger(__name__)
+
+def hash64(key: str) -> int:
+    """
+    Returns a stable 64-bit hash of a key, identical across processes and runs.
+
+    Args:
+        key: The key.
+
+    Returns:
+        The hash.
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+class CountMinSketch:
+    """
+    Approximate frequency table of fixed size.
+
+    Every key is counted in one cell per row, chosen by double hashing, and
+    its estimate is the smallest of those cells. Estimates never undercount.
+    Conservative updates only raise the cells that hold the minimum, which
+    keeps overestimates for rare keys much lower than plain increments.
+    """
+
+    __slots__ = ('width', 'depth', 'rows', 'total')
+
+    def __init__(self, width: int = DEFAULT_CMS_WIDTH, depth: int = DEFAULT_CMS_DEPTH):
+        """
+        Args:
+            width: Cells per row.
+            depth: Number of rows.
+        """
+        self.width = width
+        self.depth = depth
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+        self.total = 0
+
+    def add(self, key: str, count: int = 1, cells: Optional[List[int]] = None) -> int:
+        """
+        Counts a key.
+
+        Args:
+            key: The key.
+            count: The number of occurrences.
+            cells: The key's cells, if already computed (see cells).
+
+        Returns:
+            The key's new estimate.
+        """
+        if cells is None:
+            cells = self.cells(hash64(key))
+        estimate = min(row[cell] for row, cell in zip(self.rows, cells)) + count
+        for row, cell in zip(self.rows, cells):
+            if row[cell] < estimate:
+                row[cell] = estimate
+        self.total += count
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        """
+        Returns the estimated count of a key (never below the true count).
+        """
+        return min(row[cell] for row, cell in zip(self.rows, self.cells(hash64(key))))
+
+    def clear(self) -> None:
+        """
+        Resets every counter.
+        """
+        self.rows = [array('Q', bytes(8 * self.width)) for _ in range(self.depth)]
+        self.total = 0
+
+    def cells(self, value: int) -> List[int]:
+        """
+        Returns the cell of a key in each row. Sketches of equal dimensions
+        share them, so a key can be hashed once for several sketches.
+
+        Args:
+            value: The key's hash64.
+        """
+        first, second = value & 0xFFFFFFFF, (value >> 32) | 1
+        return [(first + row * second) % self.width for row in range(self.depth)]
+
+class HeavyHitters:
+    """
+    Tracks the most frequent keys of a stream in fixed memory.
+
+    Counts come from a CountMinSketch; the keys with the largest estimates
+    are kept in a min-heap of bounded size. A key enters the heap once its
+    estimate beats the smallest tracked one.
+    """
+
+    __slots__ = ('capacity', 'sketch', 'counts', '_heap')
+
+    def __init__(self, capacity: int = DEFAULT_HEAVY_HITTERS, width: int = DEFAULT_CMS_WIDTH,
+                 depth: int = DEFAULT_CMS_DEPTH):
+        """
+        Args:
+            capacity: Number of keys tracked.
+            width: Count-Min sketch width.
+            depth: Count-Min sketch depth.
+        """
+        self.capacity = capacity
+        self.sketch = CountMinSketch(width, depth)
+        self.counts: Dict[str, int] = {}
+        # (estimate, key) entries; an entry is stale when the key's count has grown since
+        self._heap: List[Tuple[int, str]] = []
+
+    def add(self, key: str, count: int = 1, cells: Optional[List[int]] = None) -> None:
+        """
+        Counts a key.
+
+        Args:
+            key: The key.
+            count: The number of occurrences.
+            cells: The key's sketch cells, if already computed (see CountMinSketch.cells).
+        """
+        estimate = self.sketch.add(key, count, cells)
+        counts = self.counts
+        if key in counts:
+            counts[key] = estimate
+            return
+        if len(counts) < self.capacity:
+            counts[key] = estimate
+            heapq.heappush(self._heap, (estimate, key))
+            return
+
+        heap = self._heap
+        # Refresh stale entries until the smallest one is accurate
+        while heap[0][0] != counts[heap[0][1]]:
+            _, stale = heapq.heappop(heap)
+            heapq.heappush(heap, (counts[stale], stale))
+        if estimate > heap[0][0]:
+            _, evicted = heapq.heapreplace(heap, (estimate, key))
+            del counts[evicted]
+            counts[key] = estimate
+
+    def most_common(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        Returns the tracked keys with the largest estimates, largest first.
+
+        Args:
+            n: Maximum number of keys; all tracked keys by default.
+        """
+        items = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return items if n is None else items[:n]
+
+    def clear(self) -> None:
+        """
+        Forgets every key and count.
+        """
+        self.sketch.clear()
+        self.counts = {}
+        self._heap = []
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct keys of a stream in fixed memory.
+
+    Each key's hash selects a register by its top bits and stores the
+    longest run of leading zeros seen in the remaining bits. The harmonic
+    mean of the registers yields the estimate; small counts fall back to
+    linear counting of empty registers. Sketches of equal precision merge by
+    taking the register-wise maximum.
+    """
+
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision: int = DEFAULT_HLL_PRECISION):
+        """
+        Args:
+            precision: Bits of the hash selecting a register (4 to 18).
+        """
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: int) -> None:
+        """
+        Counts a key.
+
+        Args:
+            value: The key's hash64.
+        """
+        bits = 64 - self.precision
+        index = value >> bits
+        rank = bits - (value & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        """
+        Adds the keys counted by another sketch of the same precision.
+        """
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        """
+        Returns the estimated number of distinct keys.
+        """
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(map(_INVERSE_POWERS.__getitem__, self.registers))
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * size and empty:
+            estimate = size * math.log(size / empty)
+        return int(round(estimate))
+
+    def clear(self) -> None:
+        """
+        Forgets every key.
+        """
+        self.registers = bytearray(len(self.registers))
+
+class KLLSketch:
+    """
+    Estimates the quantiles of a stream of numbers in fixed memory.
+
+    Values enter level 0; a full level is sorted and every other value, from
+    a random offset, moves up one level with twice the weight. Lower levels
+    have geometrically smaller capacities, so the sketch holds O(k) values
+    however long the stream. Sketches merge by concatenating their levels.
+    """
+
+    __slots__ = ('k', 'levels', 'count', '_random')
+
+    def __init__(self, k: int = DEFAULT_KLL_K, seed: int = 0):
+        """
+        Args:
+            k: Capacity of the top level; higher is more accurate.
+            seed: Seed of the compaction offsets, so reports are reproducible.
+        """
+        self.k = k
+        self.levels: List[List[float]] = [[]]
+        self.count = 0
+        self._random = random.Random(seed)
+
+    def add(self, value: float) -> None:
+        """
+        Counts a value.
+        """
+        level = self.levels[0]
+        level.append(value)
+        self.count += 1
+        if len(level) >= self._capacity(0):
+            self._compress()
+
+    def merge(self, other: 'KLLSketch') -> None:
+        """
+        Adds the values counted by another sketch.
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, values in zip(self.levels, other.levels):
+            level.extend(values)
+        self.count += other.count
+        self._compress()
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Returns the estimated q-quantile of the values counted.
+
+        Args:
+            q: The quantile, from 0 to 1 (e.g., 0.999).
+
+        Returns:
+            The smallest retained value whose estimated rank reaches q of the
+            count, or None if the sketch is empty.
+        """
+        items = sorted((value, 1 << height) for height, level in enumerate(self.levels) for value in level)
+        if not items:
+            return None
+        target = q * sum(weight for _, weight in items)
+        rank = 0
+        for value, weight in items:
+            rank += weight
+            if rank >= target:
+                return value
+        return items[-1][0]
+
+    def _capacity(self, height: int) -> int:
+        return max(2, int(math.ceil(self.k * KLL_CAPACITY_RATIO ** (len(self.levels) - height - 1))))
+
+    def _compress(self) -> None:
+        """
+        Compacts full levels, lowest first, until every level is within capacity.
+        """
+        height = 0
+        while height < len(self.levels):
+            level = self.levels[height]
+            if len(level) >= self._capacity(height):
+                if height + 1 == len(self.levels):
+                    self.levels.append([])
+                level.sort()
+                # An odd value out stays on this level
+                kept = [level.pop()] if len(level) % 2 else []
+                self.levels[height + 1].extend(level[self._random.getrandbits(1)::2])
+                self.levels[height] = kept
+            height += 1
+
+# 2^-rank for every register value
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
@@ -0,0 +1,299 @@
+# vector_simulator.py
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; only this engine needs it
+    np = None
+
+from ruleset import RuleSpec, Ruleset
+from simulator import DEFAULT_TOP_KEYS, HAPROXY_MODEL, MODELS, NGINX_MODEL, Simulator, TopKeys
+
+# Records buffered before a batch is replayed
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Once fewer keys than this are still active in a batch, their remaining
+# requests are replayed with the scalar limiters instead of one vectorized
+# step per request of the busiest key
+VECTOR_MIN_KEYS = 64
+
+# Per-key state columns, in the order the scalar limiters keep them
+STATE_FIELDS = {NGINX_MODEL: ('excess', 'last'), HAPROXY_MODEL: ('tick', 'curr', 'prev', 'last')}
+
+logger = logging.getLogger(__name__)
+
+class VectorSimulator(Simulator):
+    """
+    Simulator that replays records in NumPy batches.
+
+    Records are buffered as integer arrays (time, key id, rule id). For each
+    batch and rule, requests are stably sorted by key and replayed in
+    lockstep: step n applies the n-th request of every key at once, which is
+    safe because limiter state is independent per key. When few keys remain
+    active, the rest of the batch goes through the scalar limiters. Both
+    paths use the same integer arithmetic as Simulator, so reports are
+    identical to the scalar engine's.
+
+    Limiter state is kept in arrays indexed by key id for the whole replay,
+    so memory grows with the number of distinct keys rather than the keys
+    active within a window.
+    """
+
+    def __init__(self, ruleset: Ruleset, models: Iterable[str] = MODELS, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            ruleset: The compiled Ruleset.
+            models: The models to evaluate (see simulator.MODELS).
+            chunk_size: Number of records replayed per batch.
+
+        Raises:
+            ImportError: If NumPy is not installed.
+        """
+        if np is None:
+            raise ImportError('the vector replay engine requires NumPy (pip install numpy)')
+        super().__init__(ruleset, models)
+        self.chunk_size = chunk_size
+        self.path_index = {rule.name: index for index, rule in enumerate(ruleset.paths)}
+        self.key_ids: Dict[str, int] = {}
+        self.key_names: List[str] = []
+        # (model, rule name) -> (seen flags, state columns), indexed by key id
+        self.states: Dict[Tuple[str, str], Tuple['np.ndarray', 'np.ndarray']] = {}
+        self._times: List[int] = []
+        self._global_keys: List[int] = []
+        self._path_rules: List[int] = []
+        self._path_keys: List[int] = []
+
+    def replay(self, now: int, path_rule: Optional[RuleSpec], global_key: str, path_key: str) -> None:
+        """
+        Buffers one admitted request, replaying the batch once it is full
+        (see Simulator.replay).
+        """
+        self._times.append(now)
+        self._global_keys.append(self._key_id(global_key))
+        if path_rule is None:
+            self._path_rules.append(-1)
+            self._path_keys.append(-1)
+        else:
+            self._path_rules.append(self.path_index[path_rule.name])
+            self._path_keys.append(self._key_id(path_key))
+        if len(self._times) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Replays the buffered requests.
+        """
+        if not self._times:
+            return
+        times = np.array(self._times, dtype=np.int64)
+        global_keys = np.array(self._global_keys, dtype=np.int64)
+        path_rules = np.array(self._path_rules, dtype=np.int64)
+        path_keys = np.array(self._path_keys, dtype=np.int64)
+        self._times, self._global_keys, self._path_rules, self._path_keys = [], [], [], []
+
+        global_rule = self.ruleset.global_rule
+        for model in self.models:
+            if model == NGINX_MODEL:
+                # One rule per request: its path rule, otherwise the global rule
+                if global_rule is not None:
+                    selected = path_rules < 0
+                    self._replay(model, global_rule, times[selected], global_keys[selected])
+                for index, rule in enumerate(self.ruleset.paths):
+                    selected = path_rules == index
+                    self._replay(model, rule, times[selected], path_keys[selected])
+            else:
+                # The path rule only sees requests the global rule let through
+                passed = np.ones(len(times), dtype=bool)
+                if global_rule is not None:
+                    passed = self._replay(model, global_rule, times, global_keys)
+                for index, rule in enumerate(self.ruleset.paths):
+                    selected = (path_rules == index) & passed
+                    self._replay(model, rule, times[selected], path_keys[selected])
+
+    def report(self, top: int = DEFAULT_TOP_KEYS):
+        """
+        Replays the buffered records, then summarizes (see Simulator.report).
+        """
+        self.flush()
+        return super().report(top)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = super().__getstate__()
+        state.update(key_ids={}, key_names=[], states={}, _times=[], _global_keys=[], _path_rules=[], _path_keys=[])
+        return state
+
+    def _key_id(self, key: str) -> int:
+        """
+        Interns a key.
+
+        Returns:
+            The key id, or -1 for an empty (untracked) key.
+        """
+        if not key:
+            return -1
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            key_id = self.key_ids[key] = len(self.key_names)
+            self.key_names.append(key)
+        return key_id
+
+    def _state(self, model: str, rule: RuleSpec) -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        Returns the state arrays of a rule, grown to cover every interned key.
+        """
+        size = len(self.key_names)
+        state = self.states.get((model, rule.name))
+        if state is None or len(state[0]) < size:
+            capacity = max(size, 2 * len(state[0])) if state is not None else size
+            seen = np.zeros(capacity, dtype=bool)
+            values = np.zeros((capacity, len(STATE_FIELDS[model])), dtype=np.int64)
+            if state is not None:
+                seen[:len(state[0])] = state[0]
+                values[:len(state[0])] = state[1]
+            state = self.states[(model, rule.name)] = (seen, values)
+        return state
+
+    def _replay(self, model: str, rule: RuleSpec, times: 'np.ndarray', keys: 'np.ndarray') -> 'np.ndarray':
+        """
+        Replays a rule's requests of one batch and records the decisions.
+
+        Args:
+            model: The model.
+            rule: The rule.
+            times: Request times in milliseconds, in log order.
+            keys: Key ids of the requests (-1 for untracked).
+
+        Returns:
+            A mask of the requests that passed the rule (accepted or untracked).
+        """
+        stats = self.stats[model][rule.name]
+        passed = np.ones(len(times), dtype=bool)
+        tracked = keys >= 0
+        tracked_count = int(np.count_nonzero(tracked))
+        stats.untracked += len(times) - tracked_count
+        if not tracked_count:
+            return passed
+
+        times, keys = times[tracked], keys[tracked]
+        accepted = self._run(model, rule, times, keys)
+        passed[tracked] = accepted
+        accepted_count = int(np.count_nonzero(accepted))
+        stats.accepted += accepted_count
+        if accepted_count < len(times):
+            rejected = ~accepted
+            stats.rejected += len(times) - accepted_count
+            first_reject = int(times[rejected].min())
+            if stats.first_reject is None or first_reject < stats.first_reject:
+                stats.first_reject = first_reject
+            self._add_top_keys(stats.top_keys, keys[rejected])
+        return passed
+
+    def _run(self, model: str, rule: RuleSpec, times: 'np.ndarray', keys: 'np.ndarray') -> 'np.ndarray':
+        """
+        Computes the decisions of tracked requests, updating the rule's state.
+
+        Returns:
+            A mask of the accepted requests.
+        """
+        seen, values = self._state(model, rule)
+        limit = self.limits[model][rule.name]
+        step = self._nginx_step if model == NGINX_MODEL else self._haproxy_step
+
+        # Rank of every request among the requests of its key, in log order
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        ranks = np.arange(len(keys)) - np.repeat(starts, np.diff(np.append(starts, len(keys))))
+        by_rank = order[np.argsort(ranks, kind='stable')]
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(ranks))))
+
+        accepted = np.empty(len(keys), dtype=bool)
+        rank = 0
+        while rank < len(bounds) - 1 and bounds[rank + 1] - bounds[rank] >= VECTOR_MIN_KEYS:
+            batch = by_rank[bounds[rank]:bounds[rank + 1]]
+            accepted[batch] = step(limit, seen, values, keys[batch], times[batch])
+            rank += 1
+        if rank < len(bounds) - 1:
+            tail = np.sort(by_rank[bounds[rank]:])
+            accepted[tail] = self._scalar_tail(limit, seen, values, keys[tail], times[tail])
+        return accepted
+
+    @staticmethod
+    def _nginx_step(limit, seen: 'np.ndarray', values: 'np.ndarray', keys: 'np.ndarray',
+                    now: 'np.ndarray') -> 'np.ndarray':
+        """
+        Applies one request per key under NginxLimit semantics.
+        """
+        known = seen[keys]
+        excess, last = values[keys, 0], values[keys, 1]
+        # Past this many milliseconds any stored excess has fully drained;
+        # capping keeps the products within int64
+        drain_cap = (limit.burst + 1000) * 1000 // limit.rate + 1 if limit.rate else 0
+        elapsed = np.clip(now - last, 0, drain_cap)
+        excess = np.maximum(excess - limit.rate * elapsed // 1000 + 1000, 0)
+        excess[~known] = 0
+        accepted = ~known | (excess <= limit.burst)
+        updated = keys[accepted]
+        values[updated, 0] = excess[accepted]
+        # Time going backwards keeps the last time, as in NginxLimit.hit
+        values[updated, 1] = np.where(known & (now < last), last, now)[accepted]
+        seen[keys] = True
+        return accepted
+
+    @staticmethod
+    def _haproxy_step(limit, seen: 'np.ndarray', values: 'np.ndarray', keys: 'np.ndarray',
+                      now: 'np.ndarray') -> 'np.ndarray':
+        """
+        Applies one request per key under HAProxyLimit semantics.
+        """
+        period = limit.period
+        tick, curr, prev, last = (values[keys, column] for column in range(4))
+        reset = ~seen[keys] | (now - last >= period)
+        tick = np.where(reset, now, tick)
+        curr = np.where(reset, 0, curr)
+        prev = np.where(reset, 0, prev)
+        now = np.where(reset, now, np.maximum(now, last))
+
+        elapsed = now - tick
+        skipped = elapsed >= 2 * period
+        rotated = (elapsed >= period) & ~skipped
+        prev = np.where(skipped, 0, np.where(rotated, curr, prev))
+        tick = np.where(skipped, now, np.where(rotated, tick + period, tick))
+        curr = np.where(skipped | rotated, 0, curr) + 1
+
+        values[keys] = np.stack((tick, curr, prev, now), axis=1)
+        seen[keys] = True
+        return curr + prev * (period - (now - tick)) // period <= limit.limit
+
+    @staticmethod
+    def _scalar_tail(limit, seen: 'np.ndarray', values: 'np.ndarray', keys: 'np.ndarray',
+                     now: 'np.ndarray') -> 'np.ndarray':
+        """
+        Replays requests, in log order, with the scalar limiter of the rule.
+        """
+        states = limit.states
+        for key_id in np.unique(keys).tolist():
+            if seen[key_id]:
+                states[key_id] = values[key_id].tolist()
+        accepted = [limit.hit(key_id, time) for key_id, time in zip(keys.tolist(), now.tolist())]
+        for key_id, state in states.items():
+            values[key_id] = state
+            seen[key_id] = True
+        states.clear()
+        return np.array(accepted, dtype=bool)
+
+    def _add_top_keys(self, top_keys: TopKeys, rejected_keys: 'np.ndarray') -> None:
+        """
+        Counts rejected keys, in log order, exactly as the scalar engine would.
+        """
+        key_ids, counts = np.unique(rejected_keys, return_counts=True)
+        names = self.key_names
+        if len(top_keys.counts) + len(key_ids) <= 2 * top_keys.capacity:
+            # No pruning can happen within this batch, so the order does not matter
+            for key_id, count in zip(key_ids.tolist(), counts.tolist()):
+                name = names[key_id]
+                top_keys.counts[name] = top_keys.counts.get(name, 0) + count
+        else:
+            for key_id in rejected_keys.tolist():
+                top_keys.add(names[key_id])